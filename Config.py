@@ -54,6 +54,27 @@ class DataConfig(Config):
     DIR_NAME_NCDOT_DIVISIONS = "NCDOT_Division_Boundaries-shp"
     # Name of the shapefile containing the IMAP routes in the directory specified in DIR_NAME_NCDOT_DIVISIONS
     SHAPEFILE_NCDOT_DIVISIONS = "NCDOT_Division_Boundaries.shp"
+    # ------- Vintages (RunVintages.py) ---------
+    # AADT and AADTT fields in SHAPEFILE_AADT and Section Safety Scores window of each vintage processed in the batch
+    # mode. "field_gis_route" and "field_total_cnt" default to FIELD_GIS_ROUTE and FIELD_TOTAL_CNT.
+    VINTAGES = [
+        {
+            "name": "2018",
+            "field_aadt": "aadt_2018",
+            "field_aadtt": "aadtt2018",
+            "dir_safety_scores": "SectionScores_2015_2019",
+            "shapefile_safety": "SectionScores_2015_2019.shp",
+        },
+        # {
+        #     "name": "2020",
+        #     "field_aadt": "aadt_2020",
+        #     "field_aadtt": "aadtt_2020",
+        #     "dir_safety_scores": "SectionSafetyScores_2016_2020",
+        #     "shapefile_safety": "SectionSafetyScores_2016_2020.shp",
+        #     "field_gis_route": "gis_route",
+        #     "field_total_cnt": "crash_cnt",
+        # },
+    ]
 
 
 class DevConfig(Config):
@@ -64,19 +85,89 @@ class DevConfig(Config):
     DIR_NAME_PROCESSED = "2_processed"
     INPUT_DIR_DETOUR_TESTING = "detour_testing"
     INPUT_SHAPEFILE_DETOUR = "detour_work_ASG.shp"
+    # Format of the files passed between steps: "parquet" (GeoParquet, fast) or "gpkg". The extension of the
+    # INTERIM_GPKG_* and PROCESSED_* files passed between steps is set by this format. The final outputs are
+    # always written as GPKG/shapefile.
+    INTERIM_FORMAT = "parquet"
     INTERIM_GPKG_AADT = "ncdot_aadt_processed.gpkg"
     INTERIM_GPKG_SAFETY = "nc_crash_si_processed.gpkg"
     INTERIM_GPKG_AADT_SAFETY_MERGE = "aadt_crash_merge.gpkg"
     INTERIM_CSV_NHS_STC_ROUTES = "nhs_hpms_stc_routes.csv"  # "nhs_hpms_stc_routes.csv"
     INTERIM_CSV_AADT_BUT_NO_CRASH = "aadt_but_no_crash_route_set.csv"
+    INTERIM_JSON_PIPELINE_STATE = "pipeline_state.json"
+    INTERIM_PARQUET_CENSUS_TRACT_CACHE = "census_tract_assignment.parquet"
+    INTERIM_PARQUET_AADT_CRASH_CACHE = "aadt_crash_merge_cache.parquet"
+    INTERIM_DIR_RUN_REPORTS = "run_reports"
+    INTERIM_DIR_DIAGNOSTICS = "diagnostics"
+    INTERIM_DIR_REPROJECTION_CACHE = "reprojection_cache"
     PROCESSED_PADT_ON_INCIDENT_FACTOR = "padt_on_inc_fac_gis.gpkg"   # "padt_on_inc_fac_gis.gpkg"
     PROCESSED_CENSUS_GPD_GROWTH = "census_gpd_growth.gpkg"  # "census_gpd_growth.gpkg"
     PROCESSED_INCIDENT_FACTOR_SCALED = "inc_fac_si_scaled.gpkg"
     PROCESSED_DIR_MISSING_CRASHES = "missing_crashes"
     PROCESSED_SHAPEFILE_MISSING_CRASHES = "missing_crash.shp"
+    PROCESSED_PARQUET_VINTAGE_PANEL = "vintage_panel.parquet"
+    PROCESSED_PARQUET_VINTAGE_SEGMENTS = "vintage_segments.parquet"
     PROCESSED_GPKG_ALL_DATA_MERGE = "ncdot_processed_roadways.gpkg"  # "if_si_detour_nat_imp_census_padt.gpkg"
+    PROCESSED_NPZ_SEGMENT_INDEX = "segment_index.npz"
     FINAL_DIR_NAME = "output"
     FINAL_MERGE_SHAPEFILE = "ncdot_processed_roadways.shp"  # "if_si_detour_nat_imp_census_padt.shp"
+    FINAL_MBTILES_VECTOR_TILES = "ncdot_processed_roadways.mbtiles"
+    # Synthetic data and results of RunBenchmark.py (data/benchmark/<scale>_seed<seed> and data/benchmark/results)
+    DIR_NAME_BENCHMARK = "benchmark"
+    DIR_NAME_BENCHMARK_RESULTS = "results"
+    # ------- Processing ---------
+    # Number of worker processes for the AADT and crash data merge (1 runs in the main process)
+    N_WORKERS_AADT_CRASH_MERGE = 1
+    # Number of steps in RunModule.py that can run at the same time in separate processes (1 runs the steps in order)
+    N_WORKERS_PIPELINE = 1
+    # Number of worker processes that generate the vector tiles (1 runs in the main process)
+    N_WORKERS_VECTOR_TILES = 1
+    # Read and clean the Section Safety Scores in batches of this many rows in step 2, to bound the memory used
+    # (None reads the whole file at once)
+    BATCH_SIZE_SAFETY_SCORES = None
+    # Only merge the AADT and crash data of new or changed routes in step 3. The other routes are read from a cache
+    INCREMENTAL_AADT_CRASH_MERGE = True
+    # Save the geometry of the raw AADT, safety scores, PADT, and census tract data reprojected to EPSG:4326 in
+    # data/1_interim/reprojection_cache and reuse it while the raw files are unchanged
+    USE_REPROJECTION_CACHE = True
+    # Largest difference in miles between the AADT interval and detour, census growth, or PADT mileposts matched in the
+    # final merge (step 8)
+    MILEPOST_JOIN_TOLERANCE = 0.0005
+    # Join of the detour scores in step 8. "nearest": detour segment with the nearest BeginMp within
+    # DETOUR_JOIN_TOLERANCE miles of the AADT interval start. "backward": last detour segment starting at or before the
+    # interval start within DETOUR_JOIN_TOLERANCE miles. "overlap": mean of the scores of the detour segments on the
+    # interval, weighted by the length of the overlap (for detour segments that don't line up with the AADT intervals)
+    DETOUR_JOIN_METHOD = "nearest"
+    DETOUR_JOIN_TOLERANCE = 0.0005
+    # Check the census tract growth rates against the rates computed from the 2015 and 2040 flows in step 6
+    CHECK_CENSUS_GROWTH_RATE = False
+    # Data issues found by a step (e.g. overlapping AADT intervals) are saved in data/1_interim/diagnostics after the
+    # step. 0: only save them, 1: also print the number of issues, 2: also print the first issues of each type
+    DIAGNOSTICS_VERBOSITY = 1
+    # ------- Vector tiles (step 9) ---------
+    # Zoom levels of the vector tiles of the final output
+    VECTOR_TILE_MIN_ZOOM = 5
+    VECTOR_TILE_MAX_ZOOM = 12
+    # Geometry is simplified for each zoom level with a tolerance of this many tile pixels (1/4096 of the tile)
+    VECTOR_TILE_SIMPLIFY_PIXELS = 1.0
+    # ------- Local HTTP service (RunService.py) ---------
+    SERVICE_HOST = "127.0.0.1"
+    SERVICE_PORT = 8050
+    # Seconds between the checks for a new step 8 output, reloaded without stopping the service
+    SERVICE_RELOAD_INTERVAL = 10
+    # Number of query and map tile responses kept in the LRU cache
+    SERVICE_CACHE_SIZE = 4096
+    # Largest number of AADT intervals in a bbox or map tile response
+    SERVICE_MAX_FEATURES = 5000
+    # Weight of each score in the composite score used to rank the AADT intervals (/top query)
+    SERVICE_COMPOSITE_SCORE_WEIGHTS = {
+        "inc_fac": 1,
+        "si_fac": 1,
+        "detour_fac": 1,
+        "nat_imp_fac": 1,
+        "growth_fac": 1,
+        "seasonal_fac": 1,
+    }
 
 
 
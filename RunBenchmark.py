@@ -0,0 +1,18 @@
+import argparse
+from src.benchmark import run_benchmark, compare_benchmarks
+from src.synthetic_data import SCALES
+if __name__ == "__main__":
+    # ----------- Benchmark the processing steps on synthetic data
+    # - Synthetic raw data is generated in data/benchmark/<scale>_seed<seed>/0_raw the first time a scale is used
+    # - Results are saved in data/benchmark/results/<scale>_seed<seed>_<date>_<time>.json
+    # - Compare two runs with --compare baseline.json new.json
+    parser = argparse.ArgumentParser(description="Benchmark the processing steps on synthetic data.")
+    parser.add_argument("--scale", default="county", choices=list(SCALES), help="Size of the synthetic data.")
+    parser.add_argument("--repeat", type=int, default=3, help="Number of times to run each step.")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed of the synthetic data.")
+    parser.add_argument("--compare", nargs=2, metavar=("BASELINE_JSON", "NEW_JSON"), help="Compare two runs.")
+    args = parser.parse_args()
+    if args.compare:
+        compare_benchmarks(*args.compare)
+    else:
+        run_benchmark(scale=args.scale, n_repeat=args.repeat, seed=args.seed)
@@ -0,0 +1,13 @@
+import argparse
+from src.service import run_service
+from Config import DevConfig
+if __name__ == "__main__":
+    # ----------- Local HTTP service on the final output of RunModule.py
+    # - Answers segment scores by route and milepost, bbox and map tile queries, and the top segments by composite
+    #   score (see src/service.py for the queries)
+    # - Reloads the data when RunModule.py writes a new output
+    parser = argparse.ArgumentParser(description="Local HTTP service on the processed roadways.")
+    parser.add_argument("--host", default=DevConfig.SERVICE_HOST, help="Address of the service.")
+    parser.add_argument("--port", type=int, default=DevConfig.SERVICE_PORT, help="Port of the service.")
+    args = parser.parse_args()
+    run_service(host=args.host, port=args.port, reload_interval=DevConfig.SERVICE_RELOAD_INTERVAL)
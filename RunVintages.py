@@ -0,0 +1,10 @@
+from src.vintages import run_vintages
+from Config import DataConfig, DevConfig
+if __name__ == "__main__":
+    # ----------- Process several data vintages in one pass
+    # - The vintages (AADT fields and Section Safety Scores window) are set in DataConfig.VINTAGES
+    # - The AADT geometry and route IDs are processed once. Steps 3 (AADT and crash merge) and 7 (incident factor
+    #   scaling) are run for each vintage.
+    # - Results are saved in data/2_processed/vintage_panel.parquet with one row per vintage and AADT interval, and the
+    #   segment geometry in data/2_processed/vintage_segments.parquet (join on aadt_seg_id)
+    run_vintages(vintages=DataConfig.VINTAGES, n_workers=DevConfig.N_WORKERS_AADT_CRASH_MERGE)
@@ -0,0 +1,256 @@
+"""
+Benchmark the data processing steps on synthetic data (see src/synthetic_data.py). The results
+are saved as JSON in data/benchmark/results so that runs can be compared.
+"""
+import gc
+import json
+import os
+import platform
+import time
+from datetime import datetime
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+from src.utils import get_project_root, read_gdf, attach_geometry
+from src.synthetic_data import write_synthetic_raw_data
+from src.s1_aadt import clean_aadt
+from src.s2_crash import clean_crash
+from src.s3_aadt_crash_merge import (
+    merge_aadt_crash, bin_aadt_crash_statewide, bin_aadt_crash_by_route, get_crash_no_duplicates,
+    scale_crash_by_seg_len,
+)
+from src.s4_get_info_on_nhs_stc import get_strategic_trans_cor, get_route_nat_imp
+from src.s5_padt import clean_padt, join_padt_to_lrs
+from src.s6_census_growth_rate import get_census_tract_assignment, get_census_growth_on_lrs
+from src.s7_if_si_calc import get_incident_factor_scaled
+from src.s8_merge_all_data import merge_all_data
+from Config import DataConfig, DevConfig
+
+# bin_aadt_crash_by_route loops over the routes. It is skipped for larger data.
+MAX_ROUTES_BY_ROUTE_BINNING = 500
+
+
+def get_n_rows(result_):
+    """
+    Number of rows of a benchmark case result. Uses the first item of tuple and dict results.
+    """
+    if isinstance(result_, tuple):
+        result_ = result_[0]
+    elif isinstance(result_, dict):
+        result_ = next(iter(result_.values()))
+    return len(result_)
+
+
+def time_case(func, n_repeat, setup=None):
+    """
+    Time a benchmark case.
+    Parameters
+    ----------
+    func: callable
+        Benchmark case without arguments.
+    n_repeat: int
+        Number of times to run the case.
+    setup: callable
+        Run before each repeat and not timed.
+    Returns
+    -------
+    {"timing": timing, "result": result_} : dict
+        Times in seconds and number of output rows, and the result of the last repeat.
+    """
+    times = []
+    result_ = None
+    for _ in range(n_repeat):
+        if setup is not None:
+            setup()
+        gc.collect()
+        start_time = time.perf_counter()
+        result_ = func()
+        times.append(time.perf_counter() - start_time)
+    timing = {
+        "min_s": min(times),
+        "median_s": float(np.median(times)),
+        "times_s": times,
+        "n_rows": get_n_rows(result_),
+    }
+    return {"timing": timing, "result": result_}
+
+
+def get_benchmark_dir(scale, seed):
+    path_to_prj_dir = get_project_root()
+    return os.path.join(path_to_prj_dir, DevConfig.DIR_NAME_DATA, DevConfig.DIR_NAME_BENCHMARK, f"{scale}_seed{seed}")
+
+
+def run_benchmark(scale="county", n_repeat=3, seed=0):
+    """
+    Generate synthetic data for a scale (if not generated already) and time the steps of the
+    pipeline on it. Each step is run in memory on the output of the previous steps.
+    Parameters
+    ----------
+    scale: str
+        Key of src.synthetic_data.SCALES.
+    n_repeat: int
+        Number of times to run each step.
+    seed: int
+        Random seed of the synthetic data.
+    Returns
+    -------
+    path_result: str
+        Path to the JSON file with the results.
+    """
+    path_benchmark = get_benchmark_dir(scale, seed)
+    path_to_raw = os.path.join(path_benchmark, DevConfig.DIR_NAME_RAW)
+    path_interim_data = os.path.join(path_benchmark, DevConfig.DIR_NAME_INTERIM)
+    path_n_rows = os.path.join(path_benchmark, "n_rows.json")
+    if not os.path.isfile(path_n_rows):
+        print(f"Generating {scale} synthetic data in {path_benchmark}")
+        n_rows = write_synthetic_raw_data(path_to_raw, scale=scale, seed=seed)
+        with open(path_n_rows, "w") as file:
+            json.dump(n_rows, file, indent=2)
+    with open(path_n_rows) as file:
+        n_rows = json.load(file)
+    if not os.path.isdir(path_interim_data):
+        os.makedirs(path_interim_data)
+    aadt_file = os.path.join(path_to_raw, DataConfig.DIR_AADT_SEGMENTS, DataConfig.SHAPEFILE_AADT)
+    crash_file = os.path.join(path_to_raw, DataConfig.DIR_SAFETY_SCORES, DataConfig.SHAPEFILE_SAFETY)
+    path_hpms = os.path.join(path_to_raw, DataConfig.DIR_HPMS, DataConfig.SHAPEFILE_HPMS)
+    path_padt = os.path.join(path_to_raw, DataConfig.DIR_SEG_T3, DataConfig.SHAPEFILE_SEG_T3)
+    path_to_census = os.path.join(path_to_raw, DataConfig.DIR_CENSUS_TRACT)
+    path_to_census_shapefile = os.path.join(path_to_census, DataConfig.SHAPEFILE_CENSUS_TRACT)
+    path_growth_data = os.path.join(path_to_census, DataConfig.CSV_CENSUS_COMBINED_FLOW)
+    path_detour_data = os.path.join(path_to_raw, DevConfig.INPUT_DIR_DETOUR_TESTING, DevConfig.INPUT_SHAPEFILE_DETOUR)
+    path_cache = os.path.join(path_interim_data, DevConfig.INTERIM_PARQUET_CENSUS_TRACT_CACHE)
+    cases = {}
+
+    def run_case(case_name, func, setup=None):
+        print(f"Benchmark {case_name}")
+        case = time_case(func, n_repeat=n_repeat, setup=setup)
+        cases[case_name] = case["timing"]
+        print(f"    min {case['timing']['min_s']:.3f} s, median {case['timing']['median_s']:.3f} s, "
+              f"{case['timing']['n_rows']} rows")
+        return case["result"]
+
+    # Steps 1 and 2: read and clean the AADT and crash data.
+    aadt_gdf = run_case("clean_aadt", lambda: clean_aadt(aadt_file))
+    crash_si = run_case("clean_crash", lambda: clean_crash(crash_file))
+    aadt_geometry = aadt_gdf.set_index("aadt_seg_id").geometry
+    aadt_df = pd.DataFrame(aadt_gdf.drop(columns="geometry")).query("route_class in [1, 2, 3]")
+    crash_df = (
+        crash_si["crash_df_fil_si"].query("route_class in [1, 2, 3]").sort_values(["route_key", "st_mp_pt"])
+    )
+    # Step 3: merge the AADT and crash data.
+    aadt_crash_bin = run_case("bin_aadt_crash_statewide", lambda: bin_aadt_crash_statewide(aadt_df, crash_df))
+    if aadt_df.route_key.nunique() <= MAX_ROUTES_BY_ROUTE_BINNING:
+        run_case("bin_aadt_crash_by_route", lambda: bin_aadt_crash_by_route(aadt_df, crash_df))
+    crash_no_duplicates = get_crash_no_duplicates(aadt_crash_bin["crash_gdf_1"])
+    run_case("scale_crash_by_seg_len", lambda: scale_crash_by_seg_len(crash_no_duplicates))
+    aadt_crash_df, _ = run_case("merge_aadt_crash", lambda: merge_aadt_crash(aadt_df, crash_df))
+    aadt_crash_gdf = attach_geometry(aadt_crash_df, aadt_geometry, key="aadt_seg_id")
+    # Step 4: national importance of the routes.
+    hpms_nc = read_gdf(path_hpms)
+    stc_df = get_strategic_trans_cor().assign(stc=True)
+    aadt_nhs_stc_df = run_case(
+        "get_route_nat_imp", lambda: get_route_nat_imp(aadt_gdf_fil_=aadt_df, hpms_nc_=hpms_nc, stc_df_=stc_df)
+    )
+    # Step 5: PADT join.
+    route_id_lrs_gdf = aadt_crash_gdf.filter(
+        items=["route_id", "route_key", "aadt_interval_left", "aadt_interval_right", "route_class", "route_qual",
+               "route_no", "geometry"]
+    )
+    padt_gpd_raw = read_gdf(path_padt)
+    inc_fac_padt_gpd = run_case(
+        "padt_join", lambda: join_padt_to_lrs(route_id_lrs_gdf, clean_padt(padt_gpd_raw))
+    )
+    # Step 6: census tract join without and with the census tract cache.
+    route_id_lrs_gdf = route_id_lrs_gdf.filter(
+        items=["route_id", "route_key", "aadt_interval_left", "aadt_interval_right", "geometry"]
+    )
+
+    def remove_census_cache():
+        if os.path.isfile(path_cache):
+            os.remove(path_cache)
+
+    run_case(
+        "census_tract_join",
+        lambda: get_census_tract_assignment(route_id_lrs_gdf, path_to_census_shapefile, path_cache),
+        setup=remove_census_cache,
+    )
+    census_tract_assignment = run_case(
+        "census_tract_join_cached",
+        lambda: get_census_tract_assignment(route_id_lrs_gdf, path_to_census_shapefile, path_cache),
+    )
+    growth_df = pd.read_csv(path_growth_data).assign(GEOID10=lambda df: df.GEOID10.astype(str))
+    census_gpd_growth_lrs_grp = run_case(
+        "census_growth",
+        lambda: get_census_growth_on_lrs(route_id_lrs_gdf, census_tract_assignment, growth_df),
+    )
+    # Step 7: incident factor and severity index scaling.
+    inc_fac_si = run_case("incident_factor_scaling", lambda: get_incident_factor_scaled(aadt_crash_df))
+    inc_fac_si_gdf = attach_geometry(inc_fac_si["inc_fac_si"], aadt_geometry, key="aadt_seg_id")
+    # Step 8: final merge.
+    detour_df = read_gdf(path_detour_data)
+    run_case(
+        "merge_all_data",
+        lambda: merge_all_data(inc_fac_si_gdf, detour_df, aadt_nhs_stc_df, inc_fac_padt_gpd, census_gpd_growth_lrs_grp),
+    )
+
+    results = {
+        "scale": scale,
+        "seed": seed,
+        "n_repeat": n_repeat,
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "n_rows": n_rows,
+        "versions": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "pandas": pd.__version__,
+            "geopandas": gpd.__version__,
+            "shapely": shapely.__version__,
+        },
+        "machine": {"platform": platform.platform(), "processor": platform.processor(), "cpu_count": os.cpu_count()},
+        "cases": cases,
+    }
+    path_results = os.path.join(
+        get_project_root(), DevConfig.DIR_NAME_DATA, DevConfig.DIR_NAME_BENCHMARK, DevConfig.DIR_NAME_BENCHMARK_RESULTS
+    )
+    if not os.path.isdir(path_results):
+        os.makedirs(path_results)
+    path_result = os.path.join(
+        path_results, f"{scale}_seed{seed}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    )
+    with open(path_result, "w") as file:
+        json.dump(results, file, indent=2)
+    print(f"Benchmark results saved to {path_result}")
+    return path_result
+
+
+def compare_benchmarks(path_baseline, path_new):
+    """
+    Compare the minimum times of two benchmark runs.
+    Parameters
+    ----------
+    path_baseline: str
+        Path to the JSON results of the baseline run.
+    path_new: str
+        Path to the JSON results of the new run.
+    Returns
+    -------
+    comparison_df_: pd.DataFrame()
+        Minimum time of each case in both runs and the ratio of the new to the baseline time.
+    """
+    with open(path_baseline) as file:
+        baseline = json.load(file)
+    with open(path_new) as file:
+        new = json.load(file)
+    if (baseline["scale"], baseline["seed"]) != (new["scale"], new["seed"]):
+        print(f"Warning: comparing {baseline['scale']} (seed {baseline['seed']}) to "
+              f"{new['scale']} (seed {new['seed']}) data.")
+    comparison_df_ = (
+        pd.DataFrame({
+            "baseline_min_s": {case: timing["min_s"] for case, timing in baseline["cases"].items()},
+            "new_min_s": {case: timing["min_s"] for case, timing in new["cases"].items()},
+        })
+        .assign(ratio=lambda df: df.new_min_s / df.baseline_min_s)
+    )
+    print(comparison_df_.round(3).to_string())
+    return comparison_df_
@@ -0,0 +1,149 @@
+"""
+Collector of data issues found while processing (e.g. overlapping AADT intervals or routes
+without crash data). Issues are stored as compact records (issue code, route key, row index)
+and reported once after a step ends, instead of printing DataFrames inside the route loops.
+"""
+import os
+import numpy as np
+import pandas as pd
+from src.lrs import decode_route_id
+from Config import DevConfig
+
+# Issue codes.
+ISSUE_OVERLAPPING_AADT_INTERVAL = "overlapping_aadt_interval"
+ISSUE_NO_CRASH_DATA = "no_crash_data"
+ISSUE_ROUTE_NOT_IN_HPMS = "route_not_in_hpms"
+# Join issues of step 8, suffixed with the name of the side table (e.g. "unmatched_join_key_detour").
+ISSUE_UNMATCHED_JOIN_KEY = "unmatched_join_key"
+ISSUE_DUPLICATE_JOIN_KEY = "duplicate_join_key"
+# Rows of step 8 with a route ID that is missing or does not have 11 digits, suffixed with the name of the table.
+ISSUE_INVALID_ROUTE_ID = "invalid_route_id"
+# Row index of issues that apply to a whole route.
+ROUTE_ROW_IDX = -1
+# Route key of issues with a route ID that can't be encoded (ISSUE_INVALID_ROUTE_ID).
+INVALID_ROUTE_KEY = -1
+# Records of this process as lists of arrays, concatenated when the report is written.
+_diagnostics = {"issue": [], "route_key": [], "row_idx": []}
+
+
+def add_diagnostics(issue, route_key, row_idx=ROUTE_ROW_IDX):
+    """
+    Add records for an issue.
+    Parameters
+    ----------
+    issue: str
+        Issue code (ISSUE_*).
+    route_key: int or array-like
+        Route key of each record.
+    row_idx: int or array-like
+        Index of the row with the issue in the input table of the step, or ROUTE_ROW_IDX for
+        issues that apply to the whole route.
+    """
+    route_key = np.atleast_1d(np.asarray(route_key, dtype=np.int64))
+    if len(route_key) == 0:
+        return
+    _diagnostics["issue"].append(np.full(len(route_key), issue, dtype=object))
+    _diagnostics["route_key"].append(route_key)
+    _diagnostics["row_idx"].append(np.broadcast_to(np.asarray(row_idx, dtype=np.int64), route_key.shape))
+
+
+def get_diagnostics():
+    """
+    Get the records collected in this process.
+    Returns
+    -------
+    pd.DataFrame
+        One row per record with the columns "issue", "route_key", and "row_idx".
+    """
+    if len(_diagnostics["issue"]) == 0:
+        return pd.DataFrame({
+            "issue": pd.Series(dtype=object),
+            "route_key": pd.Series(dtype=np.int64),
+            "row_idx": pd.Series(dtype=np.int64),
+        })
+    return pd.DataFrame({col: np.concatenate(chunks) for col, chunks in _diagnostics.items()})
+
+
+def extend_diagnostics(diagnostics_df_):
+    """
+    Add records collected in another process (see run_with_diagnostics).
+    """
+    for issue, issue_df in diagnostics_df_.groupby("issue", sort=False):
+        add_diagnostics(issue, issue_df.route_key.values, issue_df.row_idx.values)
+
+
+def reset_diagnostics():
+    for chunks in _diagnostics.values():
+        chunks.clear()
+
+
+def run_with_diagnostics(func, *args):
+    """
+    Run a function in a worker process and return its result with the records it collected,
+    so that the records can be added to the main process with extend_diagnostics.
+    """
+    reset_diagnostics()
+    result_ = func(*args)
+    return result_, get_diagnostics()
+
+
+def get_diagnostics_route_id(route_key_):
+    """
+    Route ID of each record, missing for INVALID_ROUTE_KEY.
+    """
+    is_valid = route_key_ != INVALID_ROUTE_KEY
+    route_id_ = np.full(len(route_key_), None, dtype=object)
+    route_id_[is_valid] = decode_route_id(route_key_[is_valid])["route_id"]
+    return route_id_
+
+
+def write_diagnostics(path_diagnostics, stage_name, verbosity=DevConfig.DIAGNOSTICS_VERBOSITY, max_print=10):
+    """
+    Write the records collected during a step to <stage_name>_diagnostics.csv with one row per
+    record and <stage_name>_diagnostics_summary.csv with the number of records and routes for
+    each issue, and clear the records. If there are no records, the files of an earlier run
+    are removed.
+    Parameters
+    ----------
+    path_diagnostics: str
+        Directory of the diagnostics files.
+    stage_name: str
+        Name of the step.
+    verbosity: int
+        0: only write the files. 1: also print the summary. 2: also print the first
+        max_print records of each issue.
+    max_print: int
+        Number of records of each issue printed with verbosity 2.
+    Returns
+    -------
+    summary: dict
+        Number of records for each issue.
+    """
+    diagnostics_df = get_diagnostics()
+    reset_diagnostics()
+    diagnostics_file = os.path.join(path_diagnostics, f"{stage_name}_diagnostics.csv")
+    summary_file = os.path.join(path_diagnostics, f"{stage_name}_diagnostics_summary.csv")
+    if len(diagnostics_df) == 0:
+        for file in (diagnostics_file, summary_file):
+            if os.path.isfile(file):
+                os.remove(file)
+        return {}
+    diagnostics_df = (
+        diagnostics_df.sort_values(["issue", "route_key", "row_idx"], kind="mergesort")
+        .assign(route_id=lambda df: get_diagnostics_route_id(df.route_key.values))
+        .filter(items=["issue", "route_id", "route_key", "row_idx"])
+        .reset_index(drop=True)
+    )
+    summary_df = diagnostics_df.groupby("issue").agg(
+        n_records=("route_key", "size"), n_routes=("route_id", "nunique")
+    ).reset_index()
+    if not os.path.isdir(path_diagnostics):
+        os.makedirs(path_diagnostics)
+    diagnostics_df.to_csv(diagnostics_file, index=False)
+    summary_df.to_csv(summary_file, index=False)
+    if verbosity >= 1:
+        print(f"{stage_name} diagnostics (details in {path_diagnostics}):")
+        print(summary_df.to_string(index=False))
+    if verbosity >= 2:
+        print(diagnostics_df.groupby("issue").head(max_print).to_string(index=False))
+    return dict(zip(summary_df.issue, summary_df.n_records.astype(int)))
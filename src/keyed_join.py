@@ -0,0 +1,300 @@
+"""
+Join engine for the final merge (step 8). The join keys of the base table (AADT intervals) are
+sorted once, and each side table is aligned against them: side tables with a milepost key are
+matched on the route key and the nearest milepost within a tolerance, the other side tables on
+the route key only. The columns of all side tables are then gathered into the base table in one
+pass. Side rows that don't match a base row are reported as data issues instead of becoming
+missing values without notice.
+Side tables with milepost intervals that don't line up with the base intervals can instead be
+joined with the overlap-weighted mean of their values (see get_overlap_weighted_values).
+"""
+import numpy as np
+import pandas as pd
+from src.diagnostics import add_diagnostics, ISSUE_UNMATCHED_JOIN_KEY, ISSUE_DUPLICATE_JOIN_KEY
+from src.run_report import span
+from Config import DevConfig
+
+
+def get_join_index(base_df_, key="route_key", float_key="aadt_interval_left", float_end_key="aadt_interval_right"):
+    """
+    Get the join keys of the base table sorted by the milepost key.
+    Parameters
+    ----------
+    base_df_: pd.DataFrame()
+        Base table.
+    key: str
+        Integer route key column.
+    float_key: str
+        Float milepost key column.
+    float_end_key: str
+        Float end milepost column of the base intervals, used by the overlap-weighted join. Not
+        used if it is not in the base table.
+    Returns
+    -------
+    join_index_: dict
+        "key", "float_key", and "float_end_key": names of the key columns. "index_df": the key
+        columns and the position of each base row ("base_pos"), sorted by float_key. "key_set":
+        route keys of the base table.
+    """
+    index_df = (
+        pd.DataFrame({
+            key: base_df_[key].values,
+            float_key: base_df_[float_key].values.astype(np.float64),
+            "base_pos": np.arange(len(base_df_), dtype=np.int64),
+            **({float_end_key: base_df_[float_end_key].values.astype(np.float64)}
+               if float_end_key in base_df_.columns else {}),
+        })
+        .sort_values(float_key, kind="mergesort")
+        .reset_index(drop=True)
+    )
+    return {
+        "key": key,
+        "float_key": float_key,
+        "float_end_key": float_end_key,
+        "index_df": index_df,
+        "key_set": pd.Index(np.unique(base_df_[key].values)),
+    }
+
+
+def get_side_keys(side_df_, on, key, side_name):
+    """
+    Get the join keys of a side table with the position of each row ("side_pos"). Duplicated
+    keys are reported and only the first row is kept. Rows with a missing key are dropped.
+    Returns
+    -------
+    side_keys_: pd.DataFrame()
+        Join keys of the rows kept.
+    is_duplicated_: np.ndarray
+        True for the side rows with a duplicated key.
+    """
+    side_keys_ = pd.DataFrame({
+        col: side_df_[col].values.astype(np.int64 if col == key else np.float64) for col in on
+    }).assign(side_pos=np.arange(len(side_df_), dtype=np.int64))
+    is_duplicated_ = side_keys_.duplicated(on).values
+    add_diagnostics(
+        f"{ISSUE_DUPLICATE_JOIN_KEY}_{side_name}", side_keys_[key].values[is_duplicated_],
+        side_df_.index.values[is_duplicated_],
+    )
+    # Rows without a milepost can't be matched and are reported as unmatched.
+    side_keys_ = side_keys_.loc[~is_duplicated_ & ~side_keys_[on].isna().any(axis=1).values]
+    return side_keys_, is_duplicated_
+
+
+def report_unmatched_side_rows(join_index_, side_df_, side_name, is_matched, is_duplicated, n_base_matched):
+    """
+    Report the side rows on a route of the base table that are not matched to any base row.
+    """
+    key = join_index_["key"]
+    is_unmatched = ~is_matched & ~is_duplicated & side_keys_on_base_routes(join_index_, side_df_[key].values)
+    add_diagnostics(
+        f"{ISSUE_UNMATCHED_JOIN_KEY}_{side_name}", side_df_[key].values[is_unmatched],
+        side_df_.index.values[is_unmatched],
+    )
+    print(f"{side_name}: {n_base_matched} of {len(join_index_['index_df'])} rows matched. {is_unmatched.sum()} "
+          f"{side_name} rows on the same routes not matched, {is_duplicated.sum()} duplicated keys.")
+
+
+def align_side_table(join_index_, side_df_, side_name, tolerance=DevConfig.MILEPOST_JOIN_TOLERANCE,
+                     direction="nearest"):
+    """
+    Find the side row of each base row. Duplicated side keys are reported and the first row is
+    used. Side rows on a route of the base table that don't match any base row (e.g. a milepost
+    that differs by more than the tolerance) are reported.
+    Parameters
+    ----------
+    join_index_: dict
+        See get_join_index.
+    side_df_: pd.DataFrame()
+        Side table with the key column, and the float key column if it is joined on mileposts.
+    side_name: str
+        Name of the side table used in the issue codes and messages (e.g. "detour").
+    tolerance: float
+        Largest difference between the base and side mileposts of a match.
+    direction: str
+        "nearest": match the side row with the nearest milepost. "backward": match the last side
+        row with a milepost at or before the base milepost.
+    Returns
+    -------
+    side_pos_: np.ndarray
+        Position in side_df_ of the row matched to each base row (in the order of the base
+        table), -1 if there is no match.
+    """
+    key, float_key, index_df = join_index_["key"], join_index_["float_key"], join_index_["index_df"]
+    on = [key, float_key] if float_key in side_df_.columns else [key]
+    side_keys, is_duplicated = get_side_keys(side_df_, on, key, side_name)
+    with span("join") as join_span:
+        if float_key in on:
+            matched_pos = pd.merge_asof(
+                index_df,
+                side_keys.sort_values(float_key, kind="mergesort"),
+                on=float_key,
+                by=key,
+                direction=direction,
+                tolerance=tolerance,
+            ).side_pos.fillna(-1).values.astype(np.int64)
+        else:
+            matched_pos = pd.Index(side_keys[key].values).get_indexer(index_df[key].values)
+            matched_pos = np.where(matched_pos >= 0, side_keys.side_pos.values[matched_pos], -1)
+        side_pos_ = np.empty(len(index_df), dtype=np.int64)
+        side_pos_[index_df.base_pos.values] = matched_pos
+        join_span["rows_in"] = len(side_df_)
+    report_unmatched_side_rows(
+        join_index_, side_df_, side_name, np.isin(np.arange(len(side_df_)), side_pos_), is_duplicated,
+        np.sum(side_pos_ >= 0),
+    )
+    return side_pos_
+
+
+def get_overlap_weighted_values(join_index_, side_df_, side_name, value_cols, end_key):
+    """
+    Get the mean of the side values over each base interval, weighted by the length of the
+    overlap of the side and base intervals, for side intervals that don't line up with the base
+    intervals. The side intervals of each base interval are found with two sorted as-of
+    searches and expanded into (base row, side row) pairs without a loop over routes.
+    Parameters
+    ----------
+    join_index_: dict
+        See get_join_index. The base table must have the float_end_key column.
+    side_df_: pd.DataFrame()
+        Side table with the key, float key (start milepost), and end_key columns.
+    side_name: str
+        Name of the side table used in the issue codes and messages (e.g. "detour").
+    value_cols: list
+        Numeric side columns to average.
+    end_key: str
+        End milepost column of the side intervals. A missing end milepost is open ended.
+    Returns
+    -------
+    values_: dict
+        Overlap-weighted mean of each value column for each base row (in the order of the base
+        table), missing if no side interval with a value overlaps the base row.
+    """
+    key, float_key, float_end_key = join_index_["key"], join_index_["float_key"], join_index_["float_end_key"]
+    index_df = join_index_["index_df"]
+    side_keys, is_duplicated = get_side_keys(side_df_, [key, float_key], key, side_name)
+    with span("join") as join_span:
+        # Side intervals sorted by route and start milepost, with their sorted position.
+        side_keys = (
+            side_keys.assign(end=side_df_[end_key].values.astype(np.float64)[side_keys.side_pos.values])
+            .sort_values([key, float_key], kind="mergesort")
+            .assign(sorted_pos=lambda df: np.arange(len(df), dtype=np.int64))
+        )
+        side_route = side_keys[key].values
+        side_start = side_keys[float_key].values
+        side_end = np.nan_to_num(side_keys.end.values, nan=np.inf)
+        side_by_start = side_keys.sort_values(float_key, kind="mergesort")
+        # First side interval: the last one starting at or before the base start, or the first
+        # one of the route.
+        first_pos = pd.merge_asof(
+            index_df, side_by_start.filter(items=[key, float_key, "sorted_pos"]), on=float_key, by=key,
+            direction="backward",
+        ).sorted_pos.values
+        route_first_pos = np.searchsorted(side_route, index_df[key].values, side="left")
+        first_pos = np.where(np.isnan(first_pos), route_first_pos, first_pos).astype(np.int64)
+        # Last side interval: the last one starting before the base end.
+        index_by_end = index_df.sort_values(float_end_key, kind="mergesort")
+        last_pos = np.full(len(index_df), -1, dtype=np.int64)
+        last_pos_by_end = pd.merge_asof(
+            index_by_end.filter(items=[key, float_end_key]),
+            side_by_start.filter(items=[key, float_key, "sorted_pos"]),
+            left_on=float_end_key, right_on=float_key, by=key, direction="backward", allow_exact_matches=False,
+        ).sorted_pos.fillna(-1).values.astype(np.int64)
+        last_pos[index_by_end.index.values] = last_pos_by_end
+        # Expand to one (base row, side interval) pair for each candidate overlap.
+        n_pairs = np.maximum(last_pos - first_pos + 1, 0)
+        pair_base = np.repeat(np.arange(len(index_df)), n_pairs)
+        pair_side = (
+            np.repeat(first_pos, n_pairs) + np.arange(n_pairs.sum()) - np.repeat(np.cumsum(n_pairs) - n_pairs, n_pairs)
+        )
+        overlap = (
+            np.minimum(index_df[float_end_key].values[pair_base], side_end[pair_side])
+            - np.maximum(index_df[float_key].values[pair_base], side_start[pair_side])
+        )
+        is_overlap = overlap > 0
+        pair_base, pair_side, overlap = pair_base[is_overlap], pair_side[is_overlap], overlap[is_overlap]
+        base_pos = index_df.base_pos.values[pair_base]
+        side_pos = side_keys.side_pos.values[pair_side]
+        values_ = {}
+        for col in value_cols:
+            value = side_df_[col].values.astype(np.float64)[side_pos]
+            has_value = ~np.isnan(value)
+            weight_sum = np.bincount(base_pos, weights=overlap * has_value, minlength=len(index_df))
+            value_sum = np.bincount(base_pos, weights=np.where(has_value, value * overlap, 0), minlength=len(index_df))
+            with np.errstate(invalid="ignore", divide="ignore"):
+                values_[col] = np.where(weight_sum > 0, value_sum / weight_sum, np.nan)
+        join_span["rows_in"] = len(side_df_)
+    report_unmatched_side_rows(
+        join_index_, side_df_, side_name, np.isin(np.arange(len(side_df_)), side_pos), is_duplicated,
+        len(np.unique(base_pos)),
+    )
+    return values_
+
+
+def side_keys_on_base_routes(join_index_, side_key_):
+    """
+    Check which side rows are on a route of the base table.
+    """
+    return join_index_["key_set"].get_indexer(np.asarray(side_key_, dtype=np.int64)) >= 0
+
+
+def join_side_tables(base_df_, side_tables, key="route_key", float_key="aadt_interval_left",
+                     float_end_key="aadt_interval_right", tolerance=DevConfig.MILEPOST_JOIN_TOLERANCE,
+                     join_options=None):
+    """
+    Left join several side tables to the base table. The base table keys are sorted once and
+    the side columns are added in one pass, so the base table (and its geometry) is copied
+    once.
+    Parameters
+    ----------
+    base_df_: pd.DataFrame() or gpd.GeoDataFrame()
+        Base table.
+    side_tables: dict
+        Side table of each name. Side tables with the float_key column are joined on key and
+        float_key (within the tolerance), the others on key only. All other columns are added
+        to the base table and must not be in it or another side table.
+    key: str
+        Integer route key column.
+    float_key: str
+        Float milepost key column.
+    float_end_key: str
+        Float end milepost column of the base intervals (only used by the "overlap" method).
+    tolerance: float
+        Largest difference between the base and side mileposts of a match.
+    join_options: dict
+        Options of the side tables joined on mileposts, by name:
+        - "method": "nearest" (default) or "backward" (see align_side_table), or "overlap" (see
+          get_overlap_weighted_values).
+        - "tolerance": tolerance of the table, instead of tolerance.
+        - "end_key": end milepost column of the side intervals for the "overlap" method. It is
+          not added to the base table.
+    Returns
+    -------
+    pd.DataFrame() or gpd.GeoDataFrame()
+        Base table with the columns of the side tables. Values are missing for base rows
+        without a match, as with pd.merge(how="left").
+    """
+    join_options = {} if join_options is None else join_options
+    join_index = get_join_index(base_df_, key=key, float_key=float_key, float_end_key=float_end_key)
+    side_cols = {}
+    for side_name, side_df in side_tables.items():
+        side_options = join_options.get(side_name, {})
+        method = side_options.get("method", "nearest")
+        value_cols = side_df.columns.drop([key, float_key, side_options.get("end_key")], errors="ignore")
+        for col in value_cols:
+            if col in base_df_.columns or col in side_cols:
+                raise ValueError(f"Column {col} of the {side_name} table is already in the joined table.")
+        if method == "overlap":
+            side_cols.update(
+                get_overlap_weighted_values(join_index, side_df, side_name, value_cols, side_options["end_key"])
+            )
+        elif method in ("nearest", "backward"):
+            side_pos = align_side_table(
+                join_index, side_df, side_name, tolerance=side_options.get("tolerance", tolerance), direction=method
+            )
+            for col in value_cols:
+                # Missing rows (-1) are filled as in a left merge (ints become floats).
+                side_cols[col] = side_df[col].reset_index(drop=True).reindex(side_pos).values
+        else:
+            raise ValueError(f"Unknown join method {method} of the {side_name} table.")
+    with span("gather"):
+        return base_df_.assign(**side_cols)
@@ -0,0 +1,241 @@
+"""
+Linear referencing system (LRS) helpers for route-keyed and milepost-keyed tables.
+"""
+import numpy as np
+import pandas as pd
+
+# NCDOT route IDs have 11 digits: route class (1), route qualifier (1), route inventory (1),
+# route number (5), and county (3).
+ROUTE_ID_WIDTH = 11
+
+
+def parse_route_id(route_id_):
+    """
+    Read the 11 digits of NCDOT route IDs as int64 numbers and check them (see encode_route_id).
+    Returns
+    -------
+    route_key_: np.ndarray
+        int64 route key for each route ID, not meaningful where the route ID is not valid.
+    is_valid: np.ndarray
+        Whether each route ID has 11 digits. Missing route IDs are not valid.
+    """
+    route_id_ = np.asarray(route_id_)
+    if np.issubdtype(route_id_.dtype, np.number):
+        is_valid = np.isfinite(route_id_)
+        route_key_ = np.where(is_valid, route_id_, 0).astype(np.int64)
+        is_valid &= (route_key_ >= 10 ** (ROUTE_ID_WIDTH - 1)) & (route_key_ < 10 ** ROUTE_ID_WIDTH)
+    else:
+        # Parse all route IDs at once from a fixed-width ASCII buffer with one row per route
+        # ID. The byte after the 11 digits must be the end of the string or the start of a
+        # decimal part.
+        id_bytes = np.frombuffer(
+            route_id_.astype(str).astype(f"S{ROUTE_ID_WIDTH + 1}").tobytes(), dtype=np.uint8
+        ).reshape(-1, ROUTE_ID_WIDTH + 1)
+        digits = id_bytes[:, :ROUTE_ID_WIDTH].astype(np.int64) - ord("0")
+        is_valid = ((digits >= 0) & (digits <= 9)).all(axis=1) & np.isin(
+            id_bytes[:, ROUTE_ID_WIDTH], [0, ord(".")]
+        )
+        route_key_ = digits @ (10 ** np.arange(ROUTE_ID_WIDTH - 1, -1, -1, dtype=np.int64))
+    return route_key_, is_valid
+
+
+def is_valid_route_id(route_id_):
+    """
+    Check which route IDs have 11 digits and can be encoded with encode_route_id.
+    """
+    return parse_route_id(route_id_)[1]
+
+
+def encode_route_id(route_id_):
+    """
+    Pack NCDOT route IDs into int64 route keys. The 11 route ID digits are read as one
+    number, so the route keys sort in the same order as the route ID strings and can be
+    used for joins and groupbys instead of the strings.
+    Parameters
+    ----------
+    route_id_: array-like
+        Route IDs as strings (e.g. "20000001080" or "20000001080.0") or numbers.
+    Returns
+    -------
+    route_key_: np.ndarray
+        int64 route key for each route ID.
+    Raises
+    -------
+    ValueError
+        If a route ID does not have 11 digits.
+    """
+    route_key_, is_valid = parse_route_id(route_id_)
+    if not is_valid.all():
+        raise ValueError(
+            f"Route IDs must have {ROUTE_ID_WIDTH} digits: {pd.unique(np.asarray(route_id_)[~is_valid])[:10]}"
+        )
+    return route_key_
+
+
+def decode_route_id(route_id_):
+    """
+    Parse NCDOT route IDs into the route key and the route ID parts.
+    Parameters
+    ----------
+    route_id_: array-like
+        Route IDs as strings or numbers (see encode_route_id).
+    Returns
+    -------
+    {
+        "route_id": route_id,
+        "route_key": route_key,
+        "route_class": route_class,
+        "route_qual": route_qual,
+        "route_inventory": route_inventory,
+        "route_no": route_no,
+        "route_county": route_county,
+    } : dict
+        route_id: 11 character route ID string, kept for the outputs.
+        route_key: int64 route key used for joins and groupbys.
+        route_class, route_qual, route_inventory, route_no, route_county: int64 route ID
+        parts.
+    """
+    route_key = encode_route_id(route_id_)
+    return {
+        "route_id": route_key.astype(str).astype(object),
+        "route_key": route_key,
+        "route_class": route_key // 10 ** 10,
+        "route_qual": route_key // 10 ** 9 % 10,
+        "route_inventory": route_key // 10 ** 8 % 10,
+        "route_no": route_key // 10 ** 3 % 10 ** 5,
+        "route_county": route_key % 10 ** 3,
+    }
+
+
+def _count_before(query_code, query_val, ref_code, ref_val, inclusive):
+    """
+    Sweep-line count of the reference points that come before each query point.
+
+    Parameters
+    ----------
+    query_code: np.ndarray
+        Integer group code of each query point.
+    query_val: np.ndarray
+        Milepost of each query point.
+    ref_code: np.ndarray
+        Integer group code of each reference point. Must be sorted together with ref_val.
+    ref_val: np.ndarray
+        Milepost of each reference point. Sorted within each group.
+    inclusive: bool
+        True, count reference points with a milepost equal to the query milepost as before
+        the query point.
+    Returns
+    -------
+    np.ndarray
+        For each query point, the number of reference points with a smaller group code or
+        with the same group code and a smaller (or equal if inclusive) milepost. This is the
+        position of the query point in the sorted reference arrays.
+    """
+    n_query = len(query_val)
+    # Event type breaks ties at equal mileposts: 0 sorts before 1.
+    ref_type, query_type = (0, 1) if inclusive else (1, 0)
+    codes = np.concatenate([query_code, ref_code])
+    vals = np.concatenate([query_val, ref_val])
+    types = np.concatenate(
+        [np.full(n_query, query_type, dtype=np.int8), np.full(len(ref_val), ref_type, dtype=np.int8)]
+    )
+    order = np.lexsort((types, vals, codes))
+    is_ref = order >= n_query
+    refs_before = np.cumsum(is_ref) - is_ref
+    count_ = np.empty(n_query, dtype=np.int64)
+    count_[order[~is_ref]] = refs_before[~is_ref]
+    return count_
+
+
+def interval_join(
+    left_start, left_end, right_start, right_end, left_key=None, right_key=None, how="inner"
+):
+    """
+    Find all overlapping pairs between two sets of left-closed milepost intervals,
+    [start, end), in one vectorized pass. Intervals overlap when each one starts before
+    the other one ends; this matches pd.Interval.overlaps for closed="left" intervals.
+    Parameters
+    ----------
+    left_start, left_end: array-like
+        Start and end mileposts of the left intervals (e.g. crash segments).
+    right_start, right_end: array-like
+        Start and end mileposts of the right intervals (e.g. AADT bins).
+    left_key, right_key: array-like, optional
+        Route identifier of each left and right interval. Only intervals with the same key
+        are joined. If not provided, all intervals are on the same route.
+    how: str
+        "inner" returns overlapping pairs only. "left" also returns one row for each left
+        interval without any overlap, with right_idx set to -1 and NaN overlap bounds.
+    Returns
+    -------
+    pairs_: pd.DataFrame
+        One row per overlapping pair with the columns left_idx and right_idx (positions in
+        the input arrays), overlap_start, and overlap_end. Rows are sorted by left_idx and
+        then by the start milepost of the right interval.
+    """
+    if how not in ("inner", "left"):
+        raise ValueError(f'how must be "inner" or "left", not "{how}".')
+    left_start = np.asarray(left_start, dtype=np.float64)
+    left_end = np.asarray(left_end, dtype=np.float64)
+    right_start = np.asarray(right_start, dtype=np.float64)
+    right_end = np.asarray(right_end, dtype=np.float64)
+    n_left, n_right = len(left_start), len(right_start)
+    if (left_key is None) != (right_key is None):
+        raise ValueError("Provide both left_key and right_key or neither.")
+    if left_key is None:
+        left_code = np.zeros(n_left, dtype=np.int64)
+        right_code = np.zeros(n_right, dtype=np.int64)
+    else:
+        codes, _ = pd.factorize(np.concatenate([np.asarray(left_key), np.asarray(right_key)]))
+        left_code, right_code = codes[:n_left], codes[n_left:]
+
+    # Sort the right intervals by route and start milepost. The running maximum of the end
+    # milepost within a route is non-decreasing, so right intervals that end before a left
+    # interval starts form a prefix of each route that can be skipped with a sweep.
+    right_order = np.lexsort((right_start, right_code))
+    right_code_s = right_code[right_order]
+    right_start_s = right_start[right_order]
+    right_end_s = right_end[right_order]
+    right_end_cummax = (
+        pd.Series(right_end_s).groupby(right_code_s).cummax().to_numpy()
+        if n_right else right_end_s
+    )
+    # First candidate: right intervals in the route whose running max end is > left start.
+    lo = _count_before(left_code, left_start, right_code_s, right_end_cummax, inclusive=True)
+    # One past the last candidate: right intervals in the route with start < left end.
+    hi = _count_before(left_code, left_end, right_code_s, right_start_s, inclusive=False)
+    n_cand = np.clip(hi - lo, 0, None)
+
+    left_idx = np.repeat(np.arange(n_left), n_cand)
+    offset = np.arange(n_cand.sum()) - np.repeat(np.cumsum(n_cand) - n_cand, n_cand)
+    right_pos = np.repeat(lo, n_cand) + offset
+    # Candidates with an earlier end than the running max still need to be checked when the
+    # right intervals overlap each other.
+    keep = right_end_s[right_pos] > left_start[left_idx]
+    left_idx, right_pos = left_idx[keep], right_pos[keep]
+    right_idx = right_order[right_pos]
+    pairs_ = pd.DataFrame(
+        {
+            "left_idx": left_idx,
+            "right_idx": right_idx,
+            "overlap_start": np.maximum(left_start[left_idx], right_start[right_idx]),
+            "overlap_end": np.minimum(left_end[left_idx], right_end[right_idx]),
+        }
+    )
+    if how == "left":
+        no_match_idx = np.setdiff1d(np.arange(n_left), left_idx)
+        if len(no_match_idx):
+            no_match = pd.DataFrame(
+                {
+                    "left_idx": no_match_idx,
+                    "right_idx": -1,
+                    "overlap_start": np.nan,
+                    "overlap_end": np.nan,
+                }
+            )
+            pairs_ = (
+                pd.concat([pairs_, no_match], ignore_index=True)
+                .sort_values("left_idx", kind="mergesort")
+                .reset_index(drop=True)
+            )
+    return pairs_
@@ -0,0 +1,381 @@
+"""
+Incremental runner for the data processing steps. Each step is skipped if its input files
+and code have not changed since the last run and its output files are still in place.
+"""
+import hashlib
+import inspect
+import json
+import os
+import re
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from datetime import datetime
+from src.utils import get_project_root, get_interim_file, get_dataset_files, get_file_fingerprint
+from src.run_report import run_with_report, format_run_report, write_run_report
+from src.diagnostics import reset_diagnostics, write_diagnostics
+from src.s1_aadt import run_aadt_init_process
+from src.s2_crash import run_safety_init_process
+from src.s3_aadt_crash_merge import run_aadt_crash_merge
+from src.s4_get_info_on_nhs_stc import run_get_info_on_nhs_stc
+from src.s5_padt import run_padt_processing
+from src.s6_census_growth_rate import run_process_census_data
+from src.s7_if_si_calc import run_process_incident_factor
+from src.s8_merge_all_data import run_merge_all_data
+from src.s9_vector_tiles import run_vector_tiles
+from Config import DataConfig, DevConfig
+
+# Settings read in the source code of a step (e.g. DevConfig.INTERIM_FORMAT).
+CONFIG_SETTING_PATTERN = re.compile(r"\b(DataConfig|DevConfig)\.([A-Za-z_][A-Za-z0-9_]*)")
+
+
+def get_pipeline_stages():
+    """
+    Get the data processing steps with the input and output files of each step.
+    Returns
+    -------
+    stages_: list
+        List of dict with the step name ("name"), the function that runs the step ("func"),
+        and the paths to the input ("inputs") and output ("outputs") files. Steps are in
+        execution order.
+    """
+    path_to_prj_dir = get_project_root()
+    path_to_raw = os.path.join(path_to_prj_dir, DevConfig.DIR_NAME_DATA, DevConfig.DIR_NAME_RAW)
+    path_interim_data = os.path.join(path_to_prj_dir, DevConfig.DIR_NAME_DATA, DevConfig.DIR_NAME_INTERIM)
+    path_processed_data = os.path.join(path_to_prj_dir, DevConfig.DIR_NAME_DATA, DevConfig.DIR_NAME_PROCESSED)
+    path_census = os.path.join(path_to_raw, DataConfig.DIR_CENSUS_TRACT)
+
+    raw_aadt = os.path.join(path_to_raw, DataConfig.DIR_AADT_SEGMENTS, DataConfig.SHAPEFILE_AADT)
+    raw_safety = os.path.join(path_to_raw, DataConfig.DIR_SAFETY_SCORES, DataConfig.SHAPEFILE_SAFETY)
+    raw_hpms = os.path.join(path_to_raw, DataConfig.DIR_HPMS, DataConfig.SHAPEFILE_HPMS)
+    raw_seg_t3 = os.path.join(path_to_raw, DataConfig.DIR_SEG_T3, DataConfig.SHAPEFILE_SEG_T3)
+    raw_census = os.path.join(path_census, DataConfig.SHAPEFILE_CENSUS_TRACT)
+    raw_growth = os.path.join(path_census, DataConfig.CSV_CENSUS_COMBINED_FLOW)
+    raw_detour = os.path.join(path_to_raw, DevConfig.INPUT_DIR_DETOUR_TESTING, DevConfig.INPUT_SHAPEFILE_DETOUR)
+    interim_aadt = get_interim_file(os.path.join(path_interim_data, DevConfig.INTERIM_GPKG_AADT))
+    interim_safety = get_interim_file(os.path.join(path_interim_data, DevConfig.INTERIM_GPKG_SAFETY))
+    interim_aadt_safety = get_interim_file(os.path.join(path_interim_data, DevConfig.INTERIM_GPKG_AADT_SAFETY_MERGE))
+    interim_nhs_stc = os.path.join(path_interim_data, DevConfig.INTERIM_CSV_NHS_STC_ROUTES)
+    interim_no_crash = os.path.join(path_interim_data, DevConfig.INTERIM_CSV_AADT_BUT_NO_CRASH)
+    processed_padt = get_interim_file(os.path.join(path_processed_data, DevConfig.PROCESSED_PADT_ON_INCIDENT_FACTOR))
+    processed_census = get_interim_file(os.path.join(path_processed_data, DevConfig.PROCESSED_CENSUS_GPD_GROWTH))
+    processed_inc_fac = get_interim_file(os.path.join(path_processed_data, DevConfig.PROCESSED_INCIDENT_FACTOR_SCALED))
+    processed_missing_crash = os.path.join(
+        path_processed_data, DevConfig.PROCESSED_DIR_MISSING_CRASHES, DevConfig.PROCESSED_SHAPEFILE_MISSING_CRASHES
+    )
+    processed_all_data = os.path.join(path_processed_data, DevConfig.PROCESSED_GPKG_ALL_DATA_MERGE)
+    processed_segment_index = os.path.join(path_processed_data, DevConfig.PROCESSED_NPZ_SEGMENT_INDEX)
+    final_shp = os.path.join(path_to_prj_dir, DevConfig.FINAL_DIR_NAME, DevConfig.FINAL_MERGE_SHAPEFILE)
+    final_mbtiles = os.path.join(path_to_prj_dir, DevConfig.FINAL_DIR_NAME, DevConfig.FINAL_MBTILES_VECTOR_TILES)
+
+    stages_ = [
+        {
+            "name": "s1_aadt",
+            "func": run_aadt_init_process,
+            "inputs": [raw_aadt],
+            "outputs": [interim_aadt],
+        },
+        {
+            "name": "s2_crash",
+            "func": run_safety_init_process,
+            "inputs": [raw_safety],
+            "outputs": [interim_safety],
+        },
+        {
+            "name": "s3_aadt_crash_merge",
+            "func": run_aadt_crash_merge,
+            "inputs": [interim_aadt, interim_safety],
+            "outputs": [interim_aadt_safety],
+        },
+        {
+            "name": "s4_get_info_on_nhs_stc",
+            "func": run_get_info_on_nhs_stc,
+            "inputs": [raw_hpms, interim_aadt],
+            "outputs": [interim_nhs_stc],
+        },
+        {
+            "name": "s5_padt",
+            "func": run_padt_processing,
+            "inputs": [interim_aadt_safety, raw_seg_t3],
+            "outputs": [processed_padt],
+        },
+        {
+            "name": "s6_census_growth_rate",
+            "func": run_process_census_data,
+            "inputs": [interim_aadt_safety, raw_census, raw_growth],
+            "outputs": [processed_census],
+        },
+        {
+            "name": "s7_if_si_calc",
+            "func": run_process_incident_factor,
+            "inputs": [interim_aadt_safety],
+            "outputs": [processed_inc_fac, interim_no_crash, processed_missing_crash],
+        },
+        {
+            "name": "s8_merge_all_data",
+            "func": run_merge_all_data,
+            "inputs": [processed_inc_fac, raw_detour, interim_nhs_stc, processed_padt, processed_census],
+            "outputs": [processed_all_data, final_shp, processed_segment_index],
+        },
+        {
+            "name": "s9_vector_tiles",
+            "func": run_vector_tiles,
+            "inputs": [processed_all_data],
+            "outputs": [final_mbtiles],
+        },
+    ]
+    return stages_
+
+
+def get_fingerprints(paths, prev_fingerprints_=None):
+    """
+    Fingerprint all files of the datasets in paths. Returns a dict keyed by file path.
+    Datasets without any files are keyed by the dataset path with a None fingerprint.
+    """
+    prev_fingerprints_ = prev_fingerprints_ or {}
+    fingerprints_ = {}
+    for path in paths:
+        files = get_dataset_files(path)
+        if len(files) == 0:
+            fingerprints_[path] = None
+        for file in files:
+            fingerprints_[file] = get_file_fingerprint(file, prev_fingerprints_.get(file))
+    return fingerprints_
+
+
+def get_project_modules(module):
+    """
+    Get the project modules (src.*) that a module uses, directly or through the project modules
+    it imports from, with the module itself. Returns a dict keyed by module name.
+    """
+    modules_ = {module.__name__: module}
+    to_visit = [module]
+    while to_visit:
+        for obj in vars(to_visit.pop()).values():
+            obj_module = obj if inspect.ismodule(obj) else sys.modules.get(getattr(obj, "__module__", None) or "")
+            if (
+                obj_module is not None and obj_module.__name__.startswith("src.")
+                and obj_module.__name__ not in modules_
+            ):
+                modules_[obj_module.__name__] = obj_module
+                to_visit.append(obj_module)
+    return modules_
+
+
+def get_config_values(sources):
+    """
+    Get the values of the DataConfig and DevConfig settings that are read in the source code.
+    Returns a dict keyed by setting name (e.g. "DevConfig.INTERIM_FORMAT").
+    """
+    config_classes = {"DataConfig": DataConfig, "DevConfig": DevConfig}
+    names = sorted({
+        (class_name, attr) for source in sources for class_name, attr in CONFIG_SETTING_PATTERN.findall(source)
+    })
+    return {
+        f"{class_name}.{attr}": getattr(config_classes[class_name], attr, None) for class_name, attr in names
+    }
+
+
+def get_code_version(func):
+    """
+    Hash the source code of the module with the step function and of the project modules that it
+    uses (see get_project_modules), with the values of the settings in Config that this code
+    reads, so changes to other settings don't run the step again.
+    """
+    modules = get_project_modules(sys.modules[func.__module__])
+    sources = {}
+    for module_name, module in modules.items():
+        with open(inspect.getsourcefile(module)) as f:
+            sources[module_name] = f.read()
+    code_hash = hashlib.sha256()
+    for module_name in sorted(sources):
+        code_hash.update(module_name.encode())
+        code_hash.update(sources[module_name].encode())
+    code_hash.update(json.dumps(get_config_values(sources.values()), sort_keys=True, default=str).encode())
+    return code_hash.hexdigest()
+
+
+def is_stage_current(stage_state_, input_fingerprints_, output_fingerprints_, code_version_):
+    """
+    Check if a step can be skipped: the code and input files are the same as in the last
+    run and the output files from the last run have not been changed or removed.
+    """
+    if stage_state_ is None or stage_state_["code_version"] != code_version_:
+        return False
+
+    def content(fingerprints_):
+        return {
+            file: (fingerprint["sha256"] if fingerprint is not None else None)
+            for file, fingerprint in fingerprints_.items()
+        }
+
+    return (
+        None not in output_fingerprints_.values()
+        and content(input_fingerprints_) == content(stage_state_["inputs"])
+        and content(output_fingerprints_) == content(stage_state_["outputs"])
+    )
+
+
+def read_pipeline_state(path_state_):
+    if not os.path.isfile(path_state_):
+        return {}
+    with open(path_state_) as f:
+        return json.load(f)
+
+
+def write_pipeline_state(path_state_, pipeline_state_):
+    with open(path_state_, "w") as f:
+        json.dump(pipeline_state_, f, indent=2)
+
+
+def get_stage_dependencies(stages_):
+    """
+    Get the steps that each step depends on. A step depends on the steps that write its
+    input files.
+    Parameters
+    ----------
+    stages_: list
+        Steps from get_pipeline_stages.
+    Returns
+    -------
+    dict
+        Set of step names that must finish first, keyed by step name.
+    """
+    output_stage = {output: stage["name"] for stage in stages_ for output in stage["outputs"]}
+    return {
+        stage["name"]: {output_stage[input_] for input_ in stage["inputs"] if input_ in output_stage}
+        for stage in stages_
+    }
+
+
+def run_stage(func, stage_name, path_diagnostics):
+    """
+    Run a step function and return its report (see src.run_report.run_with_report) with the
+    number of data issues of each type found by the step. The issues are written to
+    path_diagnostics (see src.diagnostics.write_diagnostics).
+    """
+    reset_diagnostics()
+    stage_report_ = run_with_report(func)
+    stage_report_["diagnostics"] = write_diagnostics(path_diagnostics, stage_name)
+    return stage_report_
+
+
+def format_time(timestamp):
+    return datetime.fromtimestamp(timestamp).strftime("%H:%M:%S")
+
+
+def run_pipeline(force=False, stage_names=None, n_workers=DevConfig.N_WORKERS_PIPELINE):
+    """
+    Run the data processing steps, skipping the steps that are up to date. Steps that do not
+    depend on each other run at the same time in separate processes if n_workers > 1.
+    Parameters
+    ----------
+    force: bool
+        True, run all steps even if they are up to date.
+    stage_names: list
+        Names of the steps to consider (see get_pipeline_stages). All steps if None.
+    n_workers: int
+        Number of steps that can run at the same time. 1 runs the steps in order in the main
+        process.
+    Returns
+    -------
+    run_report: dict
+        Status of each step, and the wall time, CPU time, peak RSS, row counts, sub-spans, and
+        number of data issues of each step that ran (see src.run_report and src.diagnostics). Also saved as JSON in
+        data/1_interim/run_reports.
+    """
+    path_to_prj_dir = get_project_root()
+    path_interim_data = os.path.join(path_to_prj_dir, DevConfig.DIR_NAME_DATA, DevConfig.DIR_NAME_INTERIM)
+    if not os.path.isdir(path_interim_data):
+        os.makedirs(path_interim_data)
+    path_state = os.path.join(path_interim_data, DevConfig.INTERIM_JSON_PIPELINE_STATE)
+    path_diagnostics = os.path.join(path_interim_data, DevConfig.INTERIM_DIR_DIAGNOSTICS)
+    pipeline_state = read_pipeline_state(path_state)
+    stages = [
+        stage for stage in get_pipeline_stages() if stage_names is None or stage["name"] in stage_names
+    ]
+    stage_dict = {stage["name"]: stage for stage in stages}
+    stage_dependencies = get_stage_dependencies(stages)
+
+    def prepare_stage(stage):
+        # Fingerprint the step and return None if it can be skipped.
+        stage_state = pipeline_state.get(stage["name"])
+        prev_inputs = stage_state["inputs"] if stage_state is not None else None
+        prev_outputs = stage_state["outputs"] if stage_state is not None else None
+        code_version = get_code_version(stage["func"])
+        input_fingerprints = get_fingerprints(stage["inputs"], prev_inputs)
+        output_fingerprints = get_fingerprints(stage["outputs"], prev_outputs)
+        if not force and is_stage_current(stage_state, input_fingerprints, output_fingerprints, code_version):
+            print(f"Skipping {stage['name']}: inputs and code are unchanged.")
+            return None
+        return {"code_version": code_version, "inputs": input_fingerprints, "prev_outputs": prev_outputs}
+
+    def finish_stage(stage, stage_run, stage_report):
+        start_time, end_time = stage_report["start_time"], stage_report["end_time"]
+        print(
+            f"Finished {stage['name']}: started {format_time(start_time)}, ended {format_time(end_time)}"
+            f" ({end_time - start_time:.1f} s)"
+        )
+        pipeline_state[stage["name"]] = {
+            "code_version": stage_run["code_version"],
+            "inputs": stage_run["inputs"],
+            "outputs": get_fingerprints(stage["outputs"], stage_run["prev_outputs"]),
+        }
+        write_pipeline_state(path_state, pipeline_state)
+        run_report["stages"][stage["name"]] = {
+            "status": "run", **stage_report, "inputs": stage_run["inputs"]
+        }
+
+    run_start_time = time.time()
+    run_report = {"stages": {stage["name"]: {"status": "skipped"} for stage in stages}}
+    if n_workers <= 1:
+        for stage in stages:
+            stage_run = prepare_stage(stage)
+            if stage_run is None:
+                continue
+            print(f"Running {stage['name']}")
+            finish_stage(stage, stage_run, run_stage(stage["func"], stage["name"], path_diagnostics))
+    else:
+        # Submit each step once all the steps it depends on are done.
+        done_stages = set()
+        pending_stages = [stage["name"] for stage in stages]
+        running_futures = {}
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            while pending_stages or running_futures:
+                ready_stages = [
+                    name for name in pending_stages if stage_dependencies[name] <= done_stages
+                ]
+                for name in ready_stages:
+                    pending_stages.remove(name)
+                    stage_run = prepare_stage(stage_dict[name])
+                    if stage_run is None:
+                        done_stages.add(name)
+                        continue
+                    print(f"Running {name}")
+                    future = executor.submit(run_stage, stage_dict[name]["func"], name, path_diagnostics)
+                    running_futures[future] = (name, stage_run)
+                if any(stage_dependencies[name] <= done_stages for name in pending_stages):
+                    # A skipped step made other steps ready.
+                    continue
+                if not running_futures:
+                    break
+                finished_futures, _ = wait(running_futures, return_when=FIRST_COMPLETED)
+                for future in finished_futures:
+                    name, stage_run = running_futures.pop(future)
+                    finish_stage(stage_dict[name], stage_run, future.result())
+                    done_stages.add(name)
+    # Write the run report with the measures of each step.
+    run_end_time = time.time()
+    run_report.update(
+        start_time=run_start_time, end_time=run_end_time, wall_s=run_end_time - run_start_time, n_workers=n_workers
+    )
+    path_run_reports = os.path.join(path_interim_data, DevConfig.INTERIM_DIR_RUN_REPORTS)
+    if not os.path.isdir(path_run_reports):
+        os.makedirs(path_run_reports)
+    path_run_report = os.path.join(
+        path_run_reports, f"run_report_{datetime.fromtimestamp(run_start_time).strftime('%Y%m%d_%H%M%S')}.json"
+    )
+    write_run_report(path_run_report, run_report)
+    print(format_run_report(run_report))
+    print(f"Run report saved to {path_run_report}")
+    return run_report
@@ -0,0 +1,145 @@
+"""
+Instrumentation of the data processing steps: wall time, CPU time, peak memory, row counts,
+and the time spent in sub-spans (reads, reprojections, route loop, dissolve, spatial joins,
+and writes) of each step. Spans are only recorded while a step runs under run_with_report.
+"""
+import json
+import os
+import sys
+import time
+from contextlib import contextmanager
+try:
+    import resource
+except ImportError:  # Not available on Windows.
+    resource = None
+
+# Collector of the step that runs in this process. None if no step is instrumented.
+_stage_collector = {"spans": None, "span_path": [], "rows_in": 0, "rows_out": 0}
+PATH_PROC_STATUS = "/proc/self/status"
+PATH_PROC_CLEAR_REFS = "/proc/self/clear_refs"
+
+
+def get_peak_rss_mb():
+    """
+    Peak resident set size (RSS) of this process in MB. On Linux this is the peak since the
+    last reset_peak_rss. None if the peak RSS is not available.
+    """
+    if os.path.isfile(PATH_PROC_STATUS):
+        with open(PATH_PROC_STATUS) as file:
+            for line in file:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 2 ** 10
+    if resource is not None:
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Reported in KB on Linux and in bytes on macOS.
+        return max_rss / 2 ** 20 if sys.platform == "darwin" else max_rss / 2 ** 10
+    return None
+
+
+def reset_peak_rss():
+    """
+    Reset the peak RSS of this process to the current RSS, so that the peak of each step can
+    be measured when the steps run in the same process. Only supported on Linux.
+    """
+    try:
+        with open(PATH_PROC_CLEAR_REFS, "w") as file:
+            file.write("5")
+    except OSError:
+        pass
+
+
+@contextmanager
+def span(name):
+    """
+    Record the wall and CPU time of a section of a step. Nested spans are recorded with the
+    names of the enclosing spans ("dissolve/read"). The body can set "rows_in" or "rows_out"
+    on the yielded dict to add to the row counts of the step.
+    Parameters
+    ----------
+    name: str
+        Span name (e.g. "read", "reproject", "route_loop", "dissolve", "sjoin", "write").
+    """
+    span_info = {}
+    if _stage_collector["spans"] is None:
+        yield span_info
+        return
+    _stage_collector["span_path"].append(name)
+    span_name = "/".join(_stage_collector["span_path"])
+    start_time, start_cpu = time.perf_counter(), time.process_time()
+    try:
+        yield span_info
+    finally:
+        _stage_collector["span_path"].pop()
+        span_stats = _stage_collector["spans"].setdefault(
+            span_name, {"count": 0, "wall_s": 0.0, "cpu_s": 0.0, "rows": 0}
+        )
+        span_stats["count"] += 1
+        span_stats["wall_s"] += time.perf_counter() - start_time
+        span_stats["cpu_s"] += time.process_time() - start_cpu
+        for rows_key in ("rows_in", "rows_out"):
+            if rows_key in span_info:
+                span_stats["rows"] += span_info[rows_key]
+                _stage_collector[rows_key] += span_info[rows_key]
+
+
+def run_with_report(func):
+    """
+    Run a step function and record its wall time, CPU time, peak RSS, input and output row
+    counts (rows read and written in "read" and "write" spans), and sub-spans.
+    Returns
+    -------
+    stage_report_: dict
+        Start and end time (seconds since the epoch) and the measures of the step.
+    """
+    _stage_collector.update(spans={}, span_path=[], rows_in=0, rows_out=0)
+    reset_peak_rss()
+    start_time, start_cpu = time.time(), time.process_time()
+    try:
+        func()
+        end_time, end_cpu = time.time(), time.process_time()
+        stage_report_ = {
+            "start_time": start_time,
+            "end_time": end_time,
+            "wall_s": end_time - start_time,
+            "cpu_s": end_cpu - start_cpu,
+            "peak_rss_mb": get_peak_rss_mb(),
+            "rows_in": _stage_collector["rows_in"],
+            "rows_out": _stage_collector["rows_out"],
+            "spans": _stage_collector["spans"],
+        }
+    finally:
+        _stage_collector.update(spans=None, span_path=[])
+    return stage_report_
+
+
+def format_run_report(run_report_, n_top_spans=3):
+    """
+    Format a run report as a table with one row for each step and the slowest sub-spans of
+    each step that ran.
+    """
+    def format_value(value, fmt):
+        return "-" if value is None else format(value, fmt)
+
+    lines = [
+        f"{'step':<24}{'status':>9}{'wall s':>10}{'cpu s':>10}{'peak MB':>10}{'rows in':>12}{'rows out':>12}"
+    ]
+    for stage_name, stage_report in run_report_["stages"].items():
+        lines.append(
+            f"{stage_name:<24}{stage_report['status']:>9}"
+            f"{format_value(stage_report.get('wall_s'), '.1f'):>10}"
+            f"{format_value(stage_report.get('cpu_s'), '.1f'):>10}"
+            f"{format_value(stage_report.get('peak_rss_mb'), '.0f'):>10}"
+            f"{format_value(stage_report.get('rows_in'), 'd'):>12}"
+            f"{format_value(stage_report.get('rows_out'), 'd'):>12}"
+        )
+        top_spans = sorted(
+            stage_report.get("spans", {}).items(), key=lambda item: item[1]["wall_s"], reverse=True
+        )[:n_top_spans]
+        for span_name, span_stats in top_spans:
+            lines.append(f"    {span_name:<29}{span_stats['wall_s']:>10.1f}{span_stats['cpu_s']:>10.1f}")
+    return "\n".join(lines)
+
+
+def write_run_report(path_report, run_report_):
+    with open(path_report, "w") as file:
+        json.dump(run_report_, file, indent=2)
@@ -4,12 +4,22 @@ Created by: Apoorba Bibeka
 Modified by: Lake Trask (2022/01/22)
 """
 import os
+import numpy as np
 import pandas as pd
-from src.utils import get_project_root, read_shp
+from src.utils import get_project_root, read_shp, get_interim_file, write_gdf, get_route_class_filter, apply_schema
+from src.utils import SEGMENT_SCHEMA
+from src.lrs import decode_route_id
 from Config import DataConfig, DevConfig
 
 
-def add_aadt_new_cols_fix_dtypes(aadt_gdf_):
+def get_aadt_fields(field_aadt=DataConfig.FIELD_AADT, field_aadtt=DataConfig.FIELD_AADTT):
+    """
+    Map the AADT and AADTT output columns to the raw AADT fields of one vintage.
+    """
+    return {"aadt_val": field_aadt, "aadtt_val": field_aadtt}
+
+
+def add_aadt_new_cols_fix_dtypes(aadt_gdf_, aadt_fields=None):
     """
     Add new columns to the "NCDOT 20XX AADT Traffic Segment Data" AADT data and fix data  type for features. Utilizes
     the path to the data specified in Config.py.
@@ -18,33 +28,31 @@ def add_aadt_new_cols_fix_dtypes(aadt_gdf_):
     ----------
     aadt_gdf_: gpd.GeoDataFrame()
         NCDOT AADT data layer. Typical the spatial boundaries are at interchanges.
+    aadt_fields: dict
+        Raw AADT field for each AADT output column. get_aadt_fields() ("aadt_val" and
+        "aadtt_val" from the fields in Config.py) if None.
     Returns
     -------
     aadt_df_add_col_: gpd.GeoDataFrame()
-        AADT data with new columns for route id, route class, route qual, route inventory route number, and route county.
+        AADT data with new columns for route id, route key, route class, route qual, route inventory route number, and
+        route county. Data types are set by the compact schema (src.utils.SEGMENT_SCHEMA).
     """
+    aadt_fields = get_aadt_fields() if aadt_fields is None else aadt_fields
     aadt_df_add_col_ = (
         aadt_gdf_.rename(columns={
             "begin_mp": "st_mp_pt",
             "end_mp": "end_mp_pt",
-            DataConfig.FIELD_AADT: "aadt_val",
-            DataConfig.FIELD_AADTT: "aadtt_val"
         })
         .assign(
-            route_id=lambda df: df.route_id.astype(str).str.split(".", expand=True)[0],
-            route_class=lambda df: df.route_id.str[0].astype(int),
-            route_qual=lambda df: df.route_id.str[1].astype(int),
-            route_inventory=lambda df: df.route_id.str[2].astype(int),
-            route_no=lambda df: df.route_id.str[3:8].astype(int),
-            route_county=lambda df: df.route_id.str[8:11].astype(int),
+            **decode_route_id(aadt_gdf_.route_id),
             st_end_diff=lambda df: df.end_mp_pt - df.st_mp_pt,
-            aadt_val=lambda df: pd.to_numeric(df.aadt_val, errors="raise"),
-            aadtt_val=lambda df: pd.to_numeric(df.aadtt_val, errors="raise"),
+            **{col: pd.to_numeric(aadt_gdf_[field], errors="raise") for col, field in aadt_fields.items()},
             source=lambda df: df.source.astype(str),
         )
         .filter(
             items=[
                 "route_id",
+                "route_key",
                 "route_class",
                 "route_qual",
                 "route_inventory",
@@ -54,17 +62,21 @@ def add_aadt_new_cols_fix_dtypes(aadt_gdf_):
                 "st_mp_pt",
                 "end_mp_pt",
                 "st_end_diff",
-                "aadt_val",
-                "aadtt_val",
+                *aadt_fields,
                 "source",
                 "geometry",
             ]
         )
+        .pipe(
+            apply_schema,
+            schema={**SEGMENT_SCHEMA, **{col: SEGMENT_SCHEMA["aadt_val"] for col in aadt_fields}},
+            data_name="AADT",
+        )
     )
     return aadt_df_add_col_
 
 
-def test_aadt_df(aadt_gdf_):
+def test_aadt_df(aadt_gdf_, field_aadt=DataConfig.FIELD_AADT):
     """
     Test if there is missing data. Need to have values for all geometry for the crs
     porjection conversions to work.
@@ -72,15 +84,18 @@ def test_aadt_df(aadt_gdf_):
     ----------
     aadt_gdf_: gpd.GeoDataFrame()
         NCDOT 20XX aadt data layer. Typical the spatial boundaries are at interchanges.
+    field_aadt: str or list
+        AADT field(s) to test (e.g. "aadt_2018").
     Raises
     -------
     AssertionError
         If there is a missing value for either "route_id", "begin_mp", "end_mp", or "aadt_2018"
     """
+    aadt_field_list = [field_aadt] if isinstance(field_aadt, str) else list(field_aadt)
     assert (
-        aadt_gdf_[["route_id", "begin_mp", "end_mp", DataConfig.FIELD_AADT]].isna().sum().sum() == 0
+        aadt_gdf_[["route_id", "begin_mp", "end_mp", *aadt_field_list]].isna().sum().sum() == 0
     ), (
-        'Need to remove rows with missing "route_id", "begin_mp", "end_mp", "' + DataConfig.FIELD_AADTT + '", or "' + DataConfig.FIELD_AADT + '"'
+        'Need to remove rows with missing "route_id", "begin_mp", "end_mp", or "' + '", "'.join(aadt_field_list) + '"'
     )
     print("LRS system is complete.")
     try:
@@ -94,6 +109,61 @@ def test_aadt_df(aadt_gdf_):
         print(inst)
 
 
+def clean_aadt(aadt_file, max_highway_class=3, aadt_fields=None):
+    """
+    Read and clean the AADT data.
+    Parameters
+    ----------
+    aadt_file: str
+        Path to the AADT shapefile.
+    max_highway_class: int
+        Keep the routes up to this route class (1: interstate, 2: US Route, 3: NC Route).
+    aadt_fields: dict
+        Raw AADT field for each AADT output column (see add_aadt_new_cols_fix_dtypes). Several
+        vintages can be read at once with one output column per vintage.
+    Returns
+    -------
+    aadt_df_fil_4326: gpd.GeoDataFrame()
+        Cleaned AADT data in EPSG:4326 with an integer segment ID ("aadt_seg_id").
+    """
+    aadt_fields = get_aadt_fields() if aadt_fields is None else aadt_fields
+    # Only read the columns that are used and the 1: interstate, 2: US Route, 3: NC Route rows.
+    aadt_gdf = read_shp(
+        aadt_file,
+        data_name="AADT",
+        columns=[
+            "route_id",
+            "begin_mp",
+            "end_mp",
+            *dict.fromkeys(aadt_fields.values()),
+            "county",
+            "source",
+        ],
+        where=get_route_class_filter(
+            aadt_file, route_id_field="route_id", max_route_class=max_highway_class
+        ),
+        to_epsg=4326,
+    )
+    # Test if there is missing values for AADT data.
+    # ************************************************************************************
+    # Test the AADT fields ("aadt_val" and the "aadt_val_<vintage>" columns).
+    test_aadt_df(aadt_gdf, field_aadt=[aadt_fields[col] for col in aadt_fields if col.startswith("aadt_val")])
+    # Add new columns on route class, number, county, qual, inventory to the AADT data.
+    # ************************************************************************************
+    aadt_df_add_col = add_aadt_new_cols_fix_dtypes(aadt_gdf, aadt_fields=aadt_fields)
+    set(aadt_df_add_col.route_no.unique())
+    # Filter AADT data to 1: interstate, 2: US Route, 3: NC Route, 4: Secondary Route.
+    # ************************************************************************************
+    aadt_df_fil = aadt_df_add_col.loc[lambda df: df.route_class <= max_highway_class]
+    # Filter AADT data to rows with valid geometry (already reprojected to 4326 when read). Add an
+    # integer segment ID used to re-attach the geometry after attribute-only processing.
+    # ************************************************************************************
+    aadt_df_fil_4326 = aadt_df_fil.loc[lambda df: ~df.geometry.isnull()].assign(
+        aadt_seg_id=lambda df: np.arange(len(df), dtype=np.int64)
+    )
+    return aadt_df_fil_4326
+
+
 # if __name__ == "__main__":
 def run_aadt_init_process():
     # Set the paths to relevant files and folders.
@@ -105,23 +175,8 @@ def run_aadt_init_process():
     if not os.path.isdir(path_interim_data):  # Check if interim data directory exists
         os.mkdir(path_interim_data)  # Create interim data directory if it doesn't exist already
     aadt_file = os.path.join(path_to_raw, DataConfig.DIR_AADT_SEGMENTS, DataConfig.SHAPEFILE_AADT)
-    aadt_gdf = read_shp(aadt_file)
-    # Test if there is missing values for AADT data.
-    # ************************************************************************************
-    test_aadt_df(aadt_gdf)
-    # Add new columns on route class, number, county, qual, inventory to the AADT data.
-    # ************************************************************************************
-    aadt_df_add_col = add_aadt_new_cols_fix_dtypes(aadt_gdf)
-    set(aadt_df_add_col.route_no.unique())
-    # Filter AADT data to 1: interstate, 2: US Route, 3: NC Route, 4: Secondary Route.
-    # ************************************************************************************
-    max_highway_class = 3
-    aadt_df_fil = aadt_df_add_col.loc[lambda df: df.route_class <= max_highway_class]
-    # Filter AADT data to rows with valid geometry. Set CRS to 4326.
-    # ************************************************************************************
-    aadt_df_fil = aadt_df_fil.loc[lambda df: ~df.geometry.isnull()]
-    aadt_df_fil_4326 = aadt_df_fil.to_crs(epsg=4326)
+    aadt_df_fil_4326 = clean_aadt(aadt_file)
     # Output cleaned AADT data.
     # ************************************************************************************
-    out_file_aadt_nc = os.path.join(path_interim_data, DevConfig.INTERIM_GPKG_AADT)
-    aadt_df_fil_4326.to_file(out_file_aadt_nc, driver="GPKG")
+    out_file_aadt_nc = get_interim_file(os.path.join(path_interim_data, DevConfig.INTERIM_GPKG_AADT))
+    write_gdf(aadt_df_fil_4326, out_file_aadt_nc)
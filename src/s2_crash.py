@@ -4,14 +4,42 @@ Created by: Apoorba Bibeka
 Modified by: Lake Trask (2022/01/02)
 """
 import os
+import numpy as np
 import pandas as pd
-import geopandas as gpd
 from src.utils import get_project_root
-from src.utils import read_shp
+from src.utils import read_shp, read_shp_batches, write_gdf_batches, reproject_geometry
+from src.utils import get_interim_file, write_gdf, get_route_class_filter, attach_geometry, apply_schema, CRASH_SCHEMA
+from src.utils import print_schema_memory
+from src.lrs import decode_route_id
 from Config import DataConfig, DevConfig
 
 
-def fix_crash_dat_type(crash_df_):
+def get_crash_raw_columns(field_gis_route=DataConfig.FIELD_GIS_ROUTE, field_total_cnt=DataConfig.FIELD_TOTAL_CNT):
+    """
+    Underscored names of the columns read from the "Section Safety Scores" shapefile.
+    """
+    return [
+        field_gis_route,
+        "county",
+        "st_mp_pt",
+        "end_mp_pt",
+        "density_sc",
+        "severity_s",
+        "rate_score",
+        "combined_s",
+        "combined_r",
+        "ka_cnt",
+        "bc_cnt",
+        "pdo_cnt",
+        field_total_cnt,
+        "shape__len",
+    ]
+
+
+def fix_crash_dat_type(
+    crash_df_, field_gis_route=DataConfig.FIELD_GIS_ROUTE, field_total_cnt=DataConfig.FIELD_TOTAL_CNT,
+    schema_memory=None,
+):
     """
     Fix data for "20XX – 20XX Section Safety Scores" data and filter to relevant columns.
 
@@ -19,21 +47,26 @@ def fix_crash_dat_type(crash_df_):
     ----------
     crash_df_: pd.Dataframe()
         Crash data.
+    field_gis_route: str
+        GIS route identifier field of the safety scores vintage.
+    field_total_cnt: str
+        Total crashes field of the safety scores vintage.
+    schema_memory: dict
+        Memory totals of the compact schema of the batches (see src.utils.apply_schema). The
+        memory is printed if None.
     Returns
     -------
     crash_df_add_col_
-        Crash data with additional columns.
+        Crash data with additional columns. Data types are set by the compact schema
+        (src.utils.CRASH_SCHEMA).
     """
+    route_id_parts = decode_route_id(crash_df_[field_gis_route])
     crash_df_add_col_ = crash_df_.rename(columns={
-        DataConfig.FIELD_GIS_ROUTE: "route_gis",
-        DataConfig.FIELD_TOTAL_CNT: "total_cnt"
+        field_gis_route: "route_gis",
+        field_total_cnt: "total_cnt"
     }).assign(
-        route_gis=lambda df: df.route_gis.astype(str).str.split(".", expand=True)[0],
-        route_class=lambda df: df.route_gis.str[0].astype(int),
-        route_qual=lambda df: df.route_gis.str[1].astype(int),
-        route_inventory=lambda df: df.route_gis.str[2].astype(int),
-        route_no=lambda df: df.route_gis.str[3:8].astype(int),
-        route_county=lambda df: df.route_gis.str[8:11].astype(int),
+        route_gis=route_id_parts.pop("route_id"),
+        **route_id_parts,
         st_end_diff=lambda df: df.end_mp_pt - df.st_mp_pt,
         density_sc=lambda df: pd.to_numeric(df.density_sc, errors="coerce"),
         severity_s=lambda df: pd.to_numeric(df.severity_s, errors="coerce"),
@@ -46,7 +79,9 @@ def fix_crash_dat_type(crash_df_):
         shape_len_mi=lambda df: pd.to_numeric(df.shape__len, errors="coerce") / 5280,
     ).filter(
         items=[
+            "crash_seg_id",
             "route_gis",
+            "route_key",
             "route_class",
             "route_qual",
             "route_inventory",
@@ -67,7 +102,7 @@ def fix_crash_dat_type(crash_df_):
             "shape_len_mi",
             "st_end_diff",
         ]
-    )
+    ).pipe(apply_schema, schema=CRASH_SCHEMA, data_name="Crash", memory_=schema_memory)
     return crash_df_add_col_
 
 
@@ -118,42 +153,179 @@ def get_severity_index(
     return crash_df_fil_si_
 
 
-# if __name__ == "__main__":
-def run_safety_init_process():
-    # Set the paths to relevant files and folders.
-    # Load NCDOT 2015-2019 crash data.
-    # ************************************************************************************
-    path_to_prj_dir = get_project_root()
-    path_to_raw = os.path.join(path_to_prj_dir, DevConfig.DIR_NAME_DATA, DevConfig.DIR_NAME_RAW)
-    path_interim_data = os.path.join(path_to_prj_dir, DevConfig.DIR_NAME_DATA, DevConfig.DIR_NAME_INTERIM)
-    if not os.path.isdir(path_interim_data):  # Check if interim data directory exists
-        os.mkdir(path_interim_data)  # Create interim data directory if it doesn't exist already
-    crash_file = os.path.join(path_to_raw, DataConfig.DIR_SAFETY_SCORES, DataConfig.SHAPEFILE_SAFETY)
-    crash_gdf = read_shp(file=crash_file)
-    crash_gdf_geom_4326 = crash_gdf.to_crs(epsg=4326).geometry
-    crash_df = pd.DataFrame(crash_gdf.drop(columns="geometry"))
+def clean_crash(
+    crash_file,
+    max_highway_class=3,
+    field_gis_route=DataConfig.FIELD_GIS_ROUTE,
+    field_total_cnt=DataConfig.FIELD_TOTAL_CNT,
+    read_geometry=True,
+):
+    """
+    Read and clean the crash data, and get the severity index.
+    Parameters
+    ----------
+    crash_file: str
+        Path to the "Section Safety Scores" shapefile.
+    max_highway_class: int
+        Keep the routes up to this route class (1: interstate, 2: US Route, 3: NC Route).
+    field_gis_route: str
+        GIS route identifier field of the safety scores vintage.
+    field_total_cnt: str
+        Total crashes field of the safety scores vintage.
+    read_geometry: bool
+        False, only read the attributes. The AADT and crash merge does not use the crash
+        geometry.
+    Returns
+    -------
+    {
+        "crash_df_fil_si": crash_df_fil_si,
+        "crash_geometry": crash_gdf_geom_4326,
+    } : dict
+        Crash attributes with the severity index, and the crash geometry in EPSG:4326
+        indexed by "crash_seg_id" (None if read_geometry is False).
+    """
+    # Only read the columns that are used and the 1: interstate, 2: US Route, 3: NC Route rows.
+    crash_gdf = read_shp(
+        file=crash_file,
+        data_name="Crash",
+        columns=get_crash_raw_columns(field_gis_route=field_gis_route, field_total_cnt=field_total_cnt),
+        where=get_route_class_filter(
+            crash_file, route_id_field=field_gis_route, max_route_class=max_highway_class
+        ),
+        ignore_geometry=not read_geometry,
+        to_epsg=4326,
+    )
+    # Keep the geometry in a side table keyed by an integer segment ID and process the
+    # attributes only.
+    crash_gdf = crash_gdf.assign(crash_seg_id=np.arange(len(crash_gdf), dtype=np.int64))
+    crash_gdf_geom_4326 = None
+    if read_geometry:
+        crash_gdf_geom_4326 = crash_gdf.set_index("crash_seg_id").geometry
+    crash_df = pd.DataFrame(crash_gdf.drop(columns="geometry", errors="ignore"))
+    crash_df_fil_si = clean_crash_attributes(
+        crash_df,
+        max_highway_class=max_highway_class,
+        field_gis_route=field_gis_route,
+        field_total_cnt=field_total_cnt,
+    )
+    return {"crash_df_fil_si": crash_df_fil_si, "crash_geometry": crash_gdf_geom_4326}
+
+
+def clean_crash_attributes(
+    crash_df_,
+    max_highway_class=3,
+    field_gis_route=DataConfig.FIELD_GIS_ROUTE,
+    field_total_cnt=DataConfig.FIELD_TOTAL_CNT,
+    schema_memory=None,
+):
+    """
+    Clean the crash attributes and get the severity index. Each row is cleaned on its own, so
+    the data can be cleaned in batches of rows.
+    Parameters
+    ----------
+    crash_df_: pd.DataFrame()
+        Raw crash attributes with underscored column names and "crash_seg_id".
+    max_highway_class: int
+        Keep the routes up to this route class (1: interstate, 2: US Route, 3: NC Route).
+    field_gis_route: str
+        GIS route identifier field of the safety scores vintage.
+    field_total_cnt: str
+        Total crashes field of the safety scores vintage.
+    schema_memory: dict
+        See fix_crash_dat_type.
+    Returns
+    -------
+    crash_df_fil_si_: pd.DataFrame()
+        Crash attributes with the severity index.
+    """
     # Fix data types.
     # ************************************************************************************
-    crash_df_add_col = fix_crash_dat_type(crash_df)
+    crash_df_add_col = fix_crash_dat_type(
+        crash_df_, field_gis_route=field_gis_route, field_total_cnt=field_total_cnt, schema_memory=schema_memory
+    )
     set(crash_df_add_col.route_no.unique())
     # Filter crash data to 1: interstate, 2: US Route, 3: NC Route, 4: Secondary Route.
     # ************************************************************************************
-    max_highway_class = 3
     crash_df_fil = crash_df_add_col.loc[lambda df: df.route_class <= max_highway_class]
     test_crash_dat(crash_df_fil)
     # Get severity index.
     # ************************************************************************************
-    crash_df_fil_si = get_severity_index(crash_df_fil)
-    # Add geometry column back to crash_df_fil_si
-    # ************************************************************************************
-    crash_df_fil_si_geom = crash_df_fil_si.merge(
-        crash_gdf_geom_4326, left_index=True, right_index=True, how="left"
+    crash_df_fil_si_ = get_severity_index(crash_df_fil)
+    return crash_df_fil_si_
+
+
+def clean_crash_batches(crash_file, out_file, batch_size, max_highway_class=3):
+    """
+    Read, clean, and reproject the crash data in batches of rows and append each batch to the
+    output file, so that the memory used is bounded by the batch size and not by the size of
+    the data. Gives the same rows as clean_crash with the geometry attached.
+    Parameters
+    ----------
+    crash_file: str
+        Path to the "Section Safety Scores" shapefile.
+    out_file: str
+        Path to the cleaned crash data (see src.utils.write_gdf_batches).
+    batch_size: int
+        Number of rows in each batch.
+    max_highway_class: int
+        Keep the routes up to this route class (1: interstate, 2: US Route, 3: NC Route,
+        4: Secondary Route).
+    Returns
+    -------
+    n_rows: int
+        Number of rows written.
+    """
+    crash_gdf_batches = read_shp_batches(
+        crash_file,
+        batch_size=batch_size,
+        data_name="Crash",
+        columns=get_crash_raw_columns(),
+        where=get_route_class_filter(
+            crash_file, route_id_field=DataConfig.FIELD_GIS_ROUTE, max_route_class=max_highway_class
+        ),
     )
-    # Convert crash data to GeoDataFrame() and output to gpkg file.
+
+    def clean_batches():
+        n_rows_read = 0
+        for crash_gdf in crash_gdf_batches:
+            # Segment IDs are row numbers of the rows read, as in clean_crash.
+            crash_gdf = crash_gdf.assign(
+                crash_seg_id=np.arange(n_rows_read, n_rows_read + len(crash_gdf), dtype=np.int64)
+            )
+            n_rows_read += len(crash_gdf)
+            crash_df_fil_si = clean_crash_attributes(
+                pd.DataFrame(crash_gdf.drop(columns="geometry")), max_highway_class=max_highway_class,
+                schema_memory=schema_memory,
+            )
+            crash_gdf_geom_4326 = reproject_geometry(crash_gdf.set_index("crash_seg_id").geometry, 4326)
+            yield attach_geometry(crash_df_fil_si, crash_gdf_geom_4326, key="crash_seg_id")
+
+    # The memory of the compact schema is reported once for all the batches.
+    schema_memory = {"before": 0.0, "after": 0.0}
+    n_rows = write_gdf_batches(clean_batches(), out_file)
+    print_schema_memory("Crash", schema_memory)
+    return n_rows
+
+
+# if __name__ == "__main__":
+def run_safety_init_process(batch_size=DevConfig.BATCH_SIZE_SAFETY_SCORES):
+    # Set the paths to relevant files and folders.
+    # Load NCDOT 2015-2019 crash data.
     # ************************************************************************************
-    crash_df_fil_si_geom_gdf = gpd.GeoDataFrame(
-        crash_df_fil_si_geom, geometry=crash_df_fil_si_geom.geometry,
-    )
-    crash_df_fil_si_geom_gdf.crs = "EPSG:4326"
-    out_file_crash_si = os.path.join(path_interim_data, DevConfig.INTERIM_GPKG_SAFETY)
-    crash_df_fil_si_geom_gdf.to_file(out_file_crash_si, driver="GPKG")
+    path_to_prj_dir = get_project_root()
+    path_to_raw = os.path.join(path_to_prj_dir, DevConfig.DIR_NAME_DATA, DevConfig.DIR_NAME_RAW)
+    path_interim_data = os.path.join(path_to_prj_dir, DevConfig.DIR_NAME_DATA, DevConfig.DIR_NAME_INTERIM)
+    if not os.path.isdir(path_interim_data):  # Check if interim data directory exists
+        os.mkdir(path_interim_data)  # Create interim data directory if it doesn't exist already
+    crash_file = os.path.join(path_to_raw, DataConfig.DIR_SAFETY_SCORES, DataConfig.SHAPEFILE_SAFETY)
+    out_file_crash_si = get_interim_file(os.path.join(path_interim_data, DevConfig.INTERIM_GPKG_SAFETY))
+    if batch_size is not None:
+        # Stream the data in batches of rows to bound the memory used.
+        clean_crash_batches(crash_file, out_file_crash_si, batch_size=batch_size)
+        return
+    crash_si = clean_crash(crash_file)
+    crash_df_fil_si, crash_gdf_geom_4326 = crash_si["crash_df_fil_si"], crash_si["crash_geometry"]
+    # Add geometry column back to crash_df_fil_si and output to gpkg file.
+    # ************************************************************************************
+    crash_df_fil_si_geom_gdf = attach_geometry(crash_df_fil_si, crash_gdf_geom_4326, key="crash_seg_id")
+    write_gdf(crash_df_fil_si_geom_gdf, out_file_crash_si)
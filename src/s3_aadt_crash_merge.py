@@ -4,87 +4,80 @@ Created by: Apoorba Bibeka
 Modified by: Lake Trask (2022/01/22)
 """
 import os
+import sys
+import heapq
+import hashlib
+import inspect
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 import pandas as pd
 import geopandas as gpd
 from src.utils import get_project_root
 from src.utils import reorder_columns
+from src.utils import hash_file
+from src.utils import get_interim_file, read_df, read_geometry, attach_geometry, write_gdf, SEGMENT_SCHEMA, CRASH_SCHEMA
+from src.lrs import interval_join
+from src.run_report import span
+from src.diagnostics import add_diagnostics, extend_diagnostics, run_with_diagnostics
+from src.diagnostics import ISSUE_OVERLAPPING_AADT_INTERVAL, ISSUE_NO_CRASH_DATA
 import numpy as np
+from scipy import sparse
 from src.s2_crash import get_severity_index
 from Config import DevConfig
 
 
-def merge_aadt_crash(aadt_gdf_, crash_gdf_, crash_num_years=5, quiet=True):
+def merge_aadt_crash(
+    aadt_gdf_, crash_gdf_, crash_num_years=5, quiet=True, statewide=True, n_workers=1
+):
     """
     Function for merging AADT and Crash data.
     Parameters
     ----------
-    aadt_gdf_ : gpd.GeoDataFrame()
-        AADT data.
-    crash_gdf_: gpd.GeoDataFrame()
-        Crash data.
+    aadt_gdf_ : gpd.GeoDataFrame() or pd.DataFrame()
+        AADT data. Can be attributes only, without a geometry column.
+    crash_gdf_: gpd.GeoDataFrame() or pd.DataFrame()
+        Crash data. The crash geometry is not used.
     crash_num_years : int
         Number of years for which crash data is reported. Generally it's 5 years.
     quiet: bool
         False, for debug mode.
+    statewide: bool
+        True, bin the AADT and crash data for all routes in a single pass. False, loop over
+        the routes and bin one route at a time. Both give the same output.
+    n_workers: int
+        Number of worker processes. If more than 1, the routes are split into shards with
+        a balanced number of rows and each shard is binned in a separate process.
     Returns
     -------
     aadt_crash_gdf_ : gpd.GeoDataFrame()
-        Merged AADT and Crash data with Crash data dissolved based on AADT intervals.
+        Merged AADT and Crash data with Crash data dissolved based on AADT intervals. A
+        pd.DataFrame() if aadt_gdf_ has no geometry column.
     aadt_but_no_crash_route_set : set
         Set of route IDs with AADT data that doesn't have associated crash data.
     """
-    # Group data by route #, county, route qual.
-    aadt_grp = aadt_gdf_.groupby(["route_id"])
-    crash_grp = crash_gdf_.groupby(["route_gis"])
-    aadt_grp_keys = aadt_gdf_.groupby(["route_id"]).groups.keys()
-
-    aadt_grp_sub_dict = {}
-    crash_grp_sub_dict = {}
-    aadt_but_no_crash_route_list_ = list()
-    # Loop over aadt and crash data for a particular route and county and create a
-    # crosswalk in the crash data that allows us to merge it to the AADT data using
-    # the LRS (linear referencing system).
-    for aadt_grp_key in aadt_grp_keys:
-        aadt_grp_sub = aadt_grp.get_group(aadt_grp_key).copy()
-        # Bin the crash start milepost and end milepost based on AADT.
-        aadt_bin_df_dict = get_aadt_bin(aadt_grp_sub_=aadt_grp_sub)
-        aadt_grp_sub_dict[aadt_grp_key] = aadt_bin_df_dict["aadt_grp_sub_1"]
-        if not quiet:
-            print(
-                f"Now processing route {aadt_grp_key}; {aadt_grp_sub[['route_class','route_qual', 'route_no', 'route_county']].head(1)}"
+    with span("bin_aadt_crash"):
+        if n_workers > 1:
+            aadt_crash_bin_dict = bin_aadt_crash_parallel(
+                aadt_gdf_=aadt_gdf_,
+                crash_gdf_=crash_gdf_,
+                n_workers=n_workers,
+                statewide=statewide,
             )
-        try:
-            crash_grp_sub = crash_grp.get_group(aadt_grp_key).copy()
-        except KeyError as err:
-            print(f"No Crash data for route {err.args}")
-            aadt_but_no_crash_route_list_.append(aadt_grp_key)
-            # continue
+        elif statewide:
+            aadt_crash_bin_dict = bin_aadt_crash_statewide(aadt_gdf_=aadt_gdf_, crash_gdf_=crash_gdf_)
         else:
-            crash_grp_sub_dict[aadt_grp_key] = bin_aadt_crash(
-                aadt_lrs_bins=aadt_bin_df_dict["aadt_lrs_bins"],
-                crash_grp_sub_=crash_grp_sub,
+            aadt_crash_bin_dict = bin_aadt_crash_by_route(
+                aadt_gdf_=aadt_gdf_, crash_gdf_=crash_gdf_, quiet=quiet
             )
-    aadt_gdf_1 = pd.concat(aadt_grp_sub_dict.values()).sort_values(
-        ["route_id", "st_mp_pt"]
-    )
-
-    # Subset crash dataset with non-zero rows.
-    crash_grp_sub_no_empty_df_set = list(crash_grp_sub_dict.values())
-    if len(crash_grp_sub_no_empty_df_set) != 0:
-        if min([len(values) for values in crash_grp_sub_dict.values()]) == 0:
-            crash_grp_sub_no_empty_df_set = [
-                value for value in crash_grp_sub_dict.values() if len(value) != 0
-            ]
+    aadt_gdf_1 = aadt_crash_bin_dict["aadt_gdf_1"]
+    crash_gdf_1 = aadt_crash_bin_dict["crash_gdf_1"]
+    aadt_but_no_crash_route_set_ = aadt_crash_bin_dict["aadt_but_no_crash_route_set"]
 
-    # Get a list of routes with missing crash data.
-    for key, value in crash_grp_sub_dict.items():
-        if len(value) == 0:
-            aadt_but_no_crash_route_list_.append(key)
-    aadt_but_no_crash_route_set_ = set(aadt_but_no_crash_route_list_)
-
-    if len(crash_grp_sub_no_empty_df_set) == 0:
+    if len(crash_gdf_1) == 0:
         aadt_crash_df_ = (
-            aadt_gdf_1.assign(
+            pd.DataFrame(aadt_gdf_1)
+            .rename(columns={"geometry": "geometry_aadt"})
+            .assign(
                 aadt_interval_left=lambda df: pd.IntervalIndex(df.aadt_interval).left,
                 aadt_interval_right=lambda df: pd.IntervalIndex(df.aadt_interval).right,
                 st_end_diff_aadt=lambda df: df.st_end_diff,
@@ -99,11 +92,12 @@ def merge_aadt_crash(aadt_gdf_, crash_gdf_, crash_num_years=5, quiet=True):
                 inc_fac=np.nan,
                 severity_index=np.nan,
                 crash_rate_per_mile_per_year=np.nan,
-                geometry_aadt=lambda df: df.geometry,
             )
             .filter(
                 items=[
                     "route_id",
+                    "route_key",
+                    "aadt_seg_id",
                     "route_class",
                     "route_qual",
                     "route_inventory",
@@ -129,64 +123,28 @@ def merge_aadt_crash(aadt_gdf_, crash_gdf_, crash_num_years=5, quiet=True):
                     "geometry_aadt",
                 ]
             )
-            .sort_values(["route_id", "aadt_interval_left"])
+            .sort_values(["route_key", "aadt_interval_left"])
         )
-        aadt_crash_gdf_ = gpd.GeoDataFrame(aadt_crash_df_, geometry="geometry_aadt")
-        aadt_crash_gdf_.crs = "EPSG:4326"
-        return aadt_crash_gdf_, aadt_but_no_crash_route_set_
-
-    crash_gdf_1 = pd.concat(crash_grp_sub_no_empty_df_set)
+        return get_aadt_crash_gdf(aadt_crash_df_), aadt_but_no_crash_route_set_
 
     # Subset to relevant columns.
-    crash_gdf_no_duplicates = (
-        crash_gdf_1.loc[
-            :,
-            [
-                "route_gis",
-                "aadt_interval",
-                "ka_cnt",
-                "bc_cnt",
-                "pdo_cnt",
-                "total_cnt",
-                "st_mp_pt",
-                "end_mp_pt",
-                "shape_len_mi",
-                "st_end_diff",
-                "geometry",
-            ],
-        ]
-        .drop_duplicates(["route_gis", "aadt_interval", "st_mp_pt"])
-        .sort_values(["route_gis", "st_mp_pt"])
-    )
+    crash_gdf_no_duplicates = get_crash_no_duplicates(crash_gdf_1)
     # Change the crash frequency in a segment based on the AADT interval length and
-    # position. Consider crashes to be uniform distributed along the length.
-    crash_gdf_adj_crash_by_len = scale_crash_by_seg_len(crash_gdf_no_duplicates)
-    # Aggregate crash fields based on AADT intervals.
-    # dissolve() is the groupby implementation with spatial attributes (geometry column)
-    crash_gdf_adj_crash_by_len_dissolve = crash_gdf_adj_crash_by_len.dissolve(
-        by=["route_gis", "aadt_interval"],
-        aggfunc={
-            "ka_cnt": "sum",
-            "bc_cnt": "sum",
-            "pdo_cnt": "sum",
-            "total_cnt": "sum",
-            "st_mp_pt": "min",
-            "end_mp_pt": "max",
-            "st_end_diff": "sum",
-            "seg_len_in_interval": "sum",
-        },
-    ).reset_index()
+    # position. Consider crashes to be uniform distributed along the length. Aggregate
+    # crash fields based on AADT intervals. The AADT geometry is used for the output, so
+    # the crash geometry is not needed.
+    with span("dissolve"):
+        crash_df_adj_crash_by_len_agg = scale_crash_by_seg_len(crash_gdf_no_duplicates)
     # Compute severity index on the new crash data boundaries correponding to the AADT
     # data boundaries.
-    crash_gdf_adj_crash_by_len_dissolve = get_severity_index(
-        crash_gdf_adj_crash_by_len_dissolve
-    )
+    crash_df_adj_crash_by_len_agg = get_severity_index(crash_df_adj_crash_by_len_agg)
     # Merge the crash data to AADT data and compute IF and severity index factor.
     aadt_crash_df_ = (
-        aadt_gdf_1.merge(
-            crash_gdf_adj_crash_by_len_dissolve,
-            left_on=["route_id", "aadt_interval"],
-            right_on=["route_gis", "aadt_interval"],
+        pd.DataFrame(aadt_gdf_1)
+        .rename(columns={"geometry": "geometry_aadt"})
+        .merge(
+            crash_df_adj_crash_by_len_agg,
+            on=["route_key", "aadt_interval"],
             suffixes=["_aadt", "_crash"],
             how="left",
         )
@@ -201,6 +159,8 @@ def merge_aadt_crash(aadt_gdf_, crash_gdf_, crash_num_years=5, quiet=True):
         .filter(
             items=[
                 "route_id",
+                "route_key",
+                "aadt_seg_id",
                 "route_class",
                 "route_qual",
                 "route_inventory",
@@ -226,13 +186,433 @@ def merge_aadt_crash(aadt_gdf_, crash_gdf_, crash_num_years=5, quiet=True):
                 "geometry_aadt",
             ]
         )
-        .sort_values(["route_id", "aadt_interval_left"])
+        .sort_values(["route_key", "aadt_interval_left"])
     )
+    return get_aadt_crash_gdf(aadt_crash_df_), aadt_but_no_crash_route_set_
+
 
+def get_aadt_crash_gdf(aadt_crash_df_):
+    """
+    Convert the merged AADT and crash data to a GeoDataFrame with the AADT geometry. Data
+    without geometry (AADT attributes only, keyed by aadt_seg_id) is returned as is; the
+    geometry is attached when the data is written (see src.utils.attach_geometry).
+    """
+    if "geometry_aadt" not in aadt_crash_df_.columns:
+        return aadt_crash_df_
     aadt_crash_gdf_ = gpd.GeoDataFrame(aadt_crash_df_, geometry="geometry_aadt")
     aadt_crash_gdf_.crs = "EPSG:4326"
+    return aadt_crash_gdf_
+
+
+def get_route_hash(df_):
+    """
+    Hash the rows of each route. The hash changes if a row of the route is added, removed,
+    changed, or moved.
+    Parameters
+    ----------
+    df_: pd.DataFrame()
+        Data with a route_key column.
+    Returns
+    -------
+    route_hash_: pd.Series
+        uint64 hash of each route, indexed by route key.
+    """
+    route_key = df_.route_key.values
+    order = np.argsort(route_key, kind="mergesort")
+    route_keys, route_start = np.unique(route_key[order], return_index=True)
+    if len(order) == 0:
+        return pd.Series(np.zeros(0, dtype=np.uint64), index=route_keys)
+    row_hash = pd.util.hash_pandas_object(df_, index=False).values[order]
+    route_len = np.diff(np.append(route_start, len(order)))
+    row_pos = np.arange(len(order)) - np.repeat(route_start, route_len)
+    # Mix the position of each row in its route into the row hash, so that the route hash
+    # depends on the row order.
+    row_pos_hash = pd.util.hash_pandas_object(
+        pd.DataFrame({"row_hash": row_hash, "row_pos": row_pos}), index=False
+    ).values
+    return pd.Series(np.bitwise_xor.reduceat(row_pos_hash, route_start), index=route_keys)
+
+
+def get_aadt_crash_route_hash(aadt_gdf_, crash_gdf_):
+    """
+    Hash the AADT and crash rows of each AADT route. The segment IDs are row numbers of the
+    whole input file, so they are not hashed: adding a segment to one route would change the
+    IDs of the segments of the next routes.
+    Returns
+    -------
+    route_hash_: pd.Series
+        uint64 hash of each route in aadt_gdf_, indexed by route key.
+    """
+    aadt_route_hash = get_route_hash(aadt_gdf_.drop(columns="aadt_seg_id"))
+    crash_route_hash = get_route_hash(
+        crash_gdf_.loc[lambda df: df.route_key.isin(aadt_route_hash.index)].drop(
+            columns="crash_seg_id", errors="ignore"
+        )
+    ).reindex(aadt_route_hash.index, fill_value=0)
+    route_hash_ = pd.util.hash_pandas_object(
+        pd.DataFrame({"aadt_hash": aadt_route_hash.values, "crash_hash": crash_route_hash.values}),
+        index=False,
+    )
+    return pd.Series(route_hash_.values, index=aadt_route_hash.index)
+
+
+def get_aadt_crash_cache_version(crash_num_years):
+    """
+    Hash the code that merges the AADT and crash data and the merge parameters. The routes
+    in the cache are only valid for the code version and parameters they were made with.
+    """
+    version_hash = hashlib.sha256(str(crash_num_years).encode())
+    for module_name in (__name__, get_severity_index.__module__, interval_join.__module__):
+        version_hash.update(hash_file(inspect.getsourcefile(sys.modules[module_name])).encode())
+    return version_hash.hexdigest()
+
 
-    return aadt_crash_gdf_, aadt_but_no_crash_route_set_
+def merge_aadt_crash_incremental(aadt_gdf_, crash_gdf_, path_cache, crash_num_years=5, n_workers=1):
+    """
+    Merge the AADT and crash data, reusing the merged data of the routes whose AADT and crash
+    rows are the same as in the last run. The merged data is cached by route with a hash of
+    the route rows (see get_aadt_crash_route_hash), so that only new or changed routes are
+    merged with merge_aadt_crash. The cache is rebuilt when the merge code changes. Data issues
+    (see src.diagnostics) are only reported for the merged routes and the cached routes without
+    crash data.
+    Parameters
+    ----------
+    aadt_gdf_ : pd.DataFrame()
+        AADT data without a geometry column.
+    crash_gdf_: pd.DataFrame()
+        Crash data without a geometry column.
+    path_cache: str
+        Path to the parquet file with the merged data of each route.
+    crash_num_years : int
+        Number of years for which crash data is reported.
+    n_workers: int
+        Number of worker processes (see merge_aadt_crash).
+    Returns
+    -------
+    aadt_crash_df_ : pd.DataFrame()
+        Same as merge_aadt_crash.
+    aadt_but_no_crash_route_set : set
+        Set of route keys with AADT data that doesn't have associated crash data.
+    """
+    cache_version = get_aadt_crash_cache_version(crash_num_years)
+    route_hash = get_aadt_crash_route_hash(aadt_gdf_, crash_gdf_)
+    # The cache stores the position of each AADT segment in its route instead of its ID (see
+    # get_aadt_crash_route_hash).
+    aadt_seg_pos_df = aadt_gdf_.filter(items=["route_key", "aadt_seg_id"]).assign(
+        aadt_seg_pos=lambda df: df.groupby("route_key").cumcount().values
+    )
+    cache_df = None
+    n_cache_rows = 0
+    if os.path.isfile(path_cache):
+        cache_df_all = pd.read_parquet(path_cache)
+        n_cache_rows = len(cache_df_all)
+        if (cache_df_all.cache_version == cache_version).all():
+            # Drop the routes that changed or are no longer in the AADT data.
+            aadt_seg_id = aadt_seg_pos_df.set_index(["route_key", "aadt_seg_pos"]).aadt_seg_id
+            cache_df = (
+                cache_df_all.drop(columns="cache_version")
+                .loc[lambda df: df.route_hash.values == route_hash.reindex(df.route_key.values).values]
+                .assign(
+                    aadt_seg_id=lambda df: aadt_seg_id.reindex(
+                        pd.MultiIndex.from_arrays([df.route_key, df.aadt_seg_pos])
+                    ).values
+                )
+            )
+    if cache_df is None:
+        cache_df = pd.DataFrame(
+            {"route_key": pd.Series(dtype=np.int64), "aadt_but_no_crash": pd.Series(dtype=bool)}
+        )
+    new_route_keys = route_hash.index[~route_hash.index.isin(cache_df.route_key.unique())]
+    print(f"AADT and crash merge: {len(new_route_keys)} new or changed routes, "
+          f"{len(route_hash) - len(new_route_keys)} cached routes.")
+    add_diagnostics(ISSUE_NO_CRASH_DATA, route_key=cache_df.loc[cache_df.aadt_but_no_crash, "route_key"].unique())
+    if len(new_route_keys) != 0:
+        new_aadt_crash_df, new_aadt_but_no_crash_route_set = merge_aadt_crash(
+            aadt_gdf_=aadt_gdf_.loc[lambda df: df.route_key.isin(new_route_keys)],
+            crash_gdf_=crash_gdf_.loc[lambda df: df.route_key.isin(new_route_keys)],
+            crash_num_years=crash_num_years,
+            n_workers=n_workers,
+        )
+        new_aadt_crash_df = new_aadt_crash_df.assign(
+            aadt_seg_pos=lambda df: aadt_seg_pos_df.set_index("aadt_seg_id").aadt_seg_pos.reindex(
+                df.aadt_seg_id.values
+            ).values,
+            route_hash=lambda df: route_hash.reindex(df.route_key.values).values,
+            aadt_but_no_crash=lambda df: df.route_key.isin(new_aadt_but_no_crash_route_set),
+        )
+        # Concatenating an empty cache would change the data types of the merged data.
+        cache_df = pd.concat([cache_df, new_aadt_crash_df], ignore_index=True) if len(cache_df) else new_aadt_crash_df
+    if len(new_route_keys) != 0 or len(cache_df) != n_cache_rows:
+        with span("write") as write_span:
+            cache_df.assign(cache_version=cache_version).to_parquet(path_cache, index=False)
+            write_span["rows_out"] = len(cache_df)
+    aadt_but_no_crash_route_set_ = set(cache_df.loc[cache_df.aadt_but_no_crash, "route_key"])
+    # Cached and merged routes can have different categories. Use the categories of the AADT
+    # data, as merge_aadt_crash does.
+    cat_dtypes = {
+        col: aadt_gdf_[col].dtype
+        for col in cache_df.columns
+        if col in aadt_gdf_.columns and isinstance(aadt_gdf_[col].dtype, pd.CategoricalDtype)
+    }
+    aadt_crash_df_ = (
+        cache_df.drop(columns=["aadt_seg_pos", "route_hash", "aadt_but_no_crash"])
+        .astype(cat_dtypes)
+        .sort_values(["route_key", "aadt_interval_left"], kind="mergesort")
+        .reset_index(drop=True)
+    )
+    return aadt_crash_df_, aadt_but_no_crash_route_set_
+
+
+def bin_aadt_crash_by_route(aadt_gdf_, crash_gdf_, quiet=True):
+    """
+    Bin the crash data based on the AADT intervals one route at a time.
+    Parameters
+    ----------
+    aadt_gdf_ : gpd.GeoDataFrame()
+        AADT data.
+    crash_gdf_: gpd.GeoDataFrame()
+        Crash data.
+    quiet: bool
+        False, for debug mode.
+    Returns
+    -------
+    {
+        "aadt_gdf_1": aadt_gdf_1,
+        "crash_gdf_1": crash_gdf_1,
+        "aadt_but_no_crash_route_set": aadt_but_no_crash_route_set_,
+    } : dict
+        aadt_gdf_1: AADT data with corrected interval boundaries and a column for defining
+        interval.
+        crash_gdf_1: Crash data with a crosswalk to the AADT intervals. Empty if no route
+        has crash data.
+        aadt_but_no_crash_route_set: Set of route keys with AADT data that doesn't have
+        associated crash data.
+    """
+    # Group data by route #, county, route qual.
+    aadt_grp = aadt_gdf_.groupby(["route_key"])
+    crash_grp = crash_gdf_.groupby(["route_key"])
+    aadt_grp_keys = aadt_gdf_.groupby(["route_key"]).groups.keys()
+
+    aadt_grp_sub_dict = {}
+    crash_grp_sub_dict = {}
+    aadt_but_no_crash_route_list_ = list()
+    # Loop over aadt and crash data for a particular route and county and create a
+    # crosswalk in the crash data that allows us to merge it to the AADT data using
+    # the LRS (linear referencing system).
+    with span("route_loop"):
+        for aadt_grp_key in aadt_grp_keys:
+            aadt_grp_sub = aadt_grp.get_group(aadt_grp_key).copy()
+            # Bin the crash start milepost and end milepost based on AADT.
+            aadt_bin_df_dict = get_aadt_bin(aadt_grp_sub_=aadt_grp_sub)
+            aadt_grp_sub_dict[aadt_grp_key] = aadt_bin_df_dict["aadt_grp_sub_1"]
+            if not quiet:
+                print(f"Now processing route {aadt_grp_key}")
+            try:
+                crash_grp_sub = crash_grp.get_group(aadt_grp_key).copy()
+            except KeyError:
+                aadt_but_no_crash_route_list_.append(aadt_grp_key)
+                # continue
+            else:
+                crash_grp_sub_dict[aadt_grp_key] = bin_aadt_crash(
+                    aadt_lrs_bins=aadt_bin_df_dict["aadt_lrs_bins"],
+                    crash_grp_sub_=crash_grp_sub,
+                )
+    aadt_gdf_1 = pd.concat(aadt_grp_sub_dict.values()).sort_values(
+        ["route_key", "st_mp_pt"]
+    )
+
+    # Subset crash dataset with non-zero rows.
+    crash_grp_sub_no_empty_df_set = [
+        value for value in crash_grp_sub_dict.values() if len(value) != 0
+    ]
+    if len(crash_grp_sub_no_empty_df_set) != 0:
+        crash_gdf_1 = pd.concat(crash_grp_sub_no_empty_df_set)
+    else:
+        crash_gdf_1 = crash_gdf_.iloc[0:0]
+
+    # Get a list of routes with missing crash data.
+    for key, value in crash_grp_sub_dict.items():
+        if len(value) == 0:
+            aadt_but_no_crash_route_list_.append(key)
+    aadt_but_no_crash_route_set_ = set(aadt_but_no_crash_route_list_)
+    add_diagnostics(ISSUE_NO_CRASH_DATA, route_key=sorted(aadt_but_no_crash_route_set_))
+    return {
+        "aadt_gdf_1": aadt_gdf_1,
+        "crash_gdf_1": crash_gdf_1,
+        "aadt_but_no_crash_route_set": aadt_but_no_crash_route_set_,
+    }
+
+
+def bin_aadt_crash_statewide(aadt_gdf_, crash_gdf_):
+    """
+    Bin the crash data based on the AADT intervals for all routes in a single pass. Both
+    tables are sorted once by route and start milepost, and the overlapping AADT
+    intervals are fixed with a grouped shift. Gives the same output as
+    bin_aadt_crash_by_route.
+    Parameters
+    ----------
+    aadt_gdf_ : gpd.GeoDataFrame()
+        AADT data.
+    crash_gdf_: gpd.GeoDataFrame()
+        Crash data.
+    Returns
+    -------
+    {
+        "aadt_gdf_1": aadt_gdf_1,
+        "crash_gdf_1": crash_gdf_1,
+        "aadt_but_no_crash_route_set": aadt_but_no_crash_route_set_,
+    } : dict
+        See bin_aadt_crash_by_route.
+    """
+    aadt_gdf_1 = aadt_gdf_.sort_values(["route_key", "st_mp_pt"], kind="mergesort").assign(
+        st_mp_pt_shift1=lambda df: (
+            df.groupby("route_key", sort=False).st_mp_pt.shift(-1).fillna(df.end_mp_pt)
+        ),
+        overlapping_interval=lambda df: (df.st_mp_pt_shift1 - df.end_mp_pt).lt(0),
+        end_mp_pt_cor=lambda df: df[["end_mp_pt", "st_mp_pt_shift1"]].min(axis=1),
+        st_end_diff=lambda df: df.end_mp_pt - df.st_mp_pt,
+    )
+    overlapping_interval = aadt_gdf_1.overlapping_interval.values
+    if overlapping_interval.any():
+        add_diagnostics(
+            ISSUE_OVERLAPPING_AADT_INTERVAL,
+            route_key=aadt_gdf_1.route_key.values[overlapping_interval],
+            row_idx=aadt_gdf_1.index.values[overlapping_interval],
+        )
+    aadt_lrs_bins = pd.IntervalIndex.from_arrays(
+        aadt_gdf_1.st_mp_pt, aadt_gdf_1.end_mp_pt_cor, closed="left"
+    )
+    aadt_gdf_1.loc[:, "aadt_interval"] = aadt_lrs_bins
+
+    # Routes with AADT data but no crash data.
+    aadt_route_set = set(aadt_gdf_1.route_key.unique())
+    crash_route_set = set(crash_gdf_.route_key.unique())
+    aadt_but_no_crash_route_set_ = aadt_route_set - crash_route_set
+    add_diagnostics(ISSUE_NO_CRASH_DATA, route_key=sorted(aadt_but_no_crash_route_set_))
+
+    # Find overlapping intervals between the crash and aadt data on the same route.
+    crash_gdf_fil = crash_gdf_.loc[lambda df: df.route_key.isin(aadt_route_set)].sort_values(
+        ["route_key", "st_mp_pt"]
+    )
+    crash_aadt_pairs = interval_join(
+        left_start=crash_gdf_fil.st_mp_pt,
+        left_end=crash_gdf_fil.end_mp_pt,
+        right_start=aadt_lrs_bins.left,
+        right_end=aadt_lrs_bins.right,
+        left_key=crash_gdf_fil.route_key.values,
+        right_key=aadt_gdf_1.route_key.values,
+        how="left",
+    )
+    crash_gdf_1 = crash_gdf_fil.iloc[crash_aadt_pairs.left_idx.values].reset_index(drop=True)
+    crash_gdf_1["aadt_interval"] = aadt_lrs_bins.take(
+        crash_aadt_pairs.right_idx.values, allow_fill=True, fill_value=np.nan
+    )
+    crash_gdf_1 = reorder_columns(
+        df=crash_gdf_1,
+        first_cols=[
+            "route_gis",
+            "route_key",
+            "route_class",
+            "route_qual",
+            "route_inventory",
+            "route_no",
+            "route_county",
+            "aadt_interval",
+            "st_mp_pt",
+            "end_mp_pt",
+        ],
+    )
+    return {
+        "aadt_gdf_1": aadt_gdf_1,
+        "crash_gdf_1": crash_gdf_1,
+        "aadt_but_no_crash_route_set": aadt_but_no_crash_route_set_,
+    }
+
+
+def get_route_shards(route_row_cnt_, n_shards):
+    """
+    Split routes into shards with a balanced number of rows. Routes are assigned from the
+    largest to the smallest to the shard with the fewest rows so far.
+    Parameters
+    ----------
+    route_row_cnt_: pd.Series
+        Number of rows (AADT + crash) for each route, indexed by route key.
+    n_shards: int
+        Number of shards.
+    Returns
+    -------
+    route_shards_: list
+        List of route key lists, one for each non-empty shard.
+    """
+    route_row_cnt_sorted = route_row_cnt_.sort_index().sort_values(ascending=False, kind="mergesort")
+    shard_heap = [(0, shard_no) for shard_no in range(n_shards)]
+    route_shards_ = [[] for _ in range(n_shards)]
+    for route_key, row_cnt in route_row_cnt_sorted.items():
+        shard_row_cnt, shard_no = heapq.heappop(shard_heap)
+        route_shards_[shard_no].append(route_key)
+        heapq.heappush(shard_heap, (shard_row_cnt + row_cnt, shard_no))
+    return [route_shard for route_shard in route_shards_ if len(route_shard) != 0]
+
+
+def bin_aadt_crash_parallel(aadt_gdf_, crash_gdf_, n_workers, statewide=True):
+    """
+    Bin the crash data based on the AADT intervals in a pool of worker processes. Routes are
+    independent, so the routes are split into shards with a balanced number of rows and
+    the results are merged back in route order. Gives the same output as a serial run.
+    Parameters
+    ----------
+    aadt_gdf_ : gpd.GeoDataFrame()
+        AADT data.
+    crash_gdf_: gpd.GeoDataFrame()
+        Crash data.
+    n_workers: int
+        Number of worker processes.
+    statewide: bool
+        True, use bin_aadt_crash_statewide within each shard. False, use
+        bin_aadt_crash_by_route.
+    Returns
+    -------
+    {
+        "aadt_gdf_1": aadt_gdf_1,
+        "crash_gdf_1": crash_gdf_1,
+        "aadt_but_no_crash_route_set": aadt_but_no_crash_route_set_,
+    } : dict
+        See bin_aadt_crash_by_route.
+    """
+    crash_gdf_fil = crash_gdf_.loc[lambda df: df.route_key.isin(aadt_gdf_.route_key.unique())]
+    route_row_cnt = aadt_gdf_.route_key.value_counts().add(
+        crash_gdf_fil.route_key.value_counts(), fill_value=0
+    )
+    route_shards = get_route_shards(route_row_cnt_=route_row_cnt, n_shards=n_workers)
+    aadt_shards = [aadt_gdf_.loc[lambda df: df.route_key.isin(shard)] for shard in route_shards]
+    crash_shards = [crash_gdf_fil.loc[lambda df: df.route_key.isin(shard)] for shard in route_shards]
+    bin_func = bin_aadt_crash_statewide if statewide else bin_aadt_crash_by_route
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        shard_results = []
+        # Add the data issues found in the worker processes to the diagnostics of this process.
+        for shard_result, shard_diagnostics in executor.map(
+            run_with_diagnostics, repeat(bin_func), aadt_shards, crash_shards
+        ):
+            shard_results.append(shard_result)
+            extend_diagnostics(shard_diagnostics)
+
+    # Each route is in a single shard, so a stable sort on the route key recovers the order
+    # of a serial run.
+    aadt_gdf_1 = pd.concat([result["aadt_gdf_1"] for result in shard_results]).sort_values(
+        ["route_key", "st_mp_pt"], kind="mergesort"
+    )
+    crash_gdf_1 = pd.concat([result["crash_gdf_1"] for result in shard_results])
+    crash_gdf_1 = crash_gdf_1.iloc[
+        np.argsort(crash_gdf_1.route_key.values, kind="mergesort")
+    ].reset_index(drop=True)
+    aadt_but_no_crash_route_set_ = set().union(
+        *[result["aadt_but_no_crash_route_set"] for result in shard_results]
+    )
+    return {
+        "aadt_gdf_1": aadt_gdf_1,
+        "crash_gdf_1": crash_gdf_1,
+        "aadt_but_no_crash_route_set": aadt_but_no_crash_route_set_,
+    }
 
 
 def get_aadt_bin(aadt_grp_sub_):
@@ -265,12 +645,12 @@ def get_aadt_bin(aadt_grp_sub_):
         end_mp_pt_cor=lambda df: df[["end_mp_pt", "st_mp_pt_shift1"]].min(axis=1),
         st_end_diff=lambda df: df.end_mp_pt - df.st_mp_pt,
     )
-    if aadt_grp_sub_1.overlapping_interval.any():
-        print(
-            f"Fixing issue with overlapping interval in "
-            f"route {aadt_grp_sub_1[['route_class', 'route_qual', 'route_no', 'route_county']].head(1)}"
-            f" for the following rows: \n"
-            f"{aadt_grp_sub_1.loc[aadt_grp_sub_1.overlapping_interval, ['st_mp_pt', 'end_mp_pt', 'st_mp_pt_shift1', 'end_mp_pt_cor']]}"
+    overlapping_interval = aadt_grp_sub_1.overlapping_interval.values
+    if overlapping_interval.any():
+        add_diagnostics(
+            ISSUE_OVERLAPPING_AADT_INTERVAL,
+            route_key=aadt_grp_sub_1.route_key.values[overlapping_interval],
+            row_idx=aadt_grp_sub_1.index.values[overlapping_interval],
         )
 
     # Create interval index from aadt data that would be used to cut the crash data.
@@ -298,46 +678,28 @@ def bin_aadt_crash(aadt_lrs_bins, crash_grp_sub_):
     """
 
     # Find overlaping intervals between the crash and aadt data.
-    crash_grp_sub_aadt_interval_ = crash_grp_sub_.copy()
-    crash_grp_sub_aadt_interval_ = (
-        crash_grp_sub_aadt_interval_.assign(
-            crash_interval=lambda df: pd.IntervalIndex.from_arrays(
-                df.st_mp_pt, df.end_mp_pt, closed="left"
-            ),
-            aadt_interval_list=lambda df: df.crash_interval.apply(
-                lambda x: [
-                    interval for interval in aadt_lrs_bins if x.overlaps(interval)
-                ]
-            ),
-        )
-        .drop(columns=["crash_interval"])
-        .sort_values(["route_gis", "st_mp_pt"])
+    crash_grp_sub_aadt_interval_ = crash_grp_sub_.sort_values(["route_key", "st_mp_pt"])
+    crash_aadt_pairs = interval_join(
+        left_start=crash_grp_sub_aadt_interval_.st_mp_pt,
+        left_end=crash_grp_sub_aadt_interval_.end_mp_pt,
+        right_start=aadt_lrs_bins.left,
+        right_end=aadt_lrs_bins.right,
+        how="left",
     )
-    # Convert the list of overlapping crash data intervals into new rows.
-    crash_grp_sub_aadt_interval_long_ = (
-        crash_grp_sub_aadt_interval_.aadt_interval_list.apply(pd.Series)
-        .merge(
-            crash_grp_sub_aadt_interval_[
-                ["route_gis", "st_mp_pt", "aadt_interval_list"]
-            ],
-            left_index=True,
-            right_index=True,
-        )
-        .drop(["aadt_interval_list"], axis=1)
-        .melt(id_vars=["route_gis", "st_mp_pt"], value_name="aadt_interval")
-        .drop("variable", axis=1)
-        .dropna()
+    # Create one row for each overlapping crash and AADT interval. Crash intervals without
+    # an overlapping AADT interval are kept with a missing AADT interval.
+    crash_grp_sub_aadt_interval_long_ = crash_grp_sub_aadt_interval_.iloc[
+        crash_aadt_pairs.left_idx.values
+    ].reset_index(drop=True)
+    crash_grp_sub_aadt_interval_long_["aadt_interval"] = aadt_lrs_bins.take(
+        crash_aadt_pairs.right_idx.values, allow_fill=True, fill_value=np.nan
     )
-    # Add the orignal set of columns to the crash_grp_sub_aadt_interval_long_.
-    # Need to do a left merge so the new DataFrame is a GeoDataFrame.
-    crash_grp_sub_aadt_interval_long_ = crash_grp_sub_aadt_interval_.drop(
-        columns="aadt_interval_list"
-    ).merge(crash_grp_sub_aadt_interval_long_, on=["route_gis", "st_mp_pt"], how="left")
     # Reorder the data new crash GeoDataFrame.
     crash_grp_sub_aadt_interval_long_ = reorder_columns(
         df=crash_grp_sub_aadt_interval_long_,
         first_cols=[
             "route_gis",
+            "route_key",
             "route_class",
             "route_qual",
             "route_inventory",
@@ -351,68 +713,79 @@ def bin_aadt_crash(aadt_lrs_bins, crash_grp_sub_):
     return crash_grp_sub_aadt_interval_long_
 
 
-def scale_crash_by_seg_len(crash_gdf_2_):
+def get_crash_aadt_weight_matrix(crash_gdf_2_):
     """
-    Consider the crashes to be uniformly distributed along the crash segment.
-    Scale the crashes based on the length of the crash segment and position of
-    crash segment w.r.t AADT segment.
+    Create a sparse weight matrix between the AADT intervals (rows) and the crash segments
+    (columns). The weight is the length of the crash segment inside the AADT interval
+    divided by the length of the crash segment.
     Parameters
     ----------
-    crash_gdf_2_ : gpd.GeoDataFrame
-        Crash data with AADT bins.
+    crash_gdf_2_ : pd.DataFrame
+        Crash data with AADT bins. One row for each crash segment and AADT interval pair.
     Returns
     -------
-    crash_gdf_2_adj_crash_freq_by_len_ : crash_gdf_2_ with crash frequency adjusted based
-    on the length of the crash segment and position of crash segment w.r.t AADT segment.
+    {
+        "weight_matrix": weight_matrix,
+        "aadt_interval_no": aadt_interval_no,
+        "crash_seg_no": crash_seg_no,
+        "seg_len_in_interval": seg_len_in_interval,
+    } : dict
+        weight_matrix: scipy.sparse.csr_matrix with one row for each AADT interval, sorted
+        by route and interval, and one column for each crash segment.
+        aadt_interval_no: row of the weight matrix for each row of crash_gdf_2_.
+        crash_seg_no: column of the weight matrix for each row of crash_gdf_2_.
+        seg_len_in_interval: length of the crash segment inside the AADT interval for each
+        row of crash_gdf_2_.
     """
-    crash_gdf_2_adj_crash_freq_by_len_ = (
-        crash_gdf_2_.assign(
-            aadt_interval_left=lambda df: pd.IntervalIndex(df.aadt_interval).left,
-            aadt_interval_right=lambda df: pd.IntervalIndex(df.aadt_interval).right,
-            crash_seg_cat=lambda df: np.select(
-                [
-                    (df.st_mp_pt < df.aadt_interval_left)
-                    & (df.end_mp_pt <= df.aadt_interval_right),
-                    (df.st_mp_pt < df.aadt_interval_left)
-                    & (df.end_mp_pt > df.aadt_interval_right),
-                    (df.st_mp_pt >= df.aadt_interval_left)
-                    & (df.end_mp_pt <= df.aadt_interval_right),
-                    (df.st_mp_pt >= df.aadt_interval_left)
-                    & (df.end_mp_pt > df.aadt_interval_right),
-                ],
-                [
-                    "left_extra_len",
-                    "left_right_extra_len",
-                    "no_extra_len",
-                    "right_extra_len",
-                ],
-                "error",
-            ),
-            seg_len_in_interval=lambda df: np.select(
-                [
-                    df.crash_seg_cat == "left_extra_len",
-                    df.crash_seg_cat == "left_right_extra_len",
-                    df.crash_seg_cat == "no_extra_len",
-                    df.crash_seg_cat == "right_extra_len",
-                ],
-                [
-                    df.st_end_diff - (df.aadt_interval_left - df.st_mp_pt),
-                    df.aadt_interval_right - df.aadt_interval_left,
-                    df.st_end_diff,
-                    df.st_end_diff - (df.end_mp_pt - df.aadt_interval_right),
-                ],
-                np.nan,
-            ),
-            ratio_len_in_interval=lambda df: df.seg_len_in_interval / df.st_end_diff,
-            ka_cnt=lambda df: df.ratio_len_in_interval * df.ka_cnt,
-            bc_cnt=lambda df: df.ratio_len_in_interval * df.bc_cnt,
-            pdo_cnt=lambda df: df.ratio_len_in_interval * df.pdo_cnt,
-            total_cnt=lambda df: df.ratio_len_in_interval * df.total_cnt,
-        )
-        .drop(columns=["shape_len_mi"])
-        .filter(
-            items=[
-                "route_gis",
+    aadt_interval = pd.IntervalIndex(crash_gdf_2_.aadt_interval)
+    aadt_interval_grp = crash_gdf_2_.assign(
+        aadt_interval_left=aadt_interval.left, aadt_interval_right=aadt_interval.right
+    ).groupby(["route_key", "aadt_interval_left", "aadt_interval_right"], sort=True)
+    crash_seg_grp = crash_gdf_2_.groupby(["route_key", "st_mp_pt", "end_mp_pt"], sort=False)
+    aadt_interval_no = aadt_interval_grp.ngroup().values
+    crash_seg_no = crash_seg_grp.ngroup().values
+    seg_len_in_interval = (
+        np.minimum(crash_gdf_2_.end_mp_pt.values, aadt_interval.right.values)
+        - np.maximum(crash_gdf_2_.st_mp_pt.values, aadt_interval.left.values)
+    )
+    # Zero length crash segments do not add crashes to the AADT interval.
+    st_end_diff = crash_gdf_2_.st_end_diff.values
+    ratio_len_in_interval = np.divide(
+        seg_len_in_interval,
+        st_end_diff,
+        out=np.zeros(len(st_end_diff)),
+        where=st_end_diff != 0,
+    )
+    weight_matrix = sparse.csr_matrix(
+        (ratio_len_in_interval, (aadt_interval_no, crash_seg_no)),
+        shape=(aadt_interval_grp.ngroups, crash_seg_grp.ngroups),
+    )
+    return {
+        "weight_matrix": weight_matrix,
+        "aadt_interval_no": aadt_interval_no,
+        "crash_seg_no": crash_seg_no,
+        "seg_len_in_interval": seg_len_in_interval,
+    }
+
+
+def get_crash_no_duplicates(crash_gdf_1_):
+    """
+    Subset the binned crash data to the columns used for scaling the crashes, with one row
+    for each route, AADT interval, and crash segment start milepost.
+    Parameters
+    ----------
+    crash_gdf_1_ : pd.DataFrame
+        Crash data with AADT bins (see bin_aadt_crash_statewide).
+    Returns
+    -------
+    crash_gdf_no_duplicates_ : pd.DataFrame
+        Input to scale_crash_by_seg_len.
+    """
+    crash_gdf_no_duplicates_ = (
+        crash_gdf_1_.loc[
+            :,
+            [
+                "route_key",
                 "aadt_interval",
                 "ka_cnt",
                 "bc_cnt",
@@ -422,37 +795,89 @@ def scale_crash_by_seg_len(crash_gdf_2_):
                 "end_mp_pt",
                 "shape_len_mi",
                 "st_end_diff",
-                "crash_seg_cat",
-                "seg_len_in_interval",
-                "ratio_len_in_interval",
-                "geometry",
-            ]
+            ],
+        ]
+        .drop_duplicates(["route_key", "aadt_interval", "st_mp_pt"])
+        .sort_values(["route_key", "st_mp_pt"])
+    )
+    return crash_gdf_no_duplicates_
+
+
+def scale_crash_by_seg_len(crash_gdf_2_, cnt_cols=("ka_cnt", "bc_cnt", "pdo_cnt", "total_cnt")):
+    """
+    Consider the crashes to be uniformly distributed along the crash segment.
+    Scale the crashes based on the length of the crash segment and position of
+    crash segment w.r.t AADT segment, and aggregate them on the AADT intervals.
+    Parameters
+    ----------
+    crash_gdf_2_ : gpd.GeoDataFrame
+        Crash data with AADT bins.
+    cnt_cols: tuple
+        Crash count columns to scale.
+    Returns
+    -------
+    crash_df_2_adj_crash_freq_by_len_ : pd.DataFrame
+        One row for each AADT interval with the crash frequency adjusted based on the
+        length of the crash segment and position of crash segment w.r.t AADT segment, the
+        minimum start and maximum end milepost of the crash segments, and the summed crash
+        segment length ("st_end_diff") and length inside the AADT interval
+        ("seg_len_in_interval").
+    """
+    crash_df_2 = pd.DataFrame(crash_gdf_2_.loc[lambda df: ~df.aadt_interval.isna()])
+    weight_dict = get_crash_aadt_weight_matrix(crash_df_2)
+    row_no = pd.Series(np.arange(len(crash_df_2)))
+    # First row of each AADT interval (matrix row) and each crash segment (matrix column).
+    aadt_interval_first_row = row_no.groupby(weight_dict["aadt_interval_no"]).first().values
+    crash_seg_first_row = row_no.groupby(weight_dict["crash_seg_no"]).first().values
+    crash_df_2_adj_crash_freq_by_len_ = (
+        crash_df_2.assign(seg_len_in_interval=weight_dict["seg_len_in_interval"])
+        .groupby(weight_dict["aadt_interval_no"], sort=True)
+        .agg(
+            st_mp_pt=("st_mp_pt", "min"),
+            end_mp_pt=("end_mp_pt", "max"),
+            st_end_diff=("st_end_diff", "sum"),
+            seg_len_in_interval=("seg_len_in_interval", "sum"),
         )
+        .reset_index(drop=True)
+    )
+    crash_df_2_adj_crash_freq_by_len_.insert(
+        0, "route_key", crash_df_2.route_key.values[aadt_interval_first_row]
     )
-    return crash_gdf_2_adj_crash_freq_by_len_
+    crash_df_2_adj_crash_freq_by_len_.insert(
+        1, "aadt_interval", crash_df_2.aadt_interval.array[aadt_interval_first_row]
+    )
+    for cnt_col in cnt_cols:
+        crash_seg_cnt = np.nan_to_num(crash_df_2[cnt_col].values[crash_seg_first_row])
+        crash_df_2_adj_crash_freq_by_len_[cnt_col] = weight_dict["weight_matrix"] @ crash_seg_cnt
+    return crash_df_2_adj_crash_freq_by_len_
 
 
 def get_missing_aadt_gdf(aadt_gdf__, aadt_but_no_crash_route_set__):
-    return aadt_gdf__.query("route_id in @aadt_but_no_crash_route_set__")
+    return aadt_gdf__.loc[lambda df: df.route_key.isin(aadt_but_no_crash_route_set__)]
 
 
 def get_missing_crash_gdf(crash_gdf__, aadt_but_no_crash_route_set__):
-    return crash_gdf__.query("route_gis in @aadt_but_no_crash_route_set__")
+    return crash_gdf__.loc[lambda df: df.route_key.isin(aadt_but_no_crash_route_set__)]
 
 
 # if __name__ == "__main__":
-def run_aadt_crash_merge():
+def run_aadt_crash_merge(
+    n_workers=DevConfig.N_WORKERS_AADT_CRASH_MERGE, incremental=DevConfig.INCREMENTAL_AADT_CRASH_MERGE
+):
     # Set the paths to relevant files and folders.
     # Load crash and aadt data.
     # ************************************************************************************
     path_to_prj_dir = get_project_root()
     path_interim_data = os.path.join(path_to_prj_dir, DevConfig.DIR_NAME_DATA, DevConfig.DIR_NAME_INTERIM)
-    path_crash_si = os.path.join(path_interim_data, DevConfig.INTERIM_GPKG_SAFETY)
-    path_aadt_nc = os.path.join(path_interim_data, DevConfig.INTERIM_GPKG_AADT)
-    crash_gdf = gpd.read_file(path_crash_si, driver="gpkg")
-    aadt_gdf = gpd.read_file(path_aadt_nc, driver="gpkg")
+    path_crash_si = get_interim_file(os.path.join(path_interim_data, DevConfig.INTERIM_GPKG_SAFETY))
+    path_aadt_nc = get_interim_file(os.path.join(path_interim_data, DevConfig.INTERIM_GPKG_AADT))
+    # Work on the attributes only. The AADT geometry is attached by aadt_seg_id before
+    # writing the output.
+    crash_gdf = read_df(path_crash_si, schema=CRASH_SCHEMA)
+    aadt_gdf = read_df(path_aadt_nc, schema=SEGMENT_SCHEMA)
+    aadt_geometry = read_geometry(path_aadt_nc, key="aadt_seg_id")
     aadt_gdf = aadt_gdf.query("route_class in [1, 2, 3]")
-    crash_gdf = crash_gdf.query("route_class in [1, 2, 3]").sort_values(["route_gis", "st_mp_pt"])
+    crash_gdf = crash_gdf.query("route_class in [1, 2, 3]").sort_values(["route_key", "st_mp_pt"])
     # crash_gdf_95_40 = crash_gdf.query("route_no in [40, 95]")
     # aadt_gdf_95_40 = aadt_gdf.query("route_no in [40, 95]")
     # Merge aadt and crash data. Fix issues with overlapping intervals.
@@ -466,13 +891,21 @@ def run_aadt_crash_merge():
     #     crash_gdf_=crash_gdf,
     #     quiet=True
     # )
-    aadt_crash_gdf, aadt_but_no_crash_route_set = merge_aadt_crash(
-        aadt_gdf_=aadt_gdf, crash_gdf_=crash_gdf, quiet=True
-    )
+    if incremental:
+        path_cache = os.path.join(path_interim_data, DevConfig.INTERIM_PARQUET_AADT_CRASH_CACHE)
+        aadt_crash_gdf, aadt_but_no_crash_route_set = merge_aadt_crash_incremental(
+            aadt_gdf_=aadt_gdf, crash_gdf_=crash_gdf, path_cache=path_cache, n_workers=n_workers
+        )
+    else:
+        aadt_crash_gdf, aadt_but_no_crash_route_set = merge_aadt_crash(
+            aadt_gdf_=aadt_gdf, crash_gdf_=crash_gdf, quiet=True, n_workers=n_workers
+        )
     # Ouput the gpkg file for aadt+crash data.
     # ************************************************************************************
-    out_file_aadt_crash = os.path.join(path_interim_data, DevConfig.INTERIM_GPKG_AADT_SAFETY_MERGE)
-    aadt_crash_gdf.to_file(out_file_aadt_crash, driver="GPKG")
+    out_file_aadt_crash = get_interim_file(
+        os.path.join(path_interim_data, DevConfig.INTERIM_GPKG_AADT_SAFETY_MERGE)
+    )
+    write_gdf(attach_geometry(aadt_crash_gdf, aadt_geometry, key="aadt_seg_id"), out_file_aadt_crash)
     # Ouput the file showing routes with AADT but no crash data.
     # ************************************************************************************
     failed_merge_aadt_crash_dat = get_missing_aadt_gdf(
@@ -480,7 +913,7 @@ def run_aadt_crash_merge():
     )
     failed_merge_aadt_dat = get_missing_aadt_gdf(
         aadt_gdf, aadt_but_no_crash_route_set
-    ).sort_values(["route_id", "st_mp_pt"])
+    ).sort_values(["route_key", "st_mp_pt"])
     failed_merge_crash_dat = get_missing_crash_gdf(
         crash_gdf, aadt_but_no_crash_route_set
-    ).sort_values(["route_gis", "st_mp_pt"])
+    ).sort_values(["route_key", "st_mp_pt"])
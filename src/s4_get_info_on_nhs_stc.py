@@ -4,8 +4,9 @@ Explore NHS, STC routes. Create shapefiles for visualizing NHS and STC routes.
 from io import StringIO
 import pandas as pd
 import os
-from src.utils import get_project_root
-import geopandas as gpd
+from src.utils import get_project_root, get_interim_file, read_gdf, SEGMENT_SCHEMA
+from src.run_report import span
+from src.diagnostics import add_diagnostics, ISSUE_ROUTE_NOT_IN_HPMS
 import numpy as np
 from Config import DataConfig, DevConfig
 
@@ -136,6 +137,57 @@ def routes_in_hpms_nhs(hpms_nc_, stc_df_):
     return hpms_nc_fil_stc
 
 
+def get_route_nat_imp(aadt_gdf_fil_, hpms_nc_, stc_df_):
+    """
+    Get the national importance factor and category of the routes in the AADT data from the
+    HPMS NHS routes and the NC strategic transportation routes.
+    Parameters
+    ----------
+    aadt_gdf_fil_: pd.DataFrame()
+        AADT data for 1: interstate, 2: US Route, 3: NC Route.
+    hpms_nc_: pd.DataFrame()
+        HPMS 20XX NC data.
+    stc_df_: pd.DataFrame()
+        North Carolina strategic transportation routes.
+    Returns
+    -------
+    aadt_nhs_stc_df_: pd.DataFrame()
+        One row for each route with the columns "stc", "nhs_net", "nat_imp_fac", and
+        "nat_imp_cat".
+    """
+    # Find routes in hpms nhs and not in stc
+    # ************************************************************************************
+    hpms_nc_fil = routes_in_hpms_nhs(hpms_nc_=hpms_nc_, stc_df_=stc_df_)
+    # Get route IDs with NHS and STC info
+    # ************************************************************************************
+    hpms_nc_fil_1 = hpms_nc_fil.filter(items=["route_id", "stc", "nhs_net"])
+    aadt_gdf_fil_route = aadt_gdf_fil_.filter(items=["route_id", "route_key"]).drop_duplicates("route_key")
+    aadt_nhs_stc_df_ = aadt_gdf_fil_route.merge(hpms_nc_fil_1, on="route_id", how="left")
+    aadt_nhs_stc_df_[["stc", "nhs_net"]] = aadt_nhs_stc_df_[["stc", "nhs_net"]].fillna(False)
+    # aadt_nhs_stc_df_.columns
+    aadt_nhs_stc_df_ = aadt_nhs_stc_df_.assign(
+        nat_imp_fac=lambda df: np.select(
+            [
+                df.nhs_net == True,
+                (df.stc == True) & (df.nhs_net == False),
+                (df.stc == False) & (df.nhs_net == False),
+            ],
+            [1, 0.5, 0],
+            "error",
+        ),
+        nat_imp_cat=lambda df: np.select(
+            [
+                df.nhs_net == True,
+                (df.stc == True) & (df.nhs_net == False),
+                (df.stc == False) & (df.nhs_net == False),
+            ],
+            ["nhs", "stc_but_not_nhs", "other"],
+            "error",
+        ),
+    )
+    return aadt_nhs_stc_df_
+
+
 # if __name__ == "__main__":
 def run_get_info_on_nhs_stc():
     # Set the paths to relevant files and folders.
@@ -146,10 +198,10 @@ def run_get_info_on_nhs_stc():
     path_to_prj_dir = get_project_root()
     path_to_prj_data = os.path.join(path_to_prj_dir, DevConfig.DIR_NAME_DATA, DevConfig.DIR_NAME_RAW)
     path_interim_data = os.path.join(path_to_prj_dir, DevConfig.DIR_NAME_DATA, DevConfig.DIR_NAME_INTERIM)
-    path_aadt_nc = os.path.join(path_interim_data, DevConfig.INTERIM_GPKG_AADT)
+    path_aadt_nc = get_interim_file(os.path.join(path_interim_data, DevConfig.INTERIM_GPKG_AADT))
     path_hpms = os.path.join(path_to_prj_data, DataConfig.DIR_HPMS, DataConfig.SHAPEFILE_HPMS)
-    hpms_nc = gpd.read_file(path_hpms)
-    aadt_gdf = gpd.read_file(path_aadt_nc, driver="gpkg")
+    hpms_nc = read_gdf(path_hpms)
+    aadt_gdf = read_gdf(path_aadt_nc, schema=SEGMENT_SCHEMA)
     aadt_gdf_fil = aadt_gdf.loc[lambda df: df.route_class.isin([1, 2, 3])]
     stc_df = get_strategic_trans_cor().assign(stc=True)
 
@@ -162,41 +214,21 @@ def run_get_info_on_nhs_stc():
     aadt_gdf_fil_test_missing_routes = aadt_gdf_fil.loc[
         lambda df: df.route_id.isin(routes_in_aadt_not_hpms)
     ]
+    add_diagnostics(
+        ISSUE_ROUTE_NOT_IN_HPMS,
+        route_key=aadt_gdf_fil_test_missing_routes.route_key.values,
+        row_idx=aadt_gdf_fil_test_missing_routes.index.values,
+    )
     print(
-        f"HPMS has info on all routes in the AADT layer expect for the following"
-        f" :{aadt_gdf_fil_test_missing_routes.route_id.values}"
+        f"HPMS has info on all routes in the AADT layer expect for {len(routes_in_aadt_not_hpms)} routes"
+        f" (see the {ISSUE_ROUTE_NOT_IN_HPMS} diagnostics)"
     )
-    # Find routes in hpms nhs and not in stc
-    # ************************************************************************************
-    hpms_nc_fil = routes_in_hpms_nhs(hpms_nc_=hpms_nc, stc_df_=stc_df)
     # Get route IDs with NHS and STC info
     # ************************************************************************************
-    hpms_nc_fil_1 = hpms_nc_fil.filter(items=["route_id", "stc", "nhs_net"])
-    aadt_gdf_fil_route = aadt_gdf_fil.filter(items=["route_id"]).drop_duplicates()
-    aadt_nhs_stc_df = aadt_gdf_fil_route.merge(hpms_nc_fil_1, on="route_id", how="left")
-    aadt_nhs_stc_df[["stc", "nhs_net"]] = aadt_nhs_stc_df[["stc", "nhs_net"]].fillna(False)
-    # aadt_nhs_stc_df.columns
-    aadt_nhs_stc_df = aadt_nhs_stc_df.assign(
-        nat_imp_fac=lambda df: np.select(
-            [
-                df.nhs_net == True,
-                (df.stc == True) & (df.nhs_net == False),
-                (df.stc == False) & (df.nhs_net == False),
-            ],
-            [1, 0.5, 0],
-            "error",
-        ),
-        nat_imp_cat=lambda df: np.select(
-            [
-                df.nhs_net == True,
-                (df.stc == True) & (df.nhs_net == False),
-                (df.stc == False) & (df.nhs_net == False),
-            ],
-            ["nhs", "stc_but_not_nhs", "other"],
-            "error",
-        ),
-    )
+    aadt_nhs_stc_df = get_route_nat_imp(aadt_gdf_fil_=aadt_gdf_fil, hpms_nc_=hpms_nc, stc_df_=stc_df)
     # Output routes in hpms nhs and not in stc
     # ************************************************************************************
     out_path_hpms_nc_fil = os.path.join(path_interim_data, DevConfig.INTERIM_CSV_NHS_STC_ROUTES)
-    aadt_nhs_stc_df.to_csv(out_path_hpms_nc_fil, index=False)
+    with span("write") as write_span:
+        aadt_nhs_stc_df.to_csv(out_path_hpms_nc_fil, index=False)
+        write_span["rows_out"] = len(aadt_nhs_stc_df)
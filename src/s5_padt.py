@@ -3,45 +3,48 @@ import os
 import numpy as np
 import pandas as pd
 import geopandas as gpd
-from src.utils import get_project_root
+import shapely
+from src.utils import get_project_root, get_interim_file, read_gdf, read_shp, write_gdf, reorder_columns
+from src.utils import reproject_geometry, SEGMENT_SCHEMA
+from src.run_report import span
 import inflection
 import re
 from sklearn.preprocessing import minmax_scale
 from Config import DataConfig, DevConfig
 
 
-# if __name__ == "__main__":
-def run_padt_processing():
-    path_to_prj_dir = get_project_root()
-    path_to_raw = os.path.join(path_to_prj_dir, DevConfig.DIR_NAME_DATA, DevConfig.DIR_NAME_RAW)
-    path_interim_data = os.path.join(path_to_prj_dir, DevConfig.DIR_NAME_DATA, DevConfig.DIR_NAME_INTERIM)
-    path_to_padt = os.path.join(path_to_raw, DataConfig.DIR_SEG_T3)
-    path_to_padt_shapefile = os.path.join(path_to_padt, DataConfig.SHAPEFILE_SEG_T3)
-    path_processed_data = os.path.join(path_to_prj_dir, DevConfig.DIR_NAME_DATA, DevConfig.DIR_NAME_PROCESSED)
-    if not os.path.isdir(path_processed_data):  # Check if interim data directory exists
-        os.mkdir(path_processed_data)  # Create interim data directory if it doesn't exist already
-    path_aadt_crash_si = os.path.join(path_interim_data, DevConfig.INTERIM_GPKG_AADT_SAFETY_MERGE)
-    crash_aadt_fil_si_geom_gdf = gpd.read_file(path_aadt_crash_si, driver="gpkg")
-    route_id_lrs_gdf = crash_aadt_fil_si_geom_gdf.filter(
-        items=[
-            "route_id",
-            "aadt_interval_left",
-            "aadt_interval_right",
-            "route_class",
-            "route_qual",
-            "route_inventory",
-            "route_county",
-            "route_no",
-            "geometry",
-        ]
-    ).assign(
-        business_route=lambda df: df.route_qual.apply(
-            lambda series: "business" if series == 9 else np.nan
-        )
-    )
+def get_route_class_no_key(route_class_, route_no_):
+    """
+    Pack route class and route number into one integer key.
+
+    Parameters
+    ----------
+    route_class_: pd.Series
+        Route class (1: interstate, 2: US Route, 3: NC Route).
+    route_no_: pd.Series
+        Route number (up to 5 digits).
+    Returns
+    -------
+    np.ndarray
+        int64 key equal to route_class * 100000 + route_no.
+    """
+    return route_class_.to_numpy(dtype=np.int64) * 100000 + route_no_.to_numpy(dtype=np.int64)
+
 
-    padt_gpd = gpd.read_file(path_to_padt_shapefile, driver="shp")
-    padt_gpd = padt_gpd.to_crs(epsg=4326)
+def clean_padt(padt_gpd_):
+    """
+    Clean the SEG_T3 PADT data: underscore the column names, set the CRS to 4326, and get
+    the route class and route qualifier from the route and street names.
+    Parameters
+    ----------
+    padt_gpd_: gpd.GeoDataFrame()
+        Raw PADT data.
+    Returns
+    -------
+    padt_gpd: gpd.GeoDataFrame()
+        PADT data for 1: interstate, 2: US Route, 3: NC Route.
+    """
+    padt_gpd = padt_gpd_.set_geometry(reproject_geometry(padt_gpd_.geometry, 4326))
     padt_gpd.columns = [inflection.underscore(col) for col in padt_gpd.columns]
     padt_gpd = padt_gpd[["rte_1_nbr", "rte_1_clss", "street_nam", "padt_rec", "geometry"]]
     pat_bus = re.compile(r"\S+\s+(\S.*)$", flags=re.IGNORECASE)
@@ -73,31 +76,92 @@ def run_padt_processing():
     )
     padt_gpd = padt_gpd.query("~ route_class.isna()", engine='python')
     padt_gpd.rte_1_nbr = padt_gpd.rte_1_nbr.astype(int)
+    return padt_gpd
 
-    route_id_lrs_grp = route_id_lrs_gdf.groupby(["route_class", "route_no"])
-    padt_gpd_grp = padt_gpd.groupby(["route_class", "rte_1_nbr"])
-    route_cls_no_not_found = []
-    inc_fac_padt_gpd = gpd.GeoDataFrame()
-    inc_fac_padt_gpd_list = []
-    for name, route_id_lrs_sub_grp in route_id_lrs_grp:
-        if name not in padt_gpd_grp.groups.keys():
-            route_cls_no_not_found.append(name)
-            continue
-        padt_sub_gpd = padt_gpd_grp.get_group(name)
-        inc_fac_padt_gpd_list.append(
-            gpd.sjoin(left_df=route_id_lrs_sub_grp, right_df=padt_sub_gpd, how="left",)
+
+def join_padt_to_lrs(route_id_lrs_gdf_, padt_gpd_):
+    """
+    Get the maximum PADT of each AADT interval from the PADT segments on the same route
+    that intersect it, and scale it to the seasonal factor.
+    Parameters
+    ----------
+    route_id_lrs_gdf_: gpd.GeoDataFrame()
+        AADT intervals with the route key, route class, and route number.
+    padt_gpd_: gpd.GeoDataFrame()
+        Cleaned PADT data (see clean_padt).
+    Returns
+    -------
+    inc_fac_padt_gpd_: gpd.GeoDataFrame()
+        One row for each AADT interval on a route in the PADT data with the columns
+        "padt_rec" and "seasonal_fac".
+    """
+    # Only keep the LRS segments on a route (route class and number) that is in the PADT data.
+    lrs_route_key = get_route_class_no_key(route_id_lrs_gdf_.route_class, route_id_lrs_gdf_.route_no)
+    padt_route_key = get_route_class_no_key(padt_gpd_.route_class, padt_gpd_.rte_1_nbr)
+    on_padt_route = np.isin(lrs_route_key, padt_route_key)
+    route_id_lrs_gdf, lrs_route_key = route_id_lrs_gdf_.loc[on_padt_route], lrs_route_key[on_padt_route]
+    # Query all the LRS segments against one spatial index of the PADT geometries, then keep
+    # the intersecting pairs that are on the same route.
+    with span("sjoin"):
+        padt_tree = shapely.STRtree(padt_gpd_.geometry.values.data)
+        lrs_idx, padt_idx = padt_tree.query(route_id_lrs_gdf.geometry.values.data, predicate="intersects")
+    same_route = lrs_route_key[lrs_idx] == padt_route_key[padt_idx]
+    lrs_idx, padt_idx = lrs_idx[same_route], padt_idx[same_route]
+    padt_rec_max = (
+        pd.Series(padt_gpd_.padt_rec.values[padt_idx])
+        .groupby(lrs_idx)
+        .max()
+        .reindex(np.arange(len(route_id_lrs_gdf)))
+    )
+    inc_fac_padt_gpd_ = route_id_lrs_gdf.assign(padt_rec=padt_rec_max.values)
+    with span("dissolve"):
+        inc_fac_padt_gpd_ = (
+            inc_fac_padt_gpd_.groupby(
+                ["route_key", "aadt_interval_left", "aadt_interval_right"]
+            )
+            .agg(route_id=("route_id", "first"), padt_rec=("padt_rec", "max"), geometry=("geometry", "first"),)
+            .reset_index()
+            .pipe(reorder_columns, first_cols=["route_id"])
         )
+    inc_fac_padt_gpd_ = gpd.GeoDataFrame(inc_fac_padt_gpd_, crs=route_id_lrs_gdf.crs)
+    inc_fac_padt_gpd_["seasonal_fac"] = minmax_scale(inc_fac_padt_gpd_.padt_rec, (0, 1))
+    return inc_fac_padt_gpd_
 
-    inc_fac_padt_gpd = pd.concat(inc_fac_padt_gpd_list, ignore_index=True)
-    inc_fac_padt_gpd = (
-        inc_fac_padt_gpd.groupby(
-            ["route_id", "aadt_interval_left", "aadt_interval_right"]
+
+# if __name__ == "__main__":
+def run_padt_processing():
+    path_to_prj_dir = get_project_root()
+    path_to_raw = os.path.join(path_to_prj_dir, DevConfig.DIR_NAME_DATA, DevConfig.DIR_NAME_RAW)
+    path_interim_data = os.path.join(path_to_prj_dir, DevConfig.DIR_NAME_DATA, DevConfig.DIR_NAME_INTERIM)
+    path_to_padt = os.path.join(path_to_raw, DataConfig.DIR_SEG_T3)
+    path_to_padt_shapefile = os.path.join(path_to_padt, DataConfig.SHAPEFILE_SEG_T3)
+    path_processed_data = os.path.join(path_to_prj_dir, DevConfig.DIR_NAME_DATA, DevConfig.DIR_NAME_PROCESSED)
+    if not os.path.isdir(path_processed_data):  # Check if interim data directory exists
+        os.mkdir(path_processed_data)  # Create interim data directory if it doesn't exist already
+    path_aadt_crash_si = get_interim_file(os.path.join(path_interim_data, DevConfig.INTERIM_GPKG_AADT_SAFETY_MERGE))
+    crash_aadt_fil_si_geom_gdf = read_gdf(path_aadt_crash_si, schema=SEGMENT_SCHEMA)
+    route_id_lrs_gdf = crash_aadt_fil_si_geom_gdf.filter(
+        items=[
+            "route_id",
+            "route_key",
+            "aadt_interval_left",
+            "aadt_interval_right",
+            "route_class",
+            "route_qual",
+            "route_inventory",
+            "route_county",
+            "route_no",
+            "geometry",
+        ]
+    ).assign(
+        business_route=lambda df: df.route_qual.apply(
+            lambda series: "business" if series == 9 else np.nan
         )
-        .agg(padt_rec=("padt_rec", "max"), geometry=("geometry", "first"),)
-        .reset_index()
     )
-    inc_fac_padt_gpd = gpd.GeoDataFrame(inc_fac_padt_gpd, crs=route_id_lrs_gdf.crs)
-    inc_fac_padt_gpd["seasonal_fac"] = minmax_scale(inc_fac_padt_gpd.padt_rec, (0, 1))
-    inc_fac_padt_gpd.to_file(
-        os.path.join(path_processed_data, DevConfig.PROCESSED_PADT_ON_INCIDENT_FACTOR), driver="GPKG"
+
+    padt_gpd = clean_padt(read_shp(path_to_padt_shapefile, data_name="PADT", to_epsg=4326))
+    inc_fac_padt_gpd = join_padt_to_lrs(route_id_lrs_gdf, padt_gpd)
+    write_gdf(
+        inc_fac_padt_gpd,
+        get_interim_file(os.path.join(path_processed_data, DevConfig.PROCESSED_PADT_ON_INCIDENT_FACTOR)),
     )
@@ -1,14 +1,186 @@
 # -*- coding: utf-8 -*-
 import os
+import hashlib
+import numpy as np
 import pandas as pd
 import geopandas as gpd
-from src.utils import get_project_root
+import shapely
+from src.utils import get_project_root, get_interim_file, read_gdf, read_shp, write_gdf, reorder_columns
+from src.utils import get_dataset_fingerprints, SEGMENT_SCHEMA
+from src.run_report import span
 from sklearn.preprocessing import minmax_scale
 from Config import DataConfig, DevConfig
 
 
+def get_geometry_hash(geometry_):
+    """
+    Hash each geometry from its WKB.
+
+    Parameters
+    ----------
+    geometry_: gpd.GeoSeries
+        Segment geometries.
+    Returns
+    -------
+    np.ndarray
+        uint64 hash of each geometry. Equal geometries have equal hashes.
+    """
+    return pd.util.hash_array(shapely.to_wkb(geometry_.values.data))
+
+
+def get_census_tract_version(path_to_census_shapefile):
+    """
+    Hash the files of the census tract shapefile. The segment to census tract assignments
+    in the cache are only valid for the census tract file version they were made with. The
+    content hashes of the files are reused while their size and modification time are
+    unchanged (see src.utils.get_dataset_fingerprints).
+    """
+    version_hash = hashlib.sha256()
+    for fingerprint in get_dataset_fingerprints(path_to_census_shapefile).values():
+        version_hash.update(fingerprint["sha256"].encode())
+    return version_hash.hexdigest()
+
+
+def get_census_tract_assignment(route_id_lrs_gdf_, path_to_census_shapefile, path_cache):
+    """
+    Get the census tracts (GEOID10) that intersect each LRS segment. Assignments are cached
+    by segment geometry hash, so that only new or changed segments are joined to the census
+    tracts. The cache is rebuilt when the census tract shapefile changes.
+
+    Parameters
+    ----------
+    route_id_lrs_gdf_: gpd.GeoDataFrame
+        LRS segments in EPSG:4326.
+    path_to_census_shapefile: str
+        Path to the census tract shapefile.
+    path_cache: str
+        Path to the parquet file with the cached assignments.
+    Returns
+    -------
+    census_tract_assignment_: pd.DataFrame
+        One row per intersecting segment and census tract with the columns seg_hash and
+        GEOID10. Segments without any census tract are not included.
+    """
+    census_version = get_census_tract_version(path_to_census_shapefile)
+    seg_hash = get_geometry_hash(route_id_lrs_gdf_.geometry)
+    cache_df = pd.DataFrame({"seg_hash": pd.Series(dtype=np.uint64), "GEOID10": pd.Series(dtype=object)})
+    if os.path.isfile(path_cache):
+        cache_df_all = pd.read_parquet(path_cache)
+        if (cache_df_all.census_version == census_version).all():
+            cache_df = cache_df_all.filter(items=["seg_hash", "GEOID10"])
+    # Drop the segments that are no longer in the LRS data.
+    cache_df = cache_df.loc[lambda df: df.seg_hash.isin(seg_hash)]
+    new_seg_hash, new_seg_pos = np.unique(seg_hash, return_index=True)
+    is_new = ~np.isin(new_seg_hash, cache_df.seg_hash.values)
+    new_seg_hash, new_seg_pos = new_seg_hash[is_new], new_seg_pos[is_new]
+    print(f"Census tract assignment: {len(new_seg_hash)} new or changed segments, "
+          f"{len(np.unique(seg_hash)) - len(new_seg_hash)} cached segments.")
+    if len(new_seg_hash) or not os.path.isfile(path_cache):
+        census_gpd = read_shp(path_to_census_shapefile, data_name="Census tract", columns=["geoid10"], to_epsg=4326)
+        with span("sjoin"):
+            census_tree = shapely.STRtree(census_gpd.geometry.values.data)
+            seg_idx, census_idx = census_tree.query(
+                route_id_lrs_gdf_.geometry.values.data[new_seg_pos], predicate="intersects"
+            )
+        order = np.lexsort((census_idx, seg_idx))
+        seg_idx, census_idx = seg_idx[order], census_idx[order]
+        # Keep segments without a census tract in the cache with a missing GEOID10.
+        no_census_pos = np.setdiff1d(np.arange(len(new_seg_hash)), seg_idx)
+        new_cache_df = pd.DataFrame(
+            {
+                "seg_hash": np.concatenate([new_seg_hash[seg_idx], new_seg_hash[no_census_pos]]),
+                "GEOID10": np.concatenate(
+                    [
+                        census_gpd.geoid10.astype(str).values[census_idx],
+                        np.full(len(no_census_pos), None, dtype=object),
+                    ]
+                ),
+            }
+        )
+        cache_df = pd.concat([cache_df, new_cache_df], ignore_index=True)
+        cache_df.assign(census_version=census_version).to_parquet(path_cache, index=False)
+    census_tract_assignment_ = cache_df.loc[lambda df: ~df.GEOID10.isna()].reset_index(drop=True)
+    return census_tract_assignment_
+
+
+def get_census_growth_on_lrs(route_id_lrs_gdf_, census_tract_assignment_, growth_df_, check_growth_rate=False):
+    """
+    Get the yearly census tract growth rate on each AADT interval and scale it to the growth
+    factor.
+    Parameters
+    ----------
+    route_id_lrs_gdf_: gpd.GeoDataFrame()
+        AADT intervals with the route key.
+    census_tract_assignment_: pd.DataFrame()
+        Census tract (GEOID10) of each segment geometry hash (see get_census_tract_assignment).
+    growth_df_: pd.DataFrame()
+        Census tract flow and growth rate data with GEOID10 as a string.
+    check_growth_rate: bool
+        Check the yearly growth rate against the 2015 and 2040 flows.
+    Returns
+    -------
+    census_gpd_growth_lrs_grp_: gpd.GeoDataFrame()
+        One row for each AADT interval with a census tract with the columns
+        "tot_gr_24_yearly" and "growth_fac".
+    """
+    census_growth_df = census_tract_assignment_.merge(growth_df_, on="GEOID10", how="left")
+    census_growth_df["tot_gr_24_yearly"] = (
+        ((1 + (census_growth_df["24h_Tot_GR"] / 100)) ** (1 / (2040 - 2015))) - 1
+    ) * 100
+    census_gpd_growth_lrs = (
+        route_id_lrs_gdf_.assign(seg_hash=get_geometry_hash(route_id_lrs_gdf_.geometry))
+        .merge(census_growth_df, on="seg_hash", how="inner")
+        .sort_values(["route_key", "aadt_interval_left"], kind="mergesort")
+    )
+    census_gpd_growth_lrs.tot_gr_24_yearly = (
+        census_gpd_growth_lrs.tot_gr_24_yearly.groupby(census_gpd_growth_lrs.route_key).ffill()
+        .groupby(census_gpd_growth_lrs.route_key).bfill()
+    )
+    if check_growth_rate:
+        test_tot_gr_24_yearly = (
+            (
+                (
+                    census_gpd_growth_lrs["2040_Tot_Flow_24h"]
+                    / census_gpd_growth_lrs["2015_Tot_Flow_24h"]
+                )
+                ** (1 / (2040 - 2015))
+            )
+            - 1
+        ) * 100
+        test_tot_gr_24_yearly = (
+            test_tot_gr_24_yearly.groupby(census_gpd_growth_lrs.route_key).ffill()
+            .groupby(census_gpd_growth_lrs.route_key).bfill()
+        )
+        mask = ~ census_gpd_growth_lrs.tot_gr_24_yearly.isna()
+        assert np.isclose(
+            census_gpd_growth_lrs[mask].tot_gr_24_yearly,
+            test_tot_gr_24_yearly[mask],
+        ).all()
+
+    with span("dissolve"):
+        census_gpd_growth_lrs_grp_ = (
+            census_gpd_growth_lrs.groupby(
+                ["route_key", "aadt_interval_left", "aadt_interval_right"]
+            )
+            .agg(
+                route_id=("route_id", "first"),
+                tot_gr_24_yearly=("tot_gr_24_yearly", "mean"),
+                GEOID10=("GEOID10", "first"),
+                tot_flow_2015_24=("2015_Tot_Flow_24h", "first"),
+                tot_flow_2040_24=("2040_Tot_Flow_24h", "first"),
+                tot_grw_rt_24=("24h_Tot_GR", "first"),
+                geometry=("geometry", "first"),
+            )
+            .reset_index()
+            .pipe(reorder_columns, first_cols=["route_id"])
+        )
+    census_gpd_growth_lrs_grp_ = gpd.GeoDataFrame(census_gpd_growth_lrs_grp_, crs=route_id_lrs_gdf_.crs)
+    census_gpd_growth_lrs_grp_["growth_fac"] = minmax_scale(census_gpd_growth_lrs_grp_.tot_gr_24_yearly, (0, 1))
+    return census_gpd_growth_lrs_grp_
+
+
 # if __name__ == "__main__":
-def run_process_census_data():
+def run_process_census_data(check_growth_rate=DevConfig.CHECK_CENSUS_GROWTH_RATE):
     path_to_prj_dir = get_project_root()
     path_to_raw = os.path.join(path_to_prj_dir, DevConfig.DIR_NAME_DATA, DevConfig.DIR_NAME_RAW)
     path_interim_data = os.path.join(path_to_prj_dir, DevConfig.DIR_NAME_DATA, DevConfig.DIR_NAME_INTERIM)
@@ -19,76 +191,26 @@ def run_process_census_data():
     path_to_census = os.path.join(path_to_raw, DataConfig.DIR_CENSUS_TRACT)
     path_to_census_shapefile = os.path.join(path_to_census, DataConfig.SHAPEFILE_CENSUS_TRACT)
     path_growth_data = os.path.join(path_to_census, DataConfig.CSV_CENSUS_COMBINED_FLOW)
-    path_aadt_crash_si = os.path.join(path_interim_data, DevConfig.INTERIM_GPKG_AADT_SAFETY_MERGE)
-    crash_aadt_fil_si_geom_gdf = gpd.read_file(path_aadt_crash_si, driver="gpkg")
+    path_aadt_crash_si = get_interim_file(os.path.join(path_interim_data, DevConfig.INTERIM_GPKG_AADT_SAFETY_MERGE))
+    path_cache = os.path.join(path_interim_data, DevConfig.INTERIM_PARQUET_CENSUS_TRACT_CACHE)
+    crash_aadt_fil_si_geom_gdf = read_gdf(path_aadt_crash_si, schema=SEGMENT_SCHEMA)
     route_id_lrs_gdf = crash_aadt_fil_si_geom_gdf.filter(
-        items=["route_id", "aadt_interval_left", "aadt_interval_right", "geometry"]
-    )
-    census_gpd = gpd.read_file(path_to_census_shapefile, driver="shp")
-    census_gpd = census_gpd.to_crs(epsg=4326)
-    growth_df = pd.read_csv(path_growth_data).assign(
-        GEOID10=lambda df: df.GEOID10.astype(str)
-    )
-    census_gpd_growth = census_gpd.merge(growth_df, on="GEOID10", how="left")
-    census_gpd_growth["test_tot_gr_24_yearly"] = (
-        (
-            (
-                census_gpd_growth["2040_Tot_Flow_24h"]
-                / census_gpd_growth["2015_Tot_Flow_24h"]
-            )
-            ** (1 / (2040 - 2015))
-        )
-        - 1
-    ) * 100
-    census_gpd_growth["tot_gr_24_yearly"] = (
-        ((1 + (census_gpd_growth["24h_Tot_GR"] / 100)) ** (1 / (2040 - 2015))) - 1
-    ) * 100
-    # census_gpd_growth.to_file(
-    #     os.path.join(path_interim_sratch, "census_gpd_growth_polygons.shp")
-    # )
-    census_gpd_growth_lrs = gpd.sjoin(
-        route_id_lrs_gdf, census_gpd_growth, how="inner", op="intersects"
-    )
-    census_gpd_growth_lrs["24h_Tot_GR"].describe()
-    census_gpd_growth_lrs["tot_gr_24_yearly"].describe()
-    census_gpd_growth_lrs = census_gpd_growth_lrs.sort_values(["route_id", "aadt_interval_left"])
-    census_gpd_growth_lrs.tot_gr_24_yearly = (
-        census_gpd_growth_lrs.groupby(["route_id"])
-        .tot_gr_24_yearly.apply(lambda x: x.ffill().bfill())
+        items=["route_id", "route_key", "aadt_interval_left", "aadt_interval_right", "geometry"]
     )
-    census_gpd_growth_lrs.test_tot_gr_24_yearly = (
-        census_gpd_growth_lrs.groupby(["route_id"])
-        .test_tot_gr_24_yearly.apply(lambda x: x.ffill().bfill())
-    )
-    import numpy as np
-
-    mask = ~ census_gpd_growth_lrs.tot_gr_24_yearly.isna()
-    assert np.isclose(
-        census_gpd_growth_lrs[mask].tot_gr_24_yearly,
-        census_gpd_growth_lrs[mask].test_tot_gr_24_yearly,
-    ).all()
-
-    census_gpd_growth_lrs_grp = (
-        census_gpd_growth_lrs.groupby(
-            ["route_id", "aadt_interval_left", "aadt_interval_right"]
-        )
-        .agg(
-            tot_gr_24_yearly=("tot_gr_24_yearly", "mean"),
-            GEOID10=("GEOID10", "first"),
-            tot_flow_2015_24=("2015_Tot_Flow_24h", "first"),
-            tot_flow_2040_24=("2040_Tot_Flow_24h", "first"),
-            tot_grw_rt_24=("24h_Tot_GR", "first"),
-            geometry=("geometry", "first"),
+    census_tract_assignment = get_census_tract_assignment(route_id_lrs_gdf, path_to_census_shapefile, path_cache)
+    with span("read") as read_span:
+        growth_df = pd.read_csv(path_growth_data).assign(
+            GEOID10=lambda df: df.GEOID10.astype(str)
         )
-        .reset_index()
+        read_span["rows_in"] = len(growth_df)
+    census_gpd_growth_lrs_grp = get_census_growth_on_lrs(
+        route_id_lrs_gdf, census_tract_assignment, growth_df, check_growth_rate=check_growth_rate
     )
-    census_gpd_growth_lrs_grp = gpd.GeoDataFrame(census_gpd_growth_lrs_grp, crs=census_gpd_growth_lrs.crs)
-    len(census_gpd_growth_lrs_grp)
-    census_gpd_growth_lrs_grp["growth_fac"] = minmax_scale(census_gpd_growth_lrs_grp.tot_gr_24_yearly, (0, 1))
 
     # census_gpd_growth_lrs_grp.to_file(
     #     os.path.join(path_interim_sratch, "census_gpd_growth.shp")
     # )
-    census_gpd_growth_lrs_grp.to_file(
-        os.path.join(path_processed_data, DevConfig.PROCESSED_CENSUS_GPD_GROWTH), driver="GPKG"
+    write_gdf(
+        census_gpd_growth_lrs_grp,
+        get_interim_file(os.path.join(path_processed_data, DevConfig.PROCESSED_CENSUS_GPD_GROWTH)),
     )
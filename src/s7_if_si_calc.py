@@ -3,42 +3,41 @@ Handle missing crash data for incidence factor and severity index calculations.
 Created by: Apoorba Bibeka
 Modified by: Lake Trask (2022/01/22)
 """
-import geopandas as gpd
 import os
-from src.utils import get_project_root
+from src.utils import get_project_root, get_interim_file, read_df, read_geometry, attach_geometry, write_gdf
+from src.utils import SEGMENT_SCHEMA, ROUTE_CLASS_LABEL_DTYPE
+from src.run_report import span
 import numpy as np
 from sklearn.preprocessing import minmax_scale
 from Config import DevConfig
 
 
-# if __name__ == "__main__":
-def run_process_incident_factor():
-    # Set the paths to relevant files and folders.
-    # Load crash and aadt data.
-    # ************************************************************************************
-    path_to_prj_dir = get_project_root()
-    path_interim_data = os.path.join(path_to_prj_dir, DevConfig.DIR_NAME_DATA, DevConfig.DIR_NAME_INTERIM)
-    path_processed_data = os.path.join(path_to_prj_dir, DevConfig.DIR_NAME_DATA, DevConfig.DIR_NAME_PROCESSED)
-    path_aadt_crash_si = os.path.join(path_interim_data, DevConfig.INTERIM_GPKG_AADT_SAFETY_MERGE)
-    path_inc_fac_si = os.path.join(path_processed_data, DevConfig.PROCESSED_INCIDENT_FACTOR_SCALED)
-
-    path_aadt_but_no_crash_route_set = os.path.join(path_interim_data, DevConfig.INTERIM_CSV_AADT_BUT_NO_CRASH)
-    crash_aadt_fil_si_geom_gdf = gpd.read_file(path_aadt_crash_si, driver="gpkg")
+def get_incident_factor_scaled(crash_aadt_fil_si_df_):
+    """
+    Keep the interstates, US routes, and NC routes, and scale the severity index to 0-1 at
+    the 90th percentile. Intervals without crash data get a severity index of 1.
+    Parameters
+    ----------
+    crash_aadt_fil_si_df_: pd.DataFrame()
+        AADT and crash merge with the incident factor and severity index.
+    Returns
+    -------
+    dict
+        "inc_fac_si": AADT intervals with the scaled severity index,
+        "no_crash": AADT intervals without crash data.
+    """
     crash_aadt_fil_si_geom_gdf = (
-        crash_aadt_fil_si_geom_gdf
-        .sort_values(by=["route_id", "aadt_interval_left"])
+        crash_aadt_fil_si_df_
+        .sort_values(by=["route_key", "aadt_interval_left"])
         .assign(route_class=lambda df: df.route_class.replace(
-            {1: "Interstate", 2: "US Route", 3: "NC Route", 4: "Secondary Routes"})
+            {1: "Interstate", 2: "US Route", 3: "NC Route", 4: "Secondary Routes"}).astype(ROUTE_CLASS_LABEL_DTYPE)
             )
         .query("route_class in ['Interstate', 'US Route', 'NC Route']")
     )
-    crash_df_fil_si_geom_gdf_nan = crash_aadt_fil_si_geom_gdf.query(
-        " severity_index.isna()", engine="python"
-    )
+    crash_df_fil_si_nan = crash_aadt_fil_si_geom_gdf.query(" severity_index.isna()", engine="python")
     crash_df_fil_si_geom_gdf_no_nan = crash_aadt_fil_si_geom_gdf.query(
         "~ severity_index.isna()", engine="python"
     )
-    crash_df_fil_si_geom_gdf_nan.to_csv(path_aadt_but_no_crash_route_set)
 
     crash_aadt_fil_si_geom_gdf.groupby("route_class").severity_index.quantile(.95)
     crash_df_fil_si_geom_gdf_no_nan.severity_index.quantile(.90)
@@ -65,10 +64,38 @@ def run_process_incident_factor():
         lambda x: ~ x.severity_index_need_scaling.astype(bool),
         "severity_index_scaled"
         ] = 1
-    crash_aadt_fil_si_geom_gdf_scaled_si.to_file(path_inc_fac_si, driver="GPKG")
+    return {"inc_fac_si": crash_aadt_fil_si_geom_gdf_scaled_si, "no_crash": crash_df_fil_si_nan}
+
+
+# if __name__ == "__main__":
+def run_process_incident_factor():
+    # Set the paths to relevant files and folders.
+    # Load crash and aadt data.
+    # ************************************************************************************
+    path_to_prj_dir = get_project_root()
+    path_interim_data = os.path.join(path_to_prj_dir, DevConfig.DIR_NAME_DATA, DevConfig.DIR_NAME_INTERIM)
+    path_processed_data = os.path.join(path_to_prj_dir, DevConfig.DIR_NAME_DATA, DevConfig.DIR_NAME_PROCESSED)
+    path_aadt_crash_si = get_interim_file(os.path.join(path_interim_data, DevConfig.INTERIM_GPKG_AADT_SAFETY_MERGE))
+    path_inc_fac_si = get_interim_file(os.path.join(path_processed_data, DevConfig.PROCESSED_INCIDENT_FACTOR_SCALED))
+
+    path_aadt_but_no_crash_route_set = os.path.join(path_interim_data, DevConfig.INTERIM_CSV_AADT_BUT_NO_CRASH)
+    # Work on the attributes only. The AADT geometry is attached by aadt_seg_id before
+    # writing the outputs.
+    crash_aadt_fil_si_geom_gdf = read_df(path_aadt_crash_si, schema=SEGMENT_SCHEMA)
+    aadt_geometry = read_geometry(path_aadt_crash_si, key="aadt_seg_id")
+    inc_fac_si = get_incident_factor_scaled(crash_aadt_fil_si_geom_gdf)
+    crash_aadt_fil_si_geom_gdf_scaled_si = inc_fac_si["inc_fac_si"]
+    crash_df_fil_si_geom_gdf_nan = attach_geometry(inc_fac_si["no_crash"], aadt_geometry, key="aadt_seg_id")
+    with span("write") as write_span:
+        crash_df_fil_si_geom_gdf_nan.to_csv(path_aadt_but_no_crash_route_set)
+        write_span["rows_out"] = len(crash_df_fil_si_geom_gdf_nan)
+    write_gdf(
+        attach_geometry(crash_aadt_fil_si_geom_gdf_scaled_si, aadt_geometry, key="aadt_seg_id"),
+        path_inc_fac_si,
+    )
 
     path_missing_crash = os.path.join(path_processed_data, DevConfig.PROCESSED_DIR_MISSING_CRASHES)
     if not os.path.isdir(path_missing_crash):
         os.mkdir(path_missing_crash)
     path_missing_crash_shp = os.path.join(path_missing_crash, DevConfig.PROCESSED_SHAPEFILE_MISSING_CRASHES)
-    crash_df_fil_si_geom_gdf_nan.to_file(path_missing_crash_shp)
+    write_gdf(crash_df_fil_si_geom_gdf_nan, path_missing_crash_shp)
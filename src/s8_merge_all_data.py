@@ -1,95 +1,129 @@
+import numpy as np
 import pandas as pd
-import geopandas as gpd
 import os
-import numpy as np
-from src.utils import get_project_root
+from src.utils import get_project_root, get_interim_file, read_gdf, write_gdf
+from src.lrs import encode_route_id, is_valid_route_id
+from src.diagnostics import add_diagnostics, ISSUE_INVALID_ROUTE_ID, INVALID_ROUTE_KEY
+from src.keyed_join import join_side_tables
+from src.segment_index import SegmentIndex
+from src.run_report import span
 from Config import DevConfig
 
 path_to_prj_dir = get_project_root()
 path_raw_data = os.path.join(path_to_prj_dir, DevConfig.DIR_NAME_DATA, DevConfig.DIR_NAME_RAW)
 path_interim_data = os.path.join(path_to_prj_dir, DevConfig.DIR_NAME_DATA, DevConfig.DIR_NAME_INTERIM)
 path_processed_data = os.path.join(path_to_prj_dir, DevConfig.DIR_NAME_DATA, DevConfig.DIR_NAME_PROCESSED)
-path_inc_fac_si = os.path.join(path_processed_data, DevConfig.PROCESSED_INCIDENT_FACTOR_SCALED)
+path_inc_fac_si = get_interim_file(os.path.join(path_processed_data, DevConfig.PROCESSED_INCIDENT_FACTOR_SCALED))
 path_detour_data = os.path.join(path_raw_data, DevConfig.INPUT_DIR_DETOUR_TESTING, DevConfig.INPUT_SHAPEFILE_DETOUR)
 path_nhs_stc_routes = os.path.join(path_interim_data, DevConfig.INTERIM_CSV_NHS_STC_ROUTES)
 path_if_si_detour_nat_imp_census_padt = os.path.join(path_processed_data, DevConfig.PROCESSED_GPKG_ALL_DATA_MERGE)
-path_padt = os.path.join(path_processed_data, DevConfig.PROCESSED_PADT_ON_INCIDENT_FACTOR)
-path_census_growth = os.path.join(path_processed_data, DevConfig.PROCESSED_CENSUS_GPD_GROWTH)
+path_segment_index = os.path.join(path_processed_data, DevConfig.PROCESSED_NPZ_SEGMENT_INDEX)
+path_padt = get_interim_file(os.path.join(path_processed_data, DevConfig.PROCESSED_PADT_ON_INCIDENT_FACTOR))
+path_census_growth = get_interim_file(os.path.join(path_processed_data, DevConfig.PROCESSED_CENSUS_GPD_GROWTH))
 path_final_output = os.path.join(path_to_prj_dir, DevConfig.FINAL_DIR_NAME)
 if not os.path.exists(path_final_output):
     os.mkdir(path_final_output)
 
 
-# if __name__ == "__main__":
-def run_merge_all_data():
-    inc_fac_si_gdf = gpd.read_file(path_inc_fac_si, driver="gpkg")
-    detour_df = gpd.read_file(path_detour_data, driver="shp")
-    nhs_stc_routes = pd.read_csv(path_nhs_stc_routes)
-    padt_df = gpd.read_file(path_padt, driver="gpkg")
-    census_growth_df = gpd.read_file(path_census_growth, driver="gpkg")
+def get_detour_end_mp(detour_df_):
+    """
+    Get the end milepost of each detour segment: "EndMp" if the detour layer has it, else the
+    start milepost of the next segment on the route (missing for the last segment).
+    """
+    if "EndMp" in detour_df_.columns:
+        return detour_df_.EndMp.astype(float)
+    return (
+        detour_df_.sort_values(["RouteID", "BeginMp"], kind="mergesort")
+        .groupby("RouteID", sort=False).BeginMp.shift(-1)
+        .reindex(detour_df_.index)
+    )
+
+
+def report_invalid_route_ids(route_id_, table_name):
+    """
+    Report the route IDs that are missing or don't have 11 digits (ISSUE_INVALID_ROUTE_ID, with
+    the row index of the table) and get the rows with valid route IDs, which can be encoded
+    with encode_route_id.
+    """
+    is_valid = is_valid_route_id(route_id_.values)
+    add_diagnostics(
+        f"{ISSUE_INVALID_ROUTE_ID}_{table_name}", np.full((~is_valid).sum(), INVALID_ROUTE_KEY),
+        route_id_.index.values[~is_valid],
+    )
+    return is_valid
+
+
+def get_display_in_imap_tool(df_):
+    """
+    Interstates, US Routes, and the NHS and STC routes are shown in the IMAP tool.
+    """
+    return (
+        df_.route_class.isin(["Interstate", "US Route"]) | df_.nat_imp_cat.isin(["nhs", "stc_but_not_nhs"])
+    ).values
+
+
+def merge_all_data(
+    inc_fac_si_gdf_, detour_df_, nhs_stc_routes_, padt_df_, census_growth_df_,
+    detour_join_method=DevConfig.DETOUR_JOIN_METHOD, detour_join_tolerance=DevConfig.DETOUR_JOIN_TOLERANCE,
+):
+    """
+    Merge the detour scores, national importance, census growth, and PADT on the incident
+    factor and severity index intervals.
+    Parameters
+    ----------
+    inc_fac_si_gdf_: gpd.GeoDataFrame()
+        AADT intervals with the incident factor and scaled severity index.
+    detour_df_: pd.DataFrame()
+        Detour data.
+    nhs_stc_routes_: pd.DataFrame()
+        National importance of each route.
+    padt_df_: pd.DataFrame()
+        PADT on the AADT intervals.
+    census_growth_df_: pd.DataFrame()
+        Census growth rate on the AADT intervals.
+    detour_join_method: str
+        "nearest" or "backward": detour segment with the nearest "BeginMp", or the last one
+        starting at or before the interval start, within detour_join_tolerance. "overlap":
+        overlap-weighted mean of the scores of the detour segments on the interval.
+    detour_join_tolerance: float
+        Largest difference in miles between "BeginMp" and the interval start.
+    Returns
+    -------
+    if_si_detour_nat_imp_census_padt_df_fil: gpd.GeoDataFrame()
+        All the data in the final output columns.
+    """
     detour_df_fil = (
-        detour_df
+        detour_df_
         .loc[lambda df: df["class"].astype(int) <= 3]
-        .filter(items=["RouteID", "BeginMp", "scr_det", "scr_d90", "scr_nd90"])
+        .assign(detour_end_mp=get_detour_end_mp)
+        .filter(items=["RouteID", "BeginMp", "detour_end_mp", "scr_det", "scr_d90", "scr_nd90"])
         .rename(columns={"RouteID": "route_id", "BeginMp": "aadt_interval_left"})
+        .loc[lambda df: report_invalid_route_ids(df.route_id, "detour")]
+        .assign(route_key=lambda df: encode_route_id(df.route_id))
+        .drop(columns="route_id")
     )
-    padt_df_fil = padt_df.filter(items=["route_id", "aadt_interval_left", "padt_rec", "seasonal_fac"])
-    census_growth_df_fil = census_growth_df.filter(items=["route_id", "aadt_interval_left",
+    # Join on the int64 route key. The route ID string is only kept for the output.
+    padt_df_fil = padt_df_.filter(items=["route_key", "aadt_interval_left", "padt_rec", "seasonal_fac"])
+    census_growth_df_fil = census_growth_df_.filter(items=["route_key", "aadt_interval_left",
                                                           "tot_gr_24_yearly",
                                                           "tot_grw_rt_24",
                                                           "GEOID10",
                                                           "tot_flow_2015_24",
                                                           "tot_flow_2040_24",
                                                           "growth_fac"])
-    if_si_detour_df = (
-        inc_fac_si_gdf
-        .merge(
-            right=detour_df_fil,
-            on=["route_id", "aadt_interval_left"],
-            how="left"
-        )
-    )
-    if_si_detour_nat_imp_df = (
-        if_si_detour_df
-        .merge(
-            right=nhs_stc_routes.assign(route_id=lambda df: df.route_id.astype(str)),
-            on=["route_id"],
-            how="left"
-        )
-    )
-    if_si_detour_nat_imp_fil_df = (
-        if_si_detour_nat_imp_df
-        .assign(display_in_imap_tool=lambda df: np.select(
-                [
-                    df.route_class.isin(["Interstate", "US Route"])
-                    | df.nat_imp_cat.isin(["nhs", "stc_but_not_nhs"]),
-                    ~ df.route_class.isin(["Interstate", "US Route"])
-                    & ~ df.nat_imp_cat.isin(["nhs", "stc_but_not_nhs"]),
-                ],
-                [
-                    True,
-                    False
-                ],
-                -99).astype(bool)
-        )
-    )
-
-    if_si_detour_nat_imp_census_df = (
-        if_si_detour_nat_imp_df
-        .merge(
-            right=census_growth_df_fil.assign(route_id=lambda df: df.route_id.astype(str)),
-            on=["route_id", "aadt_interval_left"],
-            how="left"
-        )
-    )
-
-    if_si_detour_nat_imp_census_padt_df = (
-        if_si_detour_nat_imp_census_df
-        .merge(
-            right=padt_df_fil.assign(route_id=lambda df: df.route_id.astype(str)),
-            on=["route_id", "aadt_interval_left"],
-            how="left"
-        )
+    # Align all tables on the sorted (route_key, aadt_interval_left) keys of the incident factor intervals and add
+    # their columns in one pass. Mileposts match within DevConfig.MILEPOST_JOIN_TOLERANCE.
+    if_si_detour_nat_imp_census_padt_df = join_side_tables(
+        inc_fac_si_gdf_,
+        {
+            "detour": detour_df_fil,
+            "nhs_stc": nhs_stc_routes_.drop(columns="route_id"),
+            "census_growth": census_growth_df_fil,
+            "padt": padt_df_fil,
+        },
+        join_options={
+            "detour": {"method": detour_join_method, "tolerance": detour_join_tolerance, "end_key": "detour_end_mp"},
+        },
     )
 
     if_si_detour_nat_imp_census_padt_df_fil =(
@@ -142,11 +176,23 @@ def run_merge_all_data():
         .rename(columns={"severity_index_scaled": "si_fac",
                          "scr_nd90": "detour_fac"})
     )
-
-    if_si_detour_nat_imp_census_padt_df_fil.to_file(path_if_si_detour_nat_imp_census_padt, driver="GPKG")
-    if_si_detour_nat_imp_census_padt_df_fil.to_file(os.path.join(path_final_output, DevConfig.FINAL_MERGE_SHAPEFILE))
-
-    test = if_si_detour_nat_imp_fil_df.loc[if_si_detour_nat_imp_fil_df.scr_det.isna()]
-    test2 = if_si_detour_df.loc[if_si_detour_df.route_class.isna()]
+    return if_si_detour_nat_imp_census_padt_df_fil
 
 
+# if __name__ == "__main__":
+def run_merge_all_data():
+    inc_fac_si_gdf = read_gdf(path_inc_fac_si)
+    detour_df = read_gdf(path_detour_data)
+    with span("read") as read_span:
+        nhs_stc_routes = pd.read_csv(path_nhs_stc_routes)
+        read_span["rows_in"] = len(nhs_stc_routes)
+    padt_df = read_gdf(path_padt)
+    census_growth_df = read_gdf(path_census_growth)
+    if_si_detour_nat_imp_census_padt_df_fil = merge_all_data(
+        inc_fac_si_gdf, detour_df, nhs_stc_routes, padt_df, census_growth_df
+    )
+    write_gdf(if_si_detour_nat_imp_census_padt_df_fil, path_if_si_detour_nat_imp_census_padt)
+    write_gdf(if_si_detour_nat_imp_census_padt_df_fil, os.path.join(path_final_output, DevConfig.FINAL_MERGE_SHAPEFILE))
+    # Binary snapshot of the scores for route and milepost lookups (src.segment_index.SegmentIndex). Written last: the
+    # local service (src.service) only loads the output once the snapshot is not older than the GPKG.
+    SegmentIndex.from_df(if_si_detour_nat_imp_census_padt_df_fil).save(path_segment_index)
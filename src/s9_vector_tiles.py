@@ -0,0 +1,345 @@
+"""
+Vector tiles of the final output for the IMAP map. The AADT intervals are simplified for each
+zoom level, clipped to the tiles, and encoded as Mapbox Vector Tiles (MVT 2.1) with the display
+attributes only. The tiles are generated in parallel over ranges of tiles and saved in an
+MBTiles file (SQLite), so map clients only download the tiles they show.
+"""
+import gzip
+import json
+import math
+import os
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import shapely
+from src.utils import get_project_root, read_gdf, reproject_geometry
+from src.s8_merge_all_data import get_display_in_imap_tool
+from src.run_report import span
+from Config import DevConfig
+
+# Attributes of the features in the tiles.
+VECTOR_TILE_ATTRIBUTES = [
+    "inc_fac",
+    "si_fac",
+    "detour_fac",
+    "nat_imp_fac",
+    "growth_fac",
+    "seasonal_fac",
+    "display_in_imap_tool",
+]
+VECTOR_TILE_LAYER = "ncdot_processed_roadways"
+# Size of the web mercator (EPSG:3857) world in meters, centered on 0.
+WEB_MERCATOR_SIZE = 2 * math.pi * 6378137
+MVT_GEOMETRY_LINESTRING = 2
+MVT_COMMAND_MOVE_TO = 1
+MVT_COMMAND_LINE_TO = 2
+
+
+def encode_varint(value):
+    """
+    Protocol buffers variable length encoding of a non-negative integer.
+    """
+    encoded = bytearray()
+    while value > 0x7F:
+        encoded.append((value & 0x7F) | 0x80)
+        value >>= 7
+    encoded.append(value)
+    return bytes(encoded)
+
+
+def encode_field(field, value):
+    """
+    Protocol buffers encoding of a field: varint for int, length delimited for bytes and str.
+    """
+    if isinstance(value, int):
+        return encode_varint(field << 3) + encode_varint(value)
+    if isinstance(value, str):
+        value = value.encode()
+    return encode_varint(field << 3 | 2) + encode_varint(len(value)) + value
+
+
+def encode_packed(field, values):
+    """
+    Protocol buffers encoding of a packed repeated uint32 field.
+    """
+    return encode_field(field, b"".join(encode_varint(value) for value in values))
+
+
+def encode_value(value):
+    """
+    MVT Value message of a bool or number.
+    """
+    if isinstance(value, (bool, np.bool_)):
+        return encode_field(7, int(value))
+    return encode_varint(3 << 3 | 1) + np.float64(value).tobytes()
+
+
+def get_line_commands(coords, cursor=(0, 0)):
+    """
+    MVT geometry commands of a line in tile coordinates (MoveTo the first point and LineTo
+    the others, with zigzag encoded deltas). The first delta is from the cursor, the last
+    point of the previous line of the feature ((0, 0) for the first line).
+    """
+    deltas = np.diff(coords, axis=0, prepend=np.asarray(cursor, dtype=np.int64).reshape(1, 2))
+    zigzag = ((deltas << 1) ^ (deltas >> 63)).tolist()
+    commands = [MVT_COMMAND_MOVE_TO | 1 << 3, *zigzag[0], MVT_COMMAND_LINE_TO | (len(coords) - 1) << 3]
+    for point in zigzag[1:]:
+        commands.extend(point)
+    return commands
+
+
+def get_tile_lines(geometry_, tile_bounds, extent, buffer):
+    """
+    Clip a geometry to a tile with a buffer and get the lines in integer tile coordinates.
+    Consecutive duplicate points are removed, and lines with less than two points are dropped.
+    """
+    xmin, ymin, xmax, ymax = tile_bounds
+    tile_size = xmax - xmin
+    buffer_size = buffer / extent * tile_size
+    clipped = shapely.clip_by_rect(
+        geometry_, xmin - buffer_size, ymin - buffer_size, xmax + buffer_size, ymax + buffer_size
+    )
+    lines = []
+    for part in shapely.get_parts(clipped):
+        if part.geom_type != "LineString":
+            continue
+        coords = shapely.get_coordinates(part)
+        coords = np.column_stack([
+            np.round((coords[:, 0] - xmin) / tile_size * extent),
+            np.round((ymax - coords[:, 1]) / tile_size * extent),
+        ]).astype(np.int64)
+        coords = coords[np.r_[True, np.any(np.diff(coords, axis=0) != 0, axis=1)]]
+        if len(coords) >= 2:
+            lines.append(coords)
+    return lines
+
+
+def encode_tile(features, tile_bounds, extent=4096, buffer=64):
+    """
+    Encode the features of a tile as an MVT tile with one layer.
+    Parameters
+    ----------
+    features: list
+        (feature ID, geometry in EPSG:3857, attribute dict) of each feature.
+    tile_bounds: tuple
+        (xmin, ymin, xmax, ymax) of the tile in EPSG:3857.
+    extent: int
+        Size of the tile in tile coordinates.
+    buffer: int
+        Size of the buffer around the tile in tile coordinates.
+    Returns
+    -------
+    bytes or None
+        MVT tile, None if no feature is in the tile.
+    """
+    keys, values, encoded_features = {}, {}, []
+    for feature_id, geometry, attributes in features:
+        commands, cursor = [], (0, 0)
+        for line in get_tile_lines(geometry, tile_bounds, extent, buffer):
+            commands.extend(get_line_commands(line, cursor))
+            cursor = line[-1]
+        if not commands:
+            continue
+        tags = []
+        for key, value in attributes.items():
+            # MVT has no missing values: missing attributes are left out.
+            if value is None or (isinstance(value, float) and math.isnan(value)):
+                continue
+            # Values are keyed by type, since True and 1.0 are equal dict keys.
+            value_key = (isinstance(value, (bool, np.bool_)), value)
+            tags.extend([keys.setdefault(key, len(keys)), values.setdefault(value_key, len(values))])
+        encoded_features.append(encode_field(2, (
+            encode_field(1, feature_id) + encode_packed(2, tags) + encode_field(3, MVT_GEOMETRY_LINESTRING)
+            + encode_packed(4, commands)
+        )))
+    if not encoded_features:
+        return None
+    layer = (
+        encode_field(15, 2) + encode_field(1, VECTOR_TILE_LAYER) + b"".join(encoded_features)
+        + b"".join(encode_field(3, key) for key in keys)
+        + b"".join(encode_field(4, encode_value(bool(value) if is_bool else value)) for is_bool, value in values)
+        + encode_field(5, extent)
+    )
+    return encode_field(3, layer)
+
+
+def get_tile_bounds(z, x, y):
+    """
+    Bounds (xmin, ymin, xmax, ymax) in EPSG:3857 of an XYZ tile.
+    """
+    tile_size = WEB_MERCATOR_SIZE / 2 ** z
+    xmin = -WEB_MERCATOR_SIZE / 2 + x * tile_size
+    ymax = WEB_MERCATOR_SIZE / 2 - y * tile_size
+    return xmin, ymax - tile_size, xmin + tile_size, ymax
+
+
+def get_zoom_tiles(geometry_, z, buffer_size):
+    """
+    Get the (feature, tile) pairs of a zoom level from the bounds of the features.
+    Returns
+    -------
+    dict
+        "feature": position of the feature, "x" and "y": tile of each pair.
+    """
+    n_tiles = 2 ** z
+    tile_size = WEB_MERCATOR_SIZE / n_tiles
+    bounds = shapely.bounds(geometry_)
+    x_first = np.clip(np.floor((bounds[:, 0] - buffer_size + WEB_MERCATOR_SIZE / 2) / tile_size), 0, n_tiles - 1)
+    x_last = np.clip(np.floor((bounds[:, 2] + buffer_size + WEB_MERCATOR_SIZE / 2) / tile_size), 0, n_tiles - 1)
+    y_first = np.clip(np.floor((WEB_MERCATOR_SIZE / 2 - bounds[:, 3] - buffer_size) / tile_size), 0, n_tiles - 1)
+    y_last = np.clip(np.floor((WEB_MERCATOR_SIZE / 2 - bounds[:, 1] + buffer_size) / tile_size), 0, n_tiles - 1)
+    n_x = (x_last - x_first + 1).astype(np.int64)
+    n_y = (y_last - y_first + 1).astype(np.int64)
+    n_pairs = n_x * n_y
+    feature = np.repeat(np.arange(len(geometry_)), n_pairs)
+    pair_idx = np.arange(n_pairs.sum()) - np.repeat(np.cumsum(n_pairs) - n_pairs, n_pairs)
+    return {
+        "feature": feature,
+        "x": x_first.astype(np.int64)[feature] + pair_idx % n_x[feature],
+        "y": y_first.astype(np.int64)[feature] + pair_idx // n_x[feature],
+    }
+
+
+def encode_tile_range(z, tiles, extent=4096, buffer=64):
+    """
+    Encode a range of tiles of one zoom level (run in a worker process).
+    Parameters
+    ----------
+    z: int
+        Zoom level.
+    tiles: list
+        (x, y, features) of each tile (see encode_tile).
+    Returns
+    -------
+    list
+        (z, x, y, gzipped MVT tile) of each tile with features.
+    """
+    tile_data_ = []
+    for x, y, features in tiles:
+        tile = encode_tile(features, get_tile_bounds(z, x, y), extent=extent, buffer=buffer)
+        if tile is not None:
+            tile_data_.append((z, x, y, gzip.compress(tile)))
+    return tile_data_
+
+
+def get_tile_ranges(gdf_3857_, attributes, z, n_ranges, extent=4096, buffer=64,
+                    simplify_pixels=DevConfig.VECTOR_TILE_SIMPLIFY_PIXELS):
+    """
+    Simplify the geometry for a zoom level and split the tiles of the zoom level into ranges of
+    tiles with their features.
+    Returns
+    -------
+    list
+        Tiles of each range, sorted by tile (see encode_tile_range).
+    """
+    pixel_size = WEB_MERCATOR_SIZE / 2 ** z / extent
+    geometry = shapely.simplify(gdf_3857_.geometry.values.data, simplify_pixels * pixel_size)
+    zoom_tiles = get_zoom_tiles(geometry, z, buffer * pixel_size)
+    order = np.lexsort((zoom_tiles["feature"], zoom_tiles["y"], zoom_tiles["x"]))
+    feature, x, y = zoom_tiles["feature"][order], zoom_tiles["x"][order], zoom_tiles["y"][order]
+    is_new_tile = np.r_[True, (np.diff(x) != 0) | (np.diff(y) != 0)]
+    tile_start = np.flatnonzero(is_new_tile)
+    tile_end = np.r_[tile_start[1:], len(feature)]
+    tiles = [
+        (int(x[start]), int(y[start]), [(int(pos) + 1, geometry[pos], attributes[pos]) for pos in feature[start:end]])
+        for start, end in zip(tile_start, tile_end)
+    ]
+    return [
+        tiles[range_idx[0]:range_idx[-1] + 1] for range_idx in np.array_split(np.arange(len(tiles)), n_ranges)
+        if len(range_idx)
+    ]
+
+
+def write_mbtiles(tile_data_, file, min_zoom, max_zoom, bounds):
+    """
+    Write gzipped MVT tiles to an MBTiles file (tile rows are flipped to the TMS scheme).
+    """
+    if os.path.isfile(file):
+        os.remove(file)
+    with span("write") as write_span:
+        with sqlite3.connect(file) as connection:
+            connection.execute("CREATE TABLE metadata (name text, value text)")
+            connection.execute(
+                "CREATE TABLE tiles (zoom_level integer, tile_column integer, tile_row integer, tile_data blob)"
+            )
+            connection.execute("CREATE UNIQUE INDEX tile_index ON tiles (zoom_level, tile_column, tile_row)")
+            metadata = {
+                "name": VECTOR_TILE_LAYER,
+                "format": "pbf",
+                "type": "overlay",
+                "minzoom": str(min_zoom),
+                "maxzoom": str(max_zoom),
+                "bounds": ",".join(f"{bound:.6f}" for bound in bounds),
+                "json": json.dumps({"vector_layers": [{
+                    "id": VECTOR_TILE_LAYER,
+                    "minzoom": min_zoom,
+                    "maxzoom": max_zoom,
+                    "fields": {
+                        col: "Boolean" if col == "display_in_imap_tool" else "Number" for col in VECTOR_TILE_ATTRIBUTES
+                    },
+                }]}),
+            }
+            connection.executemany("INSERT INTO metadata VALUES (?, ?)", metadata.items())
+            connection.executemany(
+                "INSERT INTO tiles VALUES (?, ?, ?, ?)",
+                ((z, x, 2 ** z - 1 - y, tile) for z, x, y, tile in tile_data_),
+            )
+        connection.close()
+        write_span["rows_out"] = len(tile_data_)
+
+
+def make_vector_tiles(gdf_, file, min_zoom=DevConfig.VECTOR_TILE_MIN_ZOOM, max_zoom=DevConfig.VECTOR_TILE_MAX_ZOOM,
+                      n_workers=DevConfig.N_WORKERS_VECTOR_TILES):
+    """
+    Generate the vector tiles of the final output and write them to an MBTiles file.
+    Parameters
+    ----------
+    gdf_: gpd.GeoDataFrame()
+        Final output (see src.s8_merge_all_data.merge_all_data).
+    file: str
+        Path to the MBTiles file.
+    min_zoom, max_zoom: int
+        Zoom levels of the tiles.
+    n_workers: int
+        Number of worker processes (1 runs in the main process).
+    Returns
+    -------
+    int
+        Number of tiles.
+    """
+    gdf_3857 = (
+        gdf_.assign(display_in_imap_tool=get_display_in_imap_tool)
+        .filter(items=[*VECTOR_TILE_ATTRIBUTES, "geometry"])
+        .loc[lambda df: ~df.geometry.isna()]
+    )
+    gdf_3857 = gdf_3857.set_geometry(reproject_geometry(gdf_3857.geometry, 3857))
+    attributes = gdf_3857.drop(columns="geometry").astype(object).to_dict(orient="records")
+    tile_ranges = []
+    with span("simplify"):
+        for z in range(min_zoom, max_zoom + 1):
+            tile_ranges.extend(
+                (z, tiles_range) for tiles_range in get_tile_ranges(gdf_3857, attributes, z, n_ranges=n_workers * 4)
+            )
+    with span("encode_tiles"):
+        if n_workers > 1:
+            with ProcessPoolExecutor(max_workers=n_workers) as executor:
+                tile_data = [
+                    tile for tile_range_data in executor.map(encode_tile_range, *zip(*tile_ranges))
+                    for tile in tile_range_data
+                ]
+        else:
+            tile_data = [tile for z, tiles in tile_ranges for tile in encode_tile_range(z, tiles)]
+    write_mbtiles(tile_data, file, min_zoom, max_zoom, reproject_geometry(gdf_.geometry, 4326).total_bounds)
+    return len(tile_data)
+
+
+# if __name__ == "__main__":
+def run_vector_tiles():
+    path_to_prj_dir = get_project_root()
+    path_processed_data = os.path.join(path_to_prj_dir, DevConfig.DIR_NAME_DATA, DevConfig.DIR_NAME_PROCESSED)
+    path_final_output = os.path.join(path_to_prj_dir, DevConfig.FINAL_DIR_NAME)
+    if not os.path.isdir(path_final_output):
+        os.makedirs(path_final_output)
+    gdf = read_gdf(os.path.join(path_processed_data, DevConfig.PROCESSED_GPKG_ALL_DATA_MERGE))
+    n_tiles = make_vector_tiles(gdf, os.path.join(path_final_output, DevConfig.FINAL_MBTILES_VECTOR_TILES))
+    print(f"Wrote {n_tiles} vector tiles to {DevConfig.FINAL_MBTILES_VECTOR_TILES}.")
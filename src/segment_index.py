@@ -0,0 +1,181 @@
+"""
+Score lookups on the final merge output (step 8) by route and milepost, without loading the
+GPKG. The AADT intervals are sorted by route key and start milepost, with the rows of each
+route stored contiguously and the numeric and boolean columns stored as arrays. Queries use
+binary searches on these arrays. The index is saved as a binary snapshot
+(data/2_processed/segment_index.npz) that loads without parsing the GPKG.
+"""
+import numpy as np
+import pandas as pd
+from src.lrs import encode_route_id
+from src.run_report import span
+
+
+class SegmentIndex:
+    """
+    Sorted route and milepost index of the AADT intervals with their score columns.
+    Parameters
+    ----------
+    route_key: np.ndarray
+        Sorted unique route keys (see src.lrs.encode_route_id).
+    route_start: np.ndarray
+        Position of the first row of each route, with the number of rows at the end, so the
+        rows of route i are route_start[i]:route_start[i + 1].
+    mp_left, mp_right: np.ndarray
+        Start and end milepost of each row, sorted by start milepost within each route.
+    columns: dict
+        Array of each score column, in the order of the rows.
+    """
+
+    def __init__(self, route_key, route_start, mp_left, mp_right, columns):
+        self.route_key = route_key
+        self.route_start = route_start
+        self.mp_left = mp_left
+        self.mp_right = mp_right
+        self.columns = columns
+
+    def __len__(self):
+        return len(self.mp_left)
+
+    @classmethod
+    def from_df(cls, df_, route_id="route_id", mp_left="aadt_interval_left", mp_right="aadt_interval_right"):
+        """
+        Build the index from the final merge output. The numeric and boolean columns are kept,
+        with "row", the position of each row in df_ (e.g. in the GPKG).
+        """
+        route_key = encode_route_id(df_[route_id].values)
+        order = np.lexsort((df_[mp_left].values, route_key))
+        route_key = route_key[order]
+        route_key_unique, route_start = np.unique(route_key, return_index=True)
+        columns = {"row": order.astype(np.int64)}
+        for col in df_.columns.drop([route_id, mp_left, mp_right]):
+            if pd.api.types.is_numeric_dtype(df_[col]) or pd.api.types.is_bool_dtype(df_[col]):
+                columns[col] = df_[col].values[order]
+        return cls(
+            route_key=route_key_unique,
+            route_start=np.append(route_start, len(route_key)).astype(np.int64),
+            mp_left=df_[mp_left].values.astype(np.float64)[order],
+            mp_right=df_[mp_right].values.astype(np.float64)[order],
+            columns=columns,
+        )
+
+    def save(self, file):
+        """
+        Save the index as an uncompressed .npz snapshot.
+        """
+        with span("write") as write_span:
+            np.savez(
+                file,
+                route_key=self.route_key,
+                route_start=self.route_start,
+                mp_left=self.mp_left,
+                mp_right=self.mp_right,
+                **{f"col_{col}": values for col, values in self.columns.items()},
+            )
+            write_span["rows_out"] = len(self)
+
+    @classmethod
+    def load(cls, file):
+        """
+        Load an index saved with save.
+        """
+        with span("read") as read_span:
+            with np.load(file, allow_pickle=False) as snapshot:
+                segment_index = cls(
+                    route_key=snapshot["route_key"],
+                    route_start=snapshot["route_start"],
+                    mp_left=snapshot["mp_left"],
+                    mp_right=snapshot["mp_right"],
+                    columns={
+                        name[len("col_"):]: snapshot[name] for name in snapshot.files if name.startswith("col_")
+                    },
+                )
+            read_span["rows_in"] = len(segment_index)
+        return segment_index
+
+    def get_route_rows(self, route_id):
+        """
+        Get the first and last + 1 row of a route ((0, 0) if the route is not in the index).
+        """
+        route_key = encode_route_id([route_id])[0]
+        route_pos = np.searchsorted(self.route_key, route_key)
+        if route_pos == len(self.route_key) or self.route_key[route_pos] != route_key:
+            return 0, 0
+        return self.route_start[route_pos], self.route_start[route_pos + 1]
+
+    def get_rows(self, row_idx):
+        """
+        Get the mileposts and score columns of rows.
+        """
+        return {
+            "aadt_interval_left": self.mp_left[row_idx],
+            "aadt_interval_right": self.mp_right[row_idx],
+            **{col: values[row_idx] for col, values in self.columns.items()},
+        }
+
+    def lookup(self, route_id, milepost):
+        """
+        Get the scores of the AADT interval of a route that contains the milepost. Intervals
+        are closed on the left, and the last interval of a route also contains its end.
+        Returns
+        -------
+        dict or None
+            Value of each column, None if no interval contains the milepost.
+        """
+        start, end = self.get_route_rows(route_id)
+        row = start + np.searchsorted(self.mp_left[start:end], milepost, side="right") - 1
+        if row < start or milepost > self.mp_right[row] or (milepost == self.mp_right[row] and row != end - 1):
+            return None
+        return {col: values.item() for col, values in self.get_rows(row).items()}
+
+    def range(self, route_id, mp_from, mp_to):
+        """
+        Get the scores of the AADT intervals of a route that overlap the milepost range
+        [mp_from, mp_to].
+        Returns
+        -------
+        dict
+            Array of each column, sorted by milepost.
+        """
+        start, end = self.get_route_rows(route_id)
+        first = start + np.searchsorted(self.mp_right[start:end], mp_from, side="right")
+        last = start + np.searchsorted(self.mp_left[start:end], mp_to, side="right")
+        return self.get_rows(slice(first, max(first, last)))
+
+    def lookup_batch(self, route_ids, mileposts):
+        """
+        Vectorized lookup of many route and milepost pairs (see lookup).
+        Returns
+        -------
+        dict
+            Array of each column for each query. "row" is -1 and the scores are missing for
+            queries without an interval.
+        """
+        route_key = encode_route_id(route_ids)
+        mileposts = np.asarray(mileposts, dtype=np.float64)
+        route_pos = np.minimum(np.searchsorted(self.route_key, route_key), len(self.route_key) - 1)
+        has_route = self.route_key[route_pos] == route_key
+        start = np.where(has_route, self.route_start[route_pos], 0)
+        end = np.where(has_route, self.route_start[np.minimum(route_pos + 1, len(self.route_key))], 0)
+        # Binary search of the last row starting at or before the milepost in each route.
+        lo, hi = start.copy(), end.copy()
+        while np.any(lo < hi):
+            is_searching = lo < hi
+            mid = (lo + hi) // 2
+            is_before = is_searching & (self.mp_left[np.minimum(mid, len(self) - 1)] <= mileposts)
+            lo = np.where(is_before, mid + 1, lo)
+            hi = np.where(is_searching & ~is_before, mid, hi)
+        row = lo - 1
+        row_clip = np.clip(row, 0, max(len(self) - 1, 0))
+        is_found = (
+            (row >= start)
+            & ((mileposts < self.mp_right[row_clip]) | ((mileposts == self.mp_right[row_clip]) & (row == end - 1)))
+        )
+        rows = self.get_rows(row_clip)
+        result_ = {}
+        for col, values in rows.items():
+            if col == "row":
+                result_[col] = np.where(is_found, values, -1)
+            else:
+                result_[col] = np.where(is_found, values.astype(np.float64), np.nan)
+        return result_
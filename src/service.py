@@ -0,0 +1,276 @@
+"""
+Local HTTP service for the final merge output (step 8). The AADT intervals are loaded once with
+a spatial index and the route and milepost index (src.segment_index.SegmentIndex), and the
+responses to repeated queries and map tiles are kept in an LRU cache. The service reloads the
+data in the background when the pipeline writes a new output, and keeps answering with the
+previous data until the new data is loaded.
+Queries (GET, JSON responses):
+- /segment?route_id=10000040092&milepost=12.3: scores of the AADT interval with the milepost.
+- /range?route_id=10000040092&mp_from=10&mp_to=15: scores of the AADT intervals in a milepost range.
+- /bbox?xmin=-79&ymin=35&xmax=-78.9&ymax=35.1[&limit=1000]: AADT intervals that intersect a box
+  in EPSG:4326 (GeoJSON).
+- /tile/<z>/<x>/<y>: AADT intervals that intersect an XYZ map tile (GeoJSON).
+- /top?n=10: AADT intervals with the highest composite score (DevConfig.SERVICE_COMPOSITE_SCORE_WEIGHTS).
+- /status: version of the data.
+The AADT intervals in all responses have the SERVICE_COLUMNS, "composite_score", and "row" (position
+in the GPKG). "limit" and "n" are at most DevConfig.SERVICE_MAX_FEATURES.
+"""
+import functools
+import json
+import math
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qsl
+import numpy as np
+import shapely
+from src.utils import get_project_root, read_gdf
+from src.segment_index import SegmentIndex
+from Config import DevConfig
+
+# Columns in the responses, with "composite_score" and "row" (position in the GPKG).
+SERVICE_COLUMNS = [
+    "route_id",
+    "route_class",
+    "aadt_interval_left",
+    "aadt_interval_right",
+    "aadt_val",
+    "inc_fac",
+    "si_fac",
+    "detour_fac",
+    "nat_imp_fac",
+    "growth_fac",
+    "seasonal_fac",
+]
+# Data used by the request handlers. Replaced as a whole when the data is reloaded, so a request
+# uses the same version of the data from start to end.
+_service_state = {"current": None}
+
+
+def get_service_files():
+    """
+    Paths to the final merge GPKG and the segment index snapshot of step 8.
+    """
+    path_processed_data = os.path.join(get_project_root(), DevConfig.DIR_NAME_DATA, DevConfig.DIR_NAME_PROCESSED)
+    return {
+        "gpkg": os.path.join(path_processed_data, DevConfig.PROCESSED_GPKG_ALL_DATA_MERGE),
+        "segment_index": os.path.join(path_processed_data, DevConfig.PROCESSED_NPZ_SEGMENT_INDEX),
+    }
+
+
+def get_data_version(service_files):
+    """
+    Version of the service data: the modification times of the files. The version is None if
+    step 8 has not written the files yet or is writing a new output (step 8 writes the segment
+    index after the GPKG, so the segment index is older than the GPKG).
+    """
+    try:
+        mtime_ns = {name: os.stat(file).st_mtime_ns for name, file in service_files.items()}
+    except FileNotFoundError:
+        return None
+    if mtime_ns["segment_index"] < mtime_ns["gpkg"]:
+        return None
+    return tuple(mtime_ns.values())
+
+
+def get_composite_score(df_, weights=DevConfig.SERVICE_COMPOSITE_SCORE_WEIGHTS):
+    """
+    Weighted sum of the score columns. Missing scores count as 0.
+    """
+    return sum(df_[col].fillna(0).values * weight for col, weight in weights.items())
+
+
+def load_service_data(service_files, cache_size=DevConfig.SERVICE_CACHE_SIZE):
+    """
+    Load the final merge output and build the indexes used by the queries.
+    Returns
+    -------
+    service_data_: dict or None
+        "version": see get_data_version. "gdf": AADT intervals with the SERVICE_COLUMNS,
+        "composite_score", and "row". "segment_index": SegmentIndex. "tree": STRtree of the
+        geometry. "top_order": rows sorted by decreasing composite score. "get_response":
+        LRU cached get_response for this data. None if step 8 is writing a new output, or
+        wrote one while the data was loaded, so the GPKG and segment index may not match.
+    """
+    version = get_data_version(service_files)
+    if version is None:
+        return None
+    gdf = read_gdf(service_files["gpkg"])
+    gdf = (
+        gdf.filter(items=[*SERVICE_COLUMNS, "geometry"])
+        .assign(composite_score=get_composite_score(gdf), row=np.arange(len(gdf)))
+    )
+    service_data_ = {
+        "version": version,
+        "gdf": gdf,
+        "segment_index": SegmentIndex.load(service_files["segment_index"]),
+        "tree": shapely.STRtree(gdf.geometry.values.data),
+        "top_order": np.argsort(-gdf.composite_score.values, kind="mergesort"),
+    }
+    if get_data_version(service_files) != version:
+        return None
+    service_data_["get_response"] = functools.lru_cache(maxsize=cache_size)(
+        functools.partial(get_response, service_data_)
+    )
+    return service_data_
+
+
+def get_tile_bbox(z, x, y):
+    """
+    Bounding box (xmin, ymin, xmax, ymax) in EPSG:4326 of an XYZ (web mercator) map tile.
+    """
+    n_tiles = 2 ** z
+
+    def tile_lat(tile_y):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * tile_y / n_tiles))))
+
+    return x / n_tiles * 360 - 180, tile_lat(y + 1), (x + 1) / n_tiles * 360 - 180, tile_lat(y)
+
+
+def get_count_param(params, name, default):
+    """
+    Number of AADT intervals asked for in a query, from 0 to DevConfig.SERVICE_MAX_FEATURES.
+    """
+    count = int(params.get(name, default))
+    if count < 0 or count > DevConfig.SERVICE_MAX_FEATURES:
+        raise ValueError(f"{name} must be from 0 to {DevConfig.SERVICE_MAX_FEATURES}.")
+    return count
+
+
+def get_records(service_data_, row):
+    """
+    JSON records of the AADT intervals in the rows, with the same columns as the GeoJSON
+    responses (SERVICE_COLUMNS, "composite_score", and "row").
+    """
+    return service_data_["gdf"].iloc[row].drop(columns="geometry").to_json(orient="records")
+
+
+def get_bbox_features(service_data_, bbox, limit):
+    """
+    GeoJSON of the AADT intervals that intersect the box, in the order of the rows.
+    """
+    row = np.sort(service_data_["tree"].query(shapely.box(*bbox), predicate="intersects"))[:limit]
+    return service_data_["gdf"].iloc[row].to_json(na="null", drop_id=True)
+
+
+def get_response(service_data_, route, query):
+    """
+    Answer a query.
+    Parameters
+    ----------
+    service_data_: dict
+        See load_service_data.
+    route: str
+        Path of the query (e.g. "/segment").
+    query: tuple
+        Sorted (name, value) pairs of the query string.
+    Returns
+    -------
+    tuple
+        HTTP status code and JSON body.
+    Raises
+    ------
+    KeyError, ValueError
+        If a parameter is missing or not valid.
+    """
+    params = dict(query)
+    if route == "/segment":
+        scores = service_data_["segment_index"].lookup(params["route_id"], float(params["milepost"]))
+        if scores is None:
+            return 404, json.dumps({"error": "No AADT interval at this route and milepost."})
+        return 200, json.dumps(json.loads(get_records(service_data_, [scores["row"]]))[0])
+    if route == "/range":
+        scores = service_data_["segment_index"].range(
+            params["route_id"], float(params["mp_from"]), float(params["mp_to"])
+        )
+        return 200, get_records(service_data_, scores["row"])
+    if route == "/bbox":
+        bbox = [float(params[name]) for name in ("xmin", "ymin", "xmax", "ymax")]
+        limit = get_count_param(params, "limit", DevConfig.SERVICE_MAX_FEATURES)
+        return 200, get_bbox_features(service_data_, bbox, limit)
+    if route.startswith("/tile/"):
+        z, x, y = (int(part) for part in route[len("/tile/"):].split("/"))
+        return 200, get_bbox_features(service_data_, get_tile_bbox(z, x, y), DevConfig.SERVICE_MAX_FEATURES)
+    if route == "/top":
+        row = service_data_["top_order"][:get_count_param(params, "n", 10)]
+        return 200, get_records(service_data_, row)
+    if route == "/status":
+        return 200, json.dumps({"version": service_data_["version"], "n_rows": len(service_data_["gdf"])})
+    return 404, json.dumps({"error": f"Unknown query {route}."})
+
+
+class ServiceRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        url = urlsplit(self.path)
+        service_data = _service_state["current"]
+        try:
+            status, body = service_data["get_response"](url.path.rstrip("/"), tuple(sorted(parse_qsl(url.query))))
+        except (KeyError, ValueError) as err:
+            status, body = 400, json.dumps({"error": f"Invalid query: {err}"})
+        body = body.encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def watch_service_data(service_files, reload_interval, stop_event):
+    """
+    Reload the service data when the pipeline writes a new output. The new data is loaded while
+    the previous data answers the requests, and then replaces it. An output that is being
+    written (see get_data_version) or a failed load is retried at the next check.
+    """
+    while not stop_event.wait(reload_interval):
+        try:
+            version = get_data_version(service_files)
+            if version is None or version == _service_state["current"]["version"]:
+                continue
+            service_data = load_service_data(service_files)
+            if service_data is None:
+                continue
+            _service_state["current"] = service_data
+            print(f"Reloaded the service data (version {_service_state['current']['version']}).")
+        except Exception as err:
+            print(f"Could not reload the service data: {err}")
+
+
+def run_service(host=DevConfig.SERVICE_HOST, port=DevConfig.SERVICE_PORT,
+                reload_interval=DevConfig.SERVICE_RELOAD_INTERVAL):
+    """
+    Run the local HTTP service on the final merge output until it is interrupted.
+    Parameters
+    ----------
+    host: str
+        Address of the service.
+    port: int
+        Port of the service.
+    reload_interval: float
+        Seconds between the checks for a new pipeline output.
+    """
+    service_files = get_service_files()
+    start_time = time.perf_counter()
+    _service_state["current"] = load_service_data(service_files)
+    while _service_state["current"] is None:
+        print(f"Waiting {reload_interval} s for step 8 to finish writing the output.")
+        time.sleep(reload_interval)
+        _service_state["current"] = load_service_data(service_files)
+    print(f"Loaded {len(_service_state['current']['gdf'])} AADT intervals in {time.perf_counter() - start_time:.1f} s.")
+    stop_event = threading.Event()
+    watcher = threading.Thread(
+        target=watch_service_data, args=(service_files, reload_interval, stop_event), daemon=True
+    )
+    watcher.start()
+    server = ThreadingHTTPServer((host, port), ServiceRequestHandler)
+    print(f"Serving on http://{host}:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop_event.set()
+        server.server_close()
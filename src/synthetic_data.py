@@ -0,0 +1,393 @@
+"""
+Generate synthetic raw input data with the same layout and schemas as the NCDOT data in
+data/0_raw (see Config.py), for benchmarks and for running the pipeline without the real data.
+"""
+import os
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import pyogrio
+import shapely
+from src.lrs import ROUTE_ID_WIDTH
+from Config import DataConfig, DevConfig
+
+# Number of 1: interstate, 2: US Route, and 3: NC Route route IDs (a route in a county) for
+# each scale. Secondary routes are added on top of these to exercise the route class filters.
+SCALES = {"county": 30, "state": 3000, "state_x10": 30000}
+# Raw data coordinate system (NAD83 / North Carolina (ftUS)) and the approximate state extent.
+RAW_CRS = "EPSG:2264"
+NC_BOUNDS = (400000.0, 30000.0, 3000000.0, 1000000.0)
+N_COUNTIES = 100
+# Census tract grid size (about the number of 2010 census tracts in North Carolina).
+N_TRACTS_X, N_TRACTS_Y = 66, 33
+INTERSTATE_NOS = np.array([26, 40, 73, 74, 77, 85, 95, 277, 285, 440, 485, 540, 795, 840])
+US_ROUTE_NOS = np.array(
+    [1, 13, 17, 19, 23, 25, 29, 52, 64, 70, 74, 117, 158, 220, 258, 264, 301, 321, 401, 421, 441]
+)
+FEET_PER_MILE = 5280
+
+
+def get_route_table(n_routes, rng, secondary_share=0.25):
+    """
+    Generate unique NCDOT route IDs and a random origin, direction, curvature, and length
+    for each route.
+    Parameters
+    ----------
+    n_routes: int
+        Number of 1: interstate, 2: US Route, and 3: NC Route route IDs.
+    rng: np.random.Generator
+        Random number generator.
+    secondary_share: float
+        Number of 4: secondary route IDs as a share of n_routes.
+    Returns
+    -------
+    route_df_: pd.DataFrame()
+        One row for each route ID.
+    """
+    n_secondary = int(round(n_routes * secondary_share))
+    # Sample more candidates than needed and keep the first unique route IDs.
+    n_candidates = 3 * (n_routes + n_secondary) + 100
+    route_class = rng.choice([1, 2, 3, 4], size=n_candidates, p=[0.08, 0.28, 0.44, 0.2])
+    route_no = np.select(
+        [route_class == 1, route_class == 2, route_class == 3],
+        [
+            rng.choice(INTERSTATE_NOS, size=n_candidates),
+            rng.choice(US_ROUTE_NOS, size=n_candidates),
+            rng.integers(1, 1000, size=n_candidates),
+        ],
+        rng.integers(1000, 10000, size=n_candidates),
+    )
+    route_df_ = pd.DataFrame({
+        "route_class": route_class,
+        "route_qual": rng.choice([0, 1, 2, 5, 7, 8, 9], size=n_candidates,
+                                 p=[0.88, 0.02, 0.02, 0.01, 0.01, 0.01, 0.05]),
+        "route_no": route_no,
+        "route_county": rng.integers(1, N_COUNTIES + 1, size=n_candidates),
+    }).assign(
+        route_key=lambda df: (
+            df.route_class * 10 ** (ROUTE_ID_WIDTH - 1)
+            + df.route_qual * 10 ** (ROUTE_ID_WIDTH - 2)
+            + df.route_no * 1000
+            + df.route_county
+        ).astype(np.int64)
+    ).drop_duplicates("route_key")
+    route_df_ = (
+        pd.concat([
+            route_df_.loc[lambda df: df.route_class <= 3].head(n_routes),
+            route_df_.loc[lambda df: df.route_class == 4].head(n_secondary),
+        ])
+        .sort_values("route_key")
+        .reset_index(drop=True)
+    )
+    n_route = len(route_df_)
+    # Routes start in their county. Counties are cells of a 10 x 10 grid over the state.
+    xmin, ymin, xmax, ymax = NC_BOUNDS
+    county_col, county_row = (route_df_.route_county.values - 1) % 10, (route_df_.route_county.values - 1) // 10
+    angle = rng.uniform(0, 2 * np.pi, n_route)
+    return route_df_.assign(
+        route_id=lambda df: df.route_key.astype(str),
+        x0=xmin + (county_col + rng.uniform(0, 1, n_route)) * (xmax - xmin) / 10,
+        y0=ymin + (county_row + rng.uniform(0, 1, n_route)) * (ymax - ymin) / 10,
+        dir_x=np.cos(angle),
+        dir_y=np.sin(angle),
+        curve_amp=rng.uniform(0, 2000, n_route),
+        curve_len=rng.uniform(2, 10, n_route),
+        route_len=np.round(
+            np.where(route_df_.route_class == 1, rng.uniform(5, 40, n_route), rng.uniform(0.5, 20, n_route)), 3
+        ),
+    )
+
+
+def get_intervals(route_df_, mean_len, rng):
+    """
+    Split each route into milepost intervals with random lengths.
+    Parameters
+    ----------
+    route_df_: pd.DataFrame()
+        Routes (see get_route_table).
+    mean_len: float
+        Mean interval length in miles.
+    rng: np.random.Generator
+        Random number generator.
+    Returns
+    -------
+    interval_df_: pd.DataFrame()
+        One row for each interval with the columns "route_pos", "st_mp_pt", and "end_mp_pt".
+    """
+    n_interval = np.maximum(1, rng.poisson(route_df_.route_len.values / mean_len))
+    route_pos = np.repeat(np.arange(len(route_df_)), n_interval)
+    gap = rng.exponential(1, len(route_pos))
+    cum_gap = pd.Series(gap).groupby(route_pos).cumsum().values
+    route_gap = pd.Series(gap).groupby(route_pos).sum().values[route_pos]
+    end_mp_pt = np.round(cum_gap / route_gap * route_df_.route_len.values[route_pos], 3)
+    st_mp_pt = pd.Series(end_mp_pt).groupby(route_pos).shift(1).fillna(0).values
+    return pd.DataFrame({"route_pos": route_pos, "st_mp_pt": st_mp_pt, "end_mp_pt": end_mp_pt}).loc[
+        lambda df: df.end_mp_pt > df.st_mp_pt
+    ].reset_index(drop=True)
+
+
+def get_interval_geometry(route_df_, interval_df_, vertex_spacing=0.25):
+    """
+    Create the line geometry of each interval from the route origin, direction, and
+    curvature. Intervals on the same route at the same mileposts have the same geometry.
+    Parameters
+    ----------
+    route_df_: pd.DataFrame()
+        Routes (see get_route_table).
+    interval_df_: pd.DataFrame()
+        Intervals (see get_intervals).
+    vertex_spacing: float
+        Distance between the line vertices in miles.
+    Returns
+    -------
+    np.ndarray
+        shapely LineStrings.
+    """
+    st_mp_pt, end_mp_pt = interval_df_.st_mp_pt.values, interval_df_.end_mp_pt.values
+    n_vertex = np.clip(np.ceil((end_mp_pt - st_mp_pt) / vertex_spacing).astype(int) + 1, 2, 50)
+    interval_idx = np.repeat(np.arange(len(interval_df_)), n_vertex)
+    vertex_no = np.arange(len(interval_idx)) - np.repeat(np.cumsum(n_vertex) - n_vertex, n_vertex)
+    milepost = st_mp_pt[interval_idx] + (vertex_no / (n_vertex[interval_idx] - 1)) * (
+        end_mp_pt[interval_idx] - st_mp_pt[interval_idx]
+    )
+    route = route_df_.iloc[interval_df_.route_pos.values[interval_idx]]
+    offset = route.curve_amp.values * np.sin(milepost / route.curve_len.values)
+    coords = np.column_stack([
+        route.x0.values + milepost * FEET_PER_MILE * route.dir_x.values - offset * route.dir_y.values,
+        route.y0.values + milepost * FEET_PER_MILE * route.dir_y.values + offset * route.dir_x.values,
+    ])
+    return shapely.linestrings(coords, indices=interval_idx)
+
+
+def get_aadt_segments(route_df_, rng, overlap_share=0.02, gap_share=0.01):
+    """
+    Generate the "NCDOT 20XX AADT Traffic Segment" data. Some intervals overlap the previous
+    interval on the route and some are missing, like in the real data.
+    """
+    aadt_df = get_intervals(route_df_, mean_len=1.5, rng=rng)
+    is_first = aadt_df.st_mp_pt.values == 0
+    overlap = ~is_first & (rng.uniform(size=len(aadt_df)) < overlap_share)
+    aadt_df.loc[overlap, "st_mp_pt"] = np.round(
+        np.maximum(0, aadt_df.st_mp_pt.values[overlap] - rng.uniform(0.01, 0.2, overlap.sum())), 3
+    )
+    aadt_df = aadt_df.loc[is_first | (rng.uniform(size=len(aadt_df)) >= gap_share)].reset_index(drop=True)
+    route_class = route_df_.route_class.values[aadt_df.route_pos]
+    aadt = np.round(
+        rng.lognormal(np.log(np.select([route_class == 1, route_class == 2, route_class == 3], [50000, 14000, 6000], 1200)), 0.5)
+    ).astype(np.int64)
+    return gpd.GeoDataFrame(
+        {
+            "RouteID": route_df_.route_key.values[aadt_df.route_pos],
+            "BeginMp": aadt_df.st_mp_pt,
+            "EndMp": aadt_df.end_mp_pt,
+            DataConfig.FIELD_AADT.upper(): aadt,
+            DataConfig.FIELD_AADTT.upper(): np.round(aadt * rng.uniform(0.03, 0.25, len(aadt))).astype(np.int64),
+            "County": route_df_.route_county.values[aadt_df.route_pos],
+            "Source": rng.choice(["Count", "Estimate", "Projection"], size=len(aadt_df), p=[0.7, 0.2, 0.1]),
+        },
+        geometry=get_interval_geometry(route_df_, aadt_df),
+        crs=RAW_CRS,
+    )
+
+
+def get_safety_scores(route_df_, rng, missing_score_share=0.02):
+    """
+    Generate the "Section Safety Scores" data. The scores are text fields with some missing
+    values, like in the real data.
+    """
+    crash_df = get_intervals(route_df_, mean_len=1.0, rng=rng)
+    route_class = route_df_.route_class.values[crash_df.route_pos]
+    seg_len = crash_df.end_mp_pt.values - crash_df.st_mp_pt.values
+    crash_rate = np.select([route_class == 1, route_class == 2, route_class == 3], [40, 25, 12], 4)
+    ka_cnt = rng.poisson(0.01 * crash_rate * seg_len)
+    bc_cnt = rng.poisson(0.25 * crash_rate * seg_len)
+    pdo_cnt = rng.poisson(0.74 * crash_rate * seg_len)
+
+    def get_score():
+        score = np.round(rng.uniform(0, 100, len(crash_df)), 2).astype(str)
+        return np.where(rng.uniform(size=len(crash_df)) < missing_score_share, "", score)
+
+    crash_gdf_ = gpd.GeoDataFrame(
+        {
+            DataConfig.FIELD_GIS_ROUTE: route_df_.route_key.values[crash_df.route_pos],
+            "county": route_df_.route_county.values[crash_df.route_pos],
+            "st_mp_pt": crash_df.st_mp_pt,
+            "end_mp_pt": crash_df.end_mp_pt,
+            "density_sc": get_score(),
+            "severity_s": get_score(),
+            "rate_score": get_score(),
+            "combined_s": get_score(),
+            "combined_r": rng.choice(["Low", "Medium", "High"], size=len(crash_df)),
+            "ka_cnt": ka_cnt,
+            "bc_cnt": bc_cnt,
+            "pdo_cnt": pdo_cnt,
+            DataConfig.FIELD_TOTAL_CNT: ka_cnt + bc_cnt + pdo_cnt,
+            "Shape__Len": seg_len * FEET_PER_MILE,
+        },
+        geometry=get_interval_geometry(route_df_, crash_df),
+        crs=RAW_CRS,
+    )
+    return crash_gdf_
+
+
+def get_hpms(route_df_, rng, missing_share=0.02):
+    """
+    Generate the HPMS data with one full length section for each 1: interstate, 2: US Route,
+    and 3: NC Route route ID. A few route IDs are missing, like in the real data.
+    """
+    hpms_route_df = route_df_.loc[
+        lambda df: (df.route_class <= 3) & (rng.uniform(size=len(df)) >= missing_share)
+    ].reset_index(drop=True)
+    route_class = hpms_route_df.route_class.values
+    is_nhs = rng.uniform(size=len(hpms_route_df)) < np.select([route_class == 1, route_class == 2], [1, 0.7], 0.2)
+    hpms_interval_df = pd.DataFrame({
+        "route_pos": hpms_route_df.index.values,
+        "st_mp_pt": 0.0,
+        "end_mp_pt": hpms_route_df.route_len.values,
+    })
+    return gpd.GeoDataFrame(
+        {
+            "route_id": hpms_route_df.route_id,
+            "route_sign": hpms_route_df.route_class + 1,
+            "route_numb": hpms_route_df.route_no,
+            "route_qual": hpms_route_df.route_qual,
+            "nhs": np.where(is_nhs, rng.integers(1, 10, len(hpms_route_df)), 0),
+            "strahnet_t": (route_class == 1).astype(int),
+        },
+        geometry=get_interval_geometry(hpms_route_df, hpms_interval_df, vertex_spacing=1),
+        crs=RAW_CRS,
+    )
+
+
+def get_padt(route_df_, rng, coverage_share=0.8):
+    """
+    Generate the SEG_T3 PADT data on most of the 1: interstate, 2: US Route, and 3: NC Route
+    route IDs.
+    """
+    padt_route_df = route_df_.loc[
+        lambda df: (df.route_class <= 3) & (rng.uniform(size=len(df)) < coverage_share)
+    ].reset_index(drop=True)
+    padt_df = get_intervals(padt_route_df, mean_len=3, rng=rng)
+    route = padt_route_df.iloc[padt_df.route_pos.values]
+    route_class_label = route.route_class.map({1: "I", 2: "US", 3: "NC"}).values
+    street_name = pd.Series(route_class_label + "-" + route.route_no.astype(str).values).where(
+        route.route_qual.values != 9, route_class_label + "-" + route.route_no.astype(str).values + " BUSINESS"
+    )
+    return gpd.GeoDataFrame(
+        {
+            "RTE_1_NBR": route.route_no.astype(str).values,
+            "RTE_1_CLSS": route_class_label,
+            "STREET_NAM": street_name.values,
+            "PADT_REC": np.round(rng.uniform(1, 1.6, len(padt_df)), 3),
+        },
+        geometry=get_interval_geometry(padt_route_df, padt_df),
+        crs=RAW_CRS,
+    )
+
+
+def get_detour(aadt_gdf_, rng):
+    """
+    Generate the detour scores on the AADT segments.
+    """
+    route_id = aadt_gdf_.RouteID.astype(np.int64).astype(str)
+    return gpd.GeoDataFrame(
+        {
+            "RouteID": route_id.values,
+            "BeginMp": aadt_gdf_.BeginMp.values,
+            "scr_det": np.round(rng.uniform(0, 1, len(aadt_gdf_)), 4),
+            "scr_d90": np.round(rng.uniform(0, 1, len(aadt_gdf_)), 4),
+            "scr_nd90": np.round(rng.uniform(0, 1, len(aadt_gdf_)), 4),
+            "class": route_id.str[0].values,
+        },
+        geometry=aadt_gdf_.geometry.values,
+        crs=RAW_CRS,
+    )
+
+
+def get_census_tracts(rng):
+    """
+    Generate census tract polygons on a grid over the state, and the 2015 and 2040 flows
+    and growth rate of each tract.
+    Returns
+    -------
+    {"census_tract_gdf": census_tract_gdf, "growth_df": growth_df} : dict
+    """
+    xmin, ymin, xmax, ymax = NC_BOUNDS
+    x_edges = np.linspace(xmin - 50000, xmax + 50000, N_TRACTS_X + 1)
+    y_edges = np.linspace(ymin - 50000, ymax + 50000, N_TRACTS_Y + 1)
+    x_no, y_no = np.meshgrid(np.arange(N_TRACTS_X), np.arange(N_TRACTS_Y))
+    x_no, y_no = x_no.ravel(), y_no.ravel()
+    tract_no = np.arange(len(x_no))
+    county_fips = 2 * (tract_no % N_COUNTIES) + 1
+    geoid10 = pd.Series(
+        ["37" + f"{county:03d}" + f"{tract:06d}" for county, tract in zip(county_fips, tract_no)]
+    )
+    census_tract_gdf = gpd.GeoDataFrame(
+        {"GEOID10": geoid10},
+        geometry=shapely.box(x_edges[x_no], y_edges[y_no], x_edges[x_no + 1], y_edges[y_no + 1]),
+        crs=RAW_CRS,
+    )
+    flow_2015 = np.round(rng.uniform(1000, 50000, len(geoid10)), 1)
+    flow_2040 = np.round(flow_2015 * rng.uniform(0.9, 2, len(geoid10)), 1)
+    growth_df = pd.DataFrame({
+        "GEOID10": geoid10,
+        "2015_Tot_Flow_24h": flow_2015,
+        "2040_Tot_Flow_24h": flow_2040,
+        "24h_Tot_GR": (flow_2040 / flow_2015 - 1) * 100,
+    })
+    return {"census_tract_gdf": census_tract_gdf, "growth_df": growth_df}
+
+
+def write_raw_shp(gdf_, path_to_raw, dir_name, file_name):
+    path_dir = os.path.join(path_to_raw, dir_name)
+    if not os.path.isdir(path_dir):
+        os.makedirs(path_dir)
+    pyogrio.write_dataframe(gdf_, os.path.join(path_dir, file_name))
+
+
+def write_synthetic_raw_data(path_to_raw, scale="county", seed=0):
+    """
+    Write synthetic AADT, safety scores, HPMS, PADT, detour, and census tract data to a raw
+    data directory with the directory, file, and field names in Config.py.
+    Parameters
+    ----------
+    path_to_raw: str
+        Raw data directory. Do not use the directory with the real data.
+    scale: str or int
+        Key of SCALES or the number of 1: interstate, 2: US Route, and 3: NC Route route IDs.
+    seed: int
+        Random seed. The same scale and seed give the same data.
+    Returns
+    -------
+    n_rows: dict
+        Number of rows written to each dataset.
+    """
+    n_routes = SCALES[scale] if isinstance(scale, str) else int(scale)
+    rng = np.random.default_rng(seed)
+    route_df = get_route_table(n_routes, rng)
+    aadt_gdf = get_aadt_segments(route_df, rng)
+    crash_gdf = get_safety_scores(route_df, rng)
+    hpms_gdf = get_hpms(route_df, rng)
+    padt_gdf = get_padt(route_df, rng)
+    detour_gdf = get_detour(aadt_gdf, rng)
+    census_tracts = get_census_tracts(rng)
+    write_raw_shp(aadt_gdf, path_to_raw, DataConfig.DIR_AADT_SEGMENTS, DataConfig.SHAPEFILE_AADT)
+    write_raw_shp(crash_gdf, path_to_raw, DataConfig.DIR_SAFETY_SCORES, DataConfig.SHAPEFILE_SAFETY)
+    write_raw_shp(hpms_gdf, path_to_raw, DataConfig.DIR_HPMS, DataConfig.SHAPEFILE_HPMS)
+    write_raw_shp(padt_gdf, path_to_raw, DataConfig.DIR_SEG_T3, DataConfig.SHAPEFILE_SEG_T3)
+    write_raw_shp(detour_gdf, path_to_raw, DevConfig.INPUT_DIR_DETOUR_TESTING, DevConfig.INPUT_SHAPEFILE_DETOUR)
+    write_raw_shp(
+        census_tracts["census_tract_gdf"], path_to_raw, DataConfig.DIR_CENSUS_TRACT, DataConfig.SHAPEFILE_CENSUS_TRACT
+    )
+    census_tracts["growth_df"].to_csv(
+        os.path.join(path_to_raw, DataConfig.DIR_CENSUS_TRACT, DataConfig.CSV_CENSUS_COMBINED_FLOW), index=False
+    )
+    return {
+        "routes": len(route_df),
+        "aadt": len(aadt_gdf),
+        "crash": len(crash_gdf),
+        "hpms": len(hpms_gdf),
+        "padt": len(padt_gdf),
+        "detour": len(detour_gdf),
+        "census_tract": len(census_tracts["census_tract_gdf"]),
+    }
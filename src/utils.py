@@ -1,6 +1,53 @@
+import functools
+import hashlib
+import json
+import os
 from pathlib import Path
 import inflection
+import numpy as np
+import pandas as pd
 import geopandas as gpd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pyogrio
+import pyproj
+from pyogrio.raw import open_arrow
+import shapely
+from src.run_report import span
+from Config import DevConfig
+
+GDF_FILE_DRIVERS = {".gpkg": "GPKG", ".shp": "ESRI Shapefile"}
+INTERIM_FORMAT_EXTENSIONS = {"parquet": ".parquet", "gpkg": ".gpkg"}
+SHAPEFILE_SIDECAR_EXTENSIONS = (".shp", ".shx", ".dbf", ".prj", ".cpg")
+# Compact data types for the AADT and merged AADT + crash segment tables. Mileposts stay
+# float64 because they are join keys. AADT values are whole numbers, so float32 stores them
+# exactly.
+SEGMENT_SCHEMA = {
+    "route_class": "int8",
+    "route_qual": "int8",
+    "route_inventory": "int8",
+    "route_no": "int32",
+    "route_county": "int16",
+    "county": "category",
+    "source": "category",
+    "aadt_val": "float32",
+    "aadtt_val": "float32",
+}
+# Compact data types for the crash segment table. The raw crash counts are whole numbers. The
+# counts scaled to the AADT intervals are not, so they stay float64 in the merged table.
+CRASH_SCHEMA = {
+    **SEGMENT_SCHEMA,
+    "ka_cnt": "float32",
+    "bc_cnt": "float32",
+    "pdo_cnt": "float32",
+    "total_cnt": "float32",
+    "density_sc": "float32",
+    "severity_s": "float32",
+    "rate_score": "float32",
+    "combined_s": "float32",
+    "shape_len_mi": "float32",
+}
+ROUTE_CLASS_LABEL_DTYPE = pd.CategoricalDtype(["Interstate", "US Route", "NC Route", "Secondary Routes"])
 
 
 def get_project_root() -> Path:
@@ -13,18 +60,638 @@ def reorder_columns(df, first_cols):
     return df
 
 
-def read_shp(file, data_name=""):
+def get_raw_field_names(file):
+    """
+    Map the underscored field names used in the code to the field names in a raw data file.
+    Parameters
+    ----------
+    file: str
+        Path to the raw data file (e.g. a shapefile).
+    Returns
+    -------
+    dict
+        Raw field name and field type ("field", "dtype") keyed by underscored field name.
+    """
+    layer_info = pyogrio.read_info(file)
+    return {
+        inflection.underscore(field): {"field": field, "dtype": dtype}
+        for field, dtype in zip(layer_info["fields"], layer_info["dtypes"])
+    }
+
+
+def get_route_class_filter(file, route_id_field, max_route_class):
+    """
+    Create an attribute filter (OGR SQL WHERE clause) that keeps the routes with a route
+    class (first digit of the 11 digit NCDOT route ID) less than or equal to
+    max_route_class. Works with route IDs stored as numbers or as text.
+    Parameters
+    ----------
+    file: str
+        Path to the raw data file.
+    route_id_field: str
+        Underscored name of the route ID field (e.g. "route_id" or "route_gis").
+    max_route_class: int
+        1: interstate, 2: US Route, 3: NC Route, 4: Secondary Route.
+    Returns
+    -------
+    str
+        WHERE clause for read_shp.
+    """
+    route_id_info = get_raw_field_names(file)[route_id_field]
+    if route_id_info["dtype"] == "object":
+        return " OR ".join(
+            f"\"{route_id_info['field']}\" LIKE '{route_class}%'"
+            for route_class in range(1, max_route_class + 1)
+        )
+    return f"\"{route_id_info['field']}\" < {(max_route_class + 1) * 10 ** 10}"
+
+
+@functools.lru_cache(maxsize=None)
+def get_transformer(crs_from, crs_to):
+    """
+    Get the transformer between two coordinate systems. It is created once for each pair of
+    coordinate systems and reused by all reprojections.
+    """
+    return pyproj.Transformer.from_crs(crs_from, crs_to, always_xy=True)
+
+
+def reproject_geometry(geometry_, epsg):
     """
+    Reproject the geometry to an EPSG coordinate system with a shared transformer (see
+    get_transformer). Gives the same coordinates as gpd.GeoSeries.to_crs.
     Parameters
     ----------
-    file
-    data_name
+    geometry_: gpd.GeoSeries()
+        Geometry with a coordinate system.
+    epsg: int
+        EPSG code of the output coordinate system.
+    Returns
+    -------
+    gpd.GeoSeries()
+        Reprojected geometry with the index of geometry_.
+    """
+    if geometry_.crs is None:
+        raise ValueError("Cannot transform naive geometries. Please set a crs on the object first.")
+    crs_to = pyproj.CRS.from_epsg(epsg)
+    if geometry_.crs.is_exact_same(crs_to):
+        return geometry_.copy()
+    transformer = get_transformer(geometry_.crs, crs_to)
+    with span("reproject"):
+        data = geometry_.values.data
+        has_z = shapely.has_z(data)
+        new_data = np.empty_like(data)
+        for is_z in (False, True):
+            new_data[has_z == is_z] = shapely.transform(
+                data[has_z == is_z],
+                lambda coords: np.column_stack(transformer.transform(*coords.T)),
+                include_z=is_z,
+            )
+    return gpd.GeoSeries(new_data, index=geometry_.index, crs=crs_to)
+
+
+def get_reprojection_cache_dir():
+    """
+    Get the path to the reprojection cache (data/1_interim/reprojection_cache).
+    """
+    return os.path.join(
+        get_project_root(),
+        DevConfig.DIR_NAME_DATA,
+        DevConfig.DIR_NAME_INTERIM,
+        DevConfig.INTERIM_DIR_REPROJECTION_CACHE,
+    )
+
 
+def get_dataset_fingerprints(file):
+    """
+    Fingerprint the files of a raw dataset (see get_file_fingerprint) for the reprojection cache
+    and the census tract assignment cache. The fingerprints are saved in the reprojection cache
+    directory, so the files are only hashed again when their size or modification time changed.
     Returns
     -------
+    dict
+        Fingerprint of each dataset file, keyed by file name.
+    """
+    path_cache = get_reprojection_cache_dir()
+    stem = os.path.splitext(os.path.basename(file))[0]
+    fingerprint_file = os.path.join(path_cache, f"{stem}_fingerprints.json")
+    prev_fingerprints = {}
+    if os.path.isfile(fingerprint_file):
+        with open(fingerprint_file) as f:
+            prev_fingerprints = json.load(f)
+    fingerprints_ = {
+        os.path.basename(dataset_file): get_file_fingerprint(
+            dataset_file, prev_fingerprints.get(os.path.basename(dataset_file))
+        )
+        for dataset_file in get_dataset_files(file)
+    }
+    if fingerprints_ != prev_fingerprints:
+        if not os.path.isdir(path_cache):
+            os.makedirs(path_cache)
+        # Replace the file in one step, so steps running at the same time never read a partial file.
+        with open(f"{fingerprint_file}.{os.getpid()}.tmp", "w") as f:
+            json.dump(fingerprints_, f, indent=2)
+        os.replace(f"{fingerprint_file}.{os.getpid()}.tmp", fingerprint_file)
+    return fingerprints_
+
 
+def get_reprojection_cache_file(file, epsg, where=None, bbox=None):
     """
-    gdf_ = gpd.read_file(file)
-    print(f"{data_name} cooridnate sytem is {gdf_.crs.srs}")
+    Get the path to the reprojected geometry of a raw dataset in the reprojection cache
+    (data/1_interim/reprojection_cache). The file name has a key computed from the content
+    hashes of the dataset files (see get_dataset_fingerprints), the filters, and the output
+    coordinate system, so a changed dataset is reprojected again.
+    """
+    key_hash = hashlib.sha256()
+    for fingerprint in get_dataset_fingerprints(file).values():
+        key_hash.update(fingerprint["sha256"].encode())
+    key_hash.update(json.dumps([where, None if bbox is None else list(bbox), epsg]).encode())
+    stem = os.path.splitext(os.path.basename(file))[0]
+    return os.path.join(get_reprojection_cache_dir(), f"{stem}_epsg{epsg}_{key_hash.hexdigest()[:16]}.parquet")
+
+
+def read_reprojection_cache(cache_file, epsg, n_rows):
+    """
+    Read the reprojected geometry from the reprojection cache. None if the number of rows
+    does not match the rows read from the dataset.
+    """
+    with span("read"):
+        wkb = pq.read_table(cache_file, columns=["geometry"]).column("geometry").to_numpy(zero_copy_only=False)
+    if len(wkb) != n_rows:
+        return None
+    return gpd.GeoSeries.from_wkb(wkb, crs=pyproj.CRS.from_epsg(epsg))
+
+
+def write_reprojection_cache(cache_file, geometry_):
+    """
+    Write the reprojected geometry to the reprojection cache as a WKB column, in the order of
+    the rows read. Older versions of the cache for the same dataset and coordinate system are
+    removed.
+    """
+    path_cache, cache_name = os.path.split(cache_file)
+    if not os.path.isdir(path_cache):
+        os.makedirs(path_cache)
+    cache_prefix = cache_name.rsplit("_", 1)[0] + "_"
+    for old_cache_name in os.listdir(path_cache):
+        if old_cache_name.startswith(cache_prefix) and old_cache_name != cache_name:
+            os.remove(os.path.join(path_cache, old_cache_name))
+    with span("write") as write_span:
+        pq.write_table(pa.table({"geometry": shapely.to_wkb(geometry_.values.data)}), cache_file)
+        write_span["rows_out"] = len(geometry_)
+
+
+def read_shp(
+    file, data_name="", columns=None, where=None, bbox=None, ignore_geometry=False, to_epsg=None,
+    use_cache=DevConfig.USE_REPROJECTION_CACHE,
+):
+    """
+    Read a raw shapefile with the Arrow based OGR reader and underscore the column names.
+    Column selection, attribute filter, and bounding box filter are applied while reading,
+    so rows and columns that are not needed are never loaded.
+    Parameters
+    ----------
+    file: str
+        Path to the shapefile.
+    data_name: str
+        Name of the data used in messages.
+    columns: list
+        Underscored names of the columns to read. Names that are not in the file are skipped.
+        All columns if None.
+    where: str
+        Attribute filter as an OGR SQL WHERE clause on the raw field names (see
+        get_route_class_filter).
+    bbox: tuple
+        (xmin, ymin, xmax, ymax) in the coordinate system of the file. Only features that
+        intersect the box are read.
+    ignore_geometry: bool
+        True, read the attributes only and return a pd.DataFrame.
+    to_epsg: int
+        EPSG code to reproject the geometry to (e.g. 4326). Not reprojected if None.
+    use_cache: bool
+        True, reuse the reprojected geometry saved in the reprojection cache by an earlier read
+        of the same dataset (see get_reprojection_cache_file).
+    Returns
+    -------
+    gdf_: gpd.GeoDataFrame() or pd.DataFrame()
+        Data with underscored column names.
+    """
+    if to_epsg is not None and not ignore_geometry:
+        cache_file = get_reprojection_cache_file(file, to_epsg, where=where, bbox=bbox) if use_cache else None
+        if cache_file is not None and os.path.isfile(cache_file):
+            # Read the attributes only and attach the cached geometry by position.
+            df = read_shp(file, columns=columns, where=where, bbox=bbox, ignore_geometry=True)
+            geometry = read_reprojection_cache(cache_file, to_epsg, len(df))
+            if geometry is not None:
+                print(f"{data_name} coordinate system is {pyogrio.read_info(file)['crs']}")
+                return gpd.GeoDataFrame(df, geometry=geometry.set_axis(df.index))
+        gdf_ = read_shp(file, data_name=data_name, columns=columns, where=where, bbox=bbox)
+        geometry = reproject_geometry(gdf_.geometry, to_epsg)
+        if cache_file is not None:
+            write_reprojection_cache(cache_file, geometry)
+        return gdf_.set_geometry(geometry)
+    raw_columns = None
+    if columns is not None:
+        raw_field_names = get_raw_field_names(file)
+        raw_columns = [
+            raw_field_names[col_name]["field"] for col_name in columns if col_name in raw_field_names
+        ]
+    with span("read") as read_span:
+        gdf_ = pyogrio.read_dataframe(
+            file,
+            columns=raw_columns,
+            where=where,
+            bbox=bbox,
+            read_geometry=not ignore_geometry,
+            use_arrow=True,
+        )
+        read_span["rows_in"] = len(gdf_)
+    if not ignore_geometry:
+        print(f"{data_name} coordinate system is {gdf_.crs.srs}")
     gdf_.columns = [inflection.underscore(col_name) for col_name in gdf_.columns]
     return gdf_
+
+
+def read_shp_batches(file, batch_size, data_name="", columns=None, where=None):
+    """
+    Read a raw shapefile in batches of rows with the Arrow based OGR reader, so that only one
+    batch is in memory at a time. Column names are underscored as in read_shp.
+    Parameters
+    ----------
+    file: str
+        Path to the shapefile.
+    batch_size: int
+        Number of rows in each batch.
+    data_name: str
+        Name of the data used in messages.
+    columns: list
+        Underscored names of the columns to read. Names that are not in the file are skipped.
+        All columns if None.
+    where: str
+        Attribute filter as an OGR SQL WHERE clause on the raw field names (see
+        get_route_class_filter).
+    Yields
+    ------
+    gdf_: gpd.GeoDataFrame()
+        Next batch of rows with underscored column names.
+    """
+    raw_columns = None
+    if columns is not None:
+        raw_field_names = get_raw_field_names(file)
+        raw_columns = [
+            raw_field_names[col_name]["field"] for col_name in columns if col_name in raw_field_names
+        ]
+    with open_arrow(file, columns=raw_columns, where=where, batch_size=batch_size) as (meta, reader):
+        print(f"{data_name} coordinate system is {meta['crs']}")
+        geometry_name = meta["geometry_name"] or "wkb_geometry"
+        batches = iter(reader)
+        while True:
+            with span("read") as read_span:
+                batch = next(batches, None)
+                if batch is None:
+                    break
+                df = batch.to_pandas()
+                geometry = gpd.GeoSeries.from_wkb(df.pop(geometry_name).values, index=df.index, crs=meta["crs"])
+                gdf_ = gpd.GeoDataFrame(df, geometry=geometry)
+                read_span["rows_in"] = len(gdf_)
+            gdf_.columns = [inflection.underscore(col_name) for col_name in gdf_.columns]
+            yield gdf_
+
+
+def get_interim_file(file, interim_format=None):
+    """
+    Get the path of a file passed between steps in the interim format set in
+    DevConfig.INTERIM_FORMAT ("parquet" for GeoParquet or "gpkg").
+    Parameters
+    ----------
+    file: str
+        Path to the file with any extension (e.g. the .gpkg names in DevConfig).
+    interim_format: str
+        Interim format. DevConfig.INTERIM_FORMAT if None.
+    Returns
+    -------
+    str
+        Path with the extension of the interim format.
+    """
+    interim_format = DevConfig.INTERIM_FORMAT if interim_format is None else interim_format
+    if interim_format not in INTERIM_FORMAT_EXTENSIONS:
+        raise ValueError(
+            f"Interim format must be one of {list(INTERIM_FORMAT_EXTENSIONS)}, not {interim_format}."
+        )
+    return os.path.splitext(file)[0] + INTERIM_FORMAT_EXTENSIONS[interim_format]
+
+
+def get_memory_usage(df_):
+    """
+    Memory used by the data in MB, including the content of object columns.
+    """
+    return df_.memory_usage(deep=True).sum() / 2 ** 20
+
+
+def print_schema_memory(data_name, memory_):
+    """
+    Print the memory used before and after the compact schema (see apply_schema).
+    """
+    print(f"{data_name} memory: {memory_['before']:.1f} MB -> {memory_['after']:.1f} MB with the compact schema")
+
+
+def apply_schema(df_, schema=None, data_name="", memory_=None):
+    """
+    Cast the columns of the data to compact data types and report the memory used before
+    and after.
+    Parameters
+    ----------
+    df_: pd.DataFrame() or gpd.GeoDataFrame()
+        Data.
+    schema: dict
+        Data type for each column name. Columns that are not in the data are skipped.
+        SEGMENT_SCHEMA if None.
+    data_name: str
+        Name of the data used in the report.
+    memory_: dict
+        If given, the memory used before and after is added to its "before" and "after" values
+        (MB) instead of printed, so data cleaned in batches is reported once with
+        print_schema_memory.
+    Returns
+    -------
+    df_: pd.DataFrame() or gpd.GeoDataFrame()
+        Data with the compact data types.
+    """
+    schema = SEGMENT_SCHEMA if schema is None else schema
+    memory_before = get_memory_usage(df_)
+    df_ = df_.astype({col: dtype for col, dtype in schema.items() if col in df_.columns})
+    if memory_ is None:
+        print_schema_memory(data_name, {"before": memory_before, "after": get_memory_usage(df_)})
+    else:
+        memory_["before"] += memory_before
+        memory_["after"] += get_memory_usage(df_)
+    return df_
+
+
+def read_gdf(file, schema=None, **kwargs):
+    """
+    Read a GeoDataFrame from a GeoParquet (.parquet), GeoPackage (.gpkg), or shapefile (.shp).
+    Parameters
+    ----------
+    file: str
+        Path to the file.
+    schema: dict
+        Compact data types to apply after reading (e.g. SEGMENT_SCHEMA). Not applied if None.
+    kwargs
+        Passed on to gpd.read_parquet or gpd.read_file.
+    Returns
+    -------
+    gpd.GeoDataFrame()
+    """
+    with span("read") as read_span:
+        if os.path.splitext(file)[1].lower() == ".parquet":
+            gdf_ = gpd.read_parquet(file, **kwargs)
+        else:
+            gdf_ = gpd.read_file(file, **kwargs)
+        read_span["rows_in"] = len(gdf_)
+    if schema is not None:
+        gdf_ = apply_schema(gdf_, schema, data_name=os.path.basename(file))
+    return gdf_
+
+
+def read_df(file, columns=None, schema=None):
+    """
+    Read the attributes of a GeoParquet (.parquet), GeoPackage (.gpkg), or shapefile (.shp)
+    without the geometry.
+    Parameters
+    ----------
+    file: str
+        Path to the file.
+    columns: list
+        Columns to read. All columns except the geometry if None.
+    schema: dict
+        Compact data types to apply after reading (e.g. SEGMENT_SCHEMA). Not applied if None.
+    Returns
+    -------
+    pd.DataFrame()
+    """
+    with span("read") as read_span:
+        if os.path.splitext(file)[1].lower() == ".parquet":
+            if columns is None:
+                columns = [col for col in pq.read_schema(file).names if col != "geometry"]
+            df_ = pd.read_parquet(file, columns=columns)
+        else:
+            df_ = pyogrio.read_dataframe(file, columns=columns, read_geometry=False, use_arrow=True)
+        read_span["rows_in"] = len(df_)
+    if schema is not None:
+        df_ = apply_schema(df_, schema, data_name=os.path.basename(file))
+    return df_
+
+
+def read_geometry(file, key):
+    """
+    Read the geometry of a GeoParquet (.parquet), GeoPackage (.gpkg), or shapefile (.shp) as a
+    side table keyed by an integer segment ID column.
+    Parameters
+    ----------
+    file: str
+        Path to the file.
+    key: str
+        Segment ID column (e.g. "aadt_seg_id").
+    Returns
+    -------
+    gpd.GeoSeries()
+        Geometry indexed by the segment ID.
+    """
+    # The rows are counted when the attributes are read.
+    with span("read"):
+        if os.path.splitext(file)[1].lower() == ".parquet":
+            gdf_ = gpd.read_parquet(file, columns=[key, "geometry"])
+        else:
+            gdf_ = pyogrio.read_dataframe(file, columns=[key], use_arrow=True)
+    return gdf_.set_index(key).geometry
+
+
+def attach_geometry(df, geometry_, key):
+    """
+    Attach the geometry from a side table (see read_geometry) to attribute data.
+    Parameters
+    ----------
+    df: pd.DataFrame()
+        Attribute data with the segment ID column.
+    geometry_: gpd.GeoSeries()
+        Geometry indexed by the segment ID.
+    key: str
+        Segment ID column.
+    Returns
+    -------
+    gpd.GeoDataFrame()
+        df with a "geometry" column.
+    """
+    return gpd.GeoDataFrame(
+        df, geometry=geometry_.reindex(df[key].values).values, crs=geometry_.crs
+    )
+
+
+def write_gdf(gdf, file):
+    """
+    Write a GeoDataFrame to a GeoParquet (.parquet), GeoPackage (.gpkg), or shapefile (.shp)
+    based on the file extension. The geometry column is named "geometry" and the index is
+    not written, so the data reads back the same way from every format. Categorical columns
+    are kept in GeoParquet and written as their values to the other formats.
+    Parameters
+    ----------
+    gdf: gpd.GeoDataFrame()
+        Data to write.
+    file: str
+        Path to the file.
+    """
+    ext = os.path.splitext(file)[1].lower()
+    if ext != ".parquet" and ext not in GDF_FILE_DRIVERS:
+        raise ValueError(f"Unsupported file type {ext} for {file}.")
+    with span("write") as write_span:
+        if ext == ".parquet":
+            if gdf.geometry.name != "geometry":
+                gdf = gdf.rename_geometry("geometry")
+            gdf.to_parquet(file, index=False)
+        else:
+            cat_cols = gdf.select_dtypes("category").columns
+            if len(cat_cols) != 0:
+                gdf = gdf.assign(**{col: np.asarray(gdf[col]) for col in cat_cols})
+            gdf.to_file(file, driver=GDF_FILE_DRIVERS[ext])
+        write_span["rows_out"] = len(gdf)
+
+
+def get_geoparquet_writer(file, schema, crs):
+    """
+    Open a GeoParquet writer with WKB geometry in the "geometry" column. The GeoParquet metadata
+    has no bounding box, which is only known after the last batch. Columns that are all missing
+    have no type in Arrow, so later batches with values could not be cast to it. They are
+    written as strings.
+    """
+    geo_metadata = {
+        "primary_column": "geometry",
+        "columns": {
+            "geometry": {
+                "encoding": "WKB",
+                "crs": None if crs is None else crs.to_json_dict(),
+            }
+        },
+        "version": "0.4.0",
+    }
+    schema = pa.schema(
+        [field.with_type(pa.string()) if pa.types.is_null(field.type) else field for field in schema],
+        metadata={**schema.metadata, b"geo": json.dumps(geo_metadata).encode()},
+    )
+    return pq.ParquetWriter(file, schema)
+
+
+def write_gdf_batches(gdf_batches, file):
+    """
+    Write batches of rows to one GeoParquet (.parquet), GeoPackage (.gpkg), or shapefile (.shp),
+    so that only one batch is in memory at a time. As in write_gdf, the geometry column is
+    named "geometry" and the index is not written. Categorical columns are written as their
+    values, because the batches can have different categories. The column types are set by the
+    first batch with rows, so an empty file is written if all the batches are empty. If there
+    is no batch, the previous file is removed.
+    Parameters
+    ----------
+    gdf_batches: iterable
+        gpd.GeoDataFrame() batches with the same columns and CRS.
+    file: str
+        Path to the file.
+    Returns
+    -------
+    n_rows: int
+        Number of rows written.
+    """
+    ext = os.path.splitext(file)[1].lower()
+    if ext != ".parquet" and ext not in GDF_FILE_DRIVERS:
+        raise ValueError(f"Unsupported file type {ext} for {file}.")
+    n_rows = 0
+    empty_batch = None
+    parquet_writer = None
+    try:
+        for gdf in gdf_batches:
+            with span("write") as write_span:
+                if gdf.geometry.name != "geometry":
+                    gdf = gdf.rename_geometry("geometry")
+                cat_cols = gdf.select_dtypes("category").columns
+                if len(cat_cols) != 0:
+                    gdf = gdf.assign(**{col: np.asarray(gdf[col]) for col in cat_cols})
+                write_span["rows_out"] = len(gdf)
+                if len(gdf) == 0 and n_rows == 0:
+                    # Empty batches only set the column types if all the batches are empty.
+                    empty_batch = gdf
+                    continue
+                if ext == ".parquet":
+                    table = pa.Table.from_pandas(
+                        pd.DataFrame(gdf.drop(columns="geometry")).assign(
+                            geometry=shapely.to_wkb(gdf.geometry.values.data)
+                        ),
+                        preserve_index=False,
+                    )
+                    if parquet_writer is None:
+                        parquet_writer = get_geoparquet_writer(file, table.schema, gdf.crs)
+                    # Columns that are all missing in a batch are cast to the type of the first batch.
+                    parquet_writer.write_table(table.cast(parquet_writer.schema))
+                else:
+                    pyogrio.write_dataframe(gdf, file, driver=GDF_FILE_DRIVERS[ext], append=n_rows != 0)
+            n_rows += len(gdf)
+    finally:
+        if parquet_writer is not None:
+            parquet_writer.close()
+    if n_rows == 0:
+        for dataset_file in get_dataset_files(file):
+            os.remove(dataset_file)
+        if empty_batch is not None:
+            write_gdf(empty_batch, file)
+    return n_rows
+
+
+def get_dataset_files(path):
+    """
+    Get the files that make up a dataset. A shapefile is stored in several files with the
+    same name and different extensions.
+    Parameters
+    ----------
+    path: str
+        Path to the dataset.
+    Returns
+    -------
+    list
+        Paths to the existing files of the dataset.
+    """
+    stem, ext = os.path.splitext(path)
+    if ext.lower() == ".shp":
+        return [stem + sidecar_ext for sidecar_ext in SHAPEFILE_SIDECAR_EXTENSIONS if os.path.isfile(stem + sidecar_ext)]
+    return [path] if os.path.isfile(path) else []
+
+
+def hash_file(file, chunk_size=2 ** 20):
+    """
+    Compute the SHA-256 hash of the file content.
+    """
+    file_hash = hashlib.sha256()
+    with open(file, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            file_hash.update(chunk)
+    return file_hash.hexdigest()
+
+
+def get_file_fingerprint(file, prev_fingerprint_=None):
+    """
+    Fingerprint a file with its size, modification time, and content hash. The content hash
+    is only recomputed if the size or modification time changed since prev_fingerprint_.
+    Parameters
+    ----------
+    file: str
+        Path to the file.
+    prev_fingerprint_: dict
+        Fingerprint of the file from the last run.
+    Returns
+    -------
+    dict
+        Fingerprint with the keys "size", "mtime_ns", and "sha256".
+    """
+    stat = os.stat(file)
+    if (
+        prev_fingerprint_ is not None
+        and prev_fingerprint_["size"] == stat.st_size
+        and prev_fingerprint_["mtime_ns"] == stat.st_mtime_ns
+    ):
+        return prev_fingerprint_
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": hash_file(file)}
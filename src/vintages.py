@@ -0,0 +1,152 @@
+"""
+Batch mode for several data vintages (AADT year and Section Safety Scores window, see
+DataConfig.VINTAGES). The AADT geometry and route decoding are shared by all vintages and
+done once, and the AADT and crash merge (step 3) and incident factor scaling (step 7) are
+run for each vintage. The results are written as a long-format panel keyed by vintage.
+"""
+import os
+import pandas as pd
+from src.utils import get_project_root, write_gdf
+from src.run_report import span
+from src.s1_aadt import clean_aadt
+from src.s2_crash import clean_crash
+from src.s3_aadt_crash_merge import merge_aadt_crash
+from src.s7_if_si_calc import get_incident_factor_scaled
+from Config import DataConfig, DevConfig
+
+
+def get_vintage_aadt_fields(vintages):
+    """
+    Map the AADT and AADTT columns of each vintage ("aadt_val_<name>" and
+    "aadtt_val_<name>") to the raw AADT fields (see src.s1_aadt.clean_aadt).
+    """
+    aadt_fields_ = {}
+    for vintage in vintages:
+        aadt_fields_[f"aadt_val_{vintage['name']}"] = vintage["field_aadt"]
+        aadt_fields_[f"aadtt_val_{vintage['name']}"] = vintage["field_aadtt"]
+    return aadt_fields_
+
+
+def get_vintage_aadt(aadt_df_, vintage_name, vintage_names):
+    """
+    Get the AADT data of one vintage from the AADT data with the columns of all vintages.
+    Parameters
+    ----------
+    aadt_df_: pd.DataFrame()
+        Cleaned AADT data with the "aadt_val_<name>" and "aadtt_val_<name>" columns of all
+        vintages.
+    vintage_name: str
+        Vintage to get.
+    vintage_names: list
+        Names of all vintages.
+    Returns
+    -------
+    pd.DataFrame()
+        AADT data with the "aadt_val" and "aadtt_val" columns of the vintage, as returned by
+        src.s1_aadt.clean_aadt for one vintage.
+    """
+    other_vintage_cols = [
+        f"{col}_{name}" for name in vintage_names if name != vintage_name for col in ("aadt_val", "aadtt_val")
+    ]
+    return aadt_df_.drop(columns=other_vintage_cols).rename(
+        columns={f"aadt_val_{vintage_name}": "aadt_val", f"aadtt_val_{vintage_name}": "aadtt_val"}
+    )
+
+
+def get_vintage_panel(aadt_df_, crash_df_dict_, vintages, n_workers=1):
+    """
+    Merge the AADT and crash data and scale the incident factor for each vintage.
+    Parameters
+    ----------
+    aadt_df_: pd.DataFrame()
+        Cleaned AADT data without geometry, with the columns of all vintages (see
+        get_vintage_aadt).
+    crash_df_dict_: dict
+        Cleaned crash data without geometry for each safety scores window.
+    vintages: list
+        Vintages (see DataConfig.VINTAGES).
+    n_workers: int
+        Number of worker processes for the AADT and crash merge.
+    Returns
+    -------
+    vintage_panel_: pd.DataFrame()
+        One row for each vintage and AADT interval, with the "vintage" column and the
+        columns of the step 7 output (src.s7_if_si_calc.get_incident_factor_scaled).
+    """
+    vintage_names = [vintage["name"] for vintage in vintages]
+    inc_fac_si_list = []
+    for vintage in vintages:
+        print(f"Processing vintage {vintage['name']}")
+        aadt_df_vintage = get_vintage_aadt(aadt_df_, vintage["name"], vintage_names)
+        aadt_crash_df, _ = merge_aadt_crash(
+            aadt_gdf_=aadt_df_vintage,
+            crash_gdf_=crash_df_dict_[vintage["dir_safety_scores"]],
+            quiet=True,
+            n_workers=n_workers,
+        )
+        inc_fac_si = get_incident_factor_scaled(aadt_crash_df)["inc_fac_si"]
+        inc_fac_si.insert(0, "vintage", vintage["name"])
+        inc_fac_si_list.append(inc_fac_si)
+    vintage_panel_ = pd.concat(inc_fac_si_list, ignore_index=True).assign(
+        vintage=lambda df: pd.Categorical(df.vintage, categories=vintage_names)
+    )
+    return vintage_panel_
+
+
+def run_vintages(vintages=DataConfig.VINTAGES, n_workers=DevConfig.N_WORKERS_AADT_CRASH_MERGE):
+    """
+    Run steps 1, 2, 3, and 7 for several vintages and write the vintage panel to
+    data/2_processed/vintage_panel.parquet and the shared AADT segment geometry, keyed by
+    aadt_seg_id, to data/2_processed/vintage_segments.parquet.
+    Parameters
+    ----------
+    vintages: list
+        Vintages (see DataConfig.VINTAGES).
+    n_workers: int
+        Number of worker processes for the AADT and crash merge.
+    Returns
+    -------
+    vintage_panel: pd.DataFrame()
+        See get_vintage_panel.
+    """
+    vintage_names = [vintage["name"] for vintage in vintages]
+    if len(set(vintage_names)) != len(vintage_names):
+        raise ValueError(f"Vintage names are not unique: {vintage_names}")
+    path_to_prj_dir = get_project_root()
+    path_to_raw = os.path.join(path_to_prj_dir, DevConfig.DIR_NAME_DATA, DevConfig.DIR_NAME_RAW)
+    path_processed_data = os.path.join(path_to_prj_dir, DevConfig.DIR_NAME_DATA, DevConfig.DIR_NAME_PROCESSED)
+    if not os.path.isdir(path_processed_data):
+        os.makedirs(path_processed_data)
+    # Read the AADT data once with the AADT fields of all vintages.
+    aadt_file = os.path.join(path_to_raw, DataConfig.DIR_AADT_SEGMENTS, DataConfig.SHAPEFILE_AADT)
+    aadt_gdf = clean_aadt(aadt_file, aadt_fields=get_vintage_aadt_fields(vintages))
+    aadt_df = pd.DataFrame(aadt_gdf.drop(columns="geometry")).query("route_class in [1, 2, 3]")
+    # Read each safety scores window once. The crash geometry is not used.
+    crash_df_dict = {}
+    for vintage in vintages:
+        if vintage["dir_safety_scores"] in crash_df_dict:
+            continue
+        crash_file = os.path.join(path_to_raw, vintage["dir_safety_scores"], vintage["shapefile_safety"])
+        crash_si = clean_crash(
+            crash_file,
+            field_gis_route=vintage.get("field_gis_route", DataConfig.FIELD_GIS_ROUTE),
+            field_total_cnt=vintage.get("field_total_cnt", DataConfig.FIELD_TOTAL_CNT),
+            read_geometry=False,
+        )
+        crash_df_dict[vintage["dir_safety_scores"]] = (
+            crash_si["crash_df_fil_si"].query("route_class in [1, 2, 3]").sort_values(["route_key", "st_mp_pt"])
+        )
+    vintage_panel = get_vintage_panel(aadt_df, crash_df_dict, vintages, n_workers=n_workers)
+    # Write the panel without geometry and the geometry of the segments once.
+    with span("write") as write_span:
+        vintage_panel.to_parquet(
+            os.path.join(path_processed_data, DevConfig.PROCESSED_PARQUET_VINTAGE_PANEL), index=False
+        )
+        write_span["rows_out"] = len(vintage_panel)
+    write_gdf(
+        aadt_gdf.filter(items=["aadt_seg_id", "route_id", "route_key", "geometry"]).loc[
+            lambda df: df.aadt_seg_id.isin(vintage_panel.aadt_seg_id)
+        ],
+        os.path.join(path_processed_data, DevConfig.PROCESSED_PARQUET_VINTAGE_SEGMENTS),
+    )
+    return vintage_panel
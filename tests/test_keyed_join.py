@@ -0,0 +1,112 @@
+import numpy as np
+import pandas as pd
+import pytest
+from src.diagnostics import get_diagnostics, reset_diagnostics
+from src.keyed_join import join_side_tables
+
+ROUTE_A = 20000001080
+ROUTE_B = 30000002090
+ROUTE_C = 40000003100
+
+
+@pytest.fixture(autouse=True)
+def clear_diagnostics():
+    reset_diagnostics()
+    yield
+    reset_diagnostics()
+
+
+def get_base_df():
+    return pd.DataFrame({
+        "route_key": [ROUTE_A, ROUTE_A, ROUTE_B],
+        "aadt_interval_left": [0.0, 1.0, 0.0],
+        "aadt_interval_right": [1.0, 3.0, 2.0],
+    })
+
+
+def get_issue_rows(issue):
+    diagnostics_df = get_diagnostics()
+    return diagnostics_df.loc[diagnostics_df.issue == issue].row_idx.tolist()
+
+
+def test_nearest_within_tolerance():
+    side_df = pd.DataFrame({
+        "route_key": [ROUTE_A, ROUTE_A, ROUTE_B],
+        "aadt_interval_left": [0.0004, 1.0006, 0.0],
+        "score": [1.0, 2.0, 3.0],
+    })
+    joined_df = join_side_tables(get_base_df(), {"side": side_df}, tolerance=0.0005)
+    # 0.0004 is within the tolerance of 0.0, 1.0006 is outside the tolerance of 1.0.
+    assert joined_df.score.tolist()[0] == 1.0
+    assert np.isnan(joined_df.score.values[1])
+    assert joined_df.score.tolist()[2] == 3.0
+    assert get_issue_rows("unmatched_join_key_side") == [1]
+
+
+def test_backward_within_tolerance():
+    side_df = pd.DataFrame({
+        "route_key": [ROUTE_A, ROUTE_A],
+        "aadt_interval_left": [-0.0004, 1.0001],
+        "score": [1.0, 2.0],
+    })
+    joined_df = join_side_tables(
+        get_base_df(), {"side": side_df}, tolerance=0.0005, join_options={"side": {"method": "backward"}}
+    )
+    # A side row just after the base milepost is not matched backward, even within the tolerance.
+    assert joined_df.score.tolist()[0] == 1.0
+    assert np.isnan(joined_df.score.values[1:]).all()
+    assert get_issue_rows("unmatched_join_key_side") == [1]
+
+
+def test_duplicated_and_unmatched_keys():
+    side_df = pd.DataFrame({
+        "route_key": [ROUTE_A, ROUTE_A, ROUTE_A, ROUTE_C],
+        "aadt_interval_left": [0.0, 0.0, 5.0, 0.0],
+        "score": [1.0, 9.0, 2.0, 3.0],
+    }, index=[10, 11, 12, 13])
+    joined_df = join_side_tables(get_base_df(), {"side": side_df})
+    # One row per base row: the first of the duplicated side keys is used, instead of one row
+    # for each duplicate as with pd.merge.
+    assert len(joined_df) == 3
+    assert joined_df.score.tolist()[0] == 1.0
+    assert get_issue_rows("duplicate_join_key_side") == [11]
+    # Side rows on a route of the base table that don't match are reported, other routes are not.
+    assert get_issue_rows("unmatched_join_key_side") == [12]
+
+
+def test_route_key_only():
+    side_df = pd.DataFrame({"route_key": [ROUTE_B, ROUTE_A], "nat_imp": ["stc", "nhs"]})
+    joined_df = join_side_tables(get_base_df(), {"nhs_stc": side_df})
+    assert joined_df.nat_imp.tolist() == ["nhs", "nhs", "stc"]
+
+
+def test_overlap_weighted_values():
+    side_df = pd.DataFrame({
+        "route_key": [ROUTE_A, ROUTE_A, ROUTE_A, ROUTE_B],
+        "aadt_interval_left": [0.0, 0.5, 2.0, 1.0],
+        "end_mp": [0.5, 2.0, np.nan, 1.5],
+        "score": [10.0, 20.0, 40.0, np.nan],
+    })
+    joined_df = join_side_tables(
+        get_base_df(), {"side": side_df}, join_options={"side": {"method": "overlap", "end_key": "end_mp"}}
+    )
+    # [0, 1): 0.5 mi of 10 and 0.5 mi of 20. [1, 3): 1 mi of 20 and 1 mi of the open-ended 40.
+    # Route B only overlaps a missing value.
+    assert joined_df.score.tolist()[:2] == [15.0, 30.0]
+    assert np.isnan(joined_df.score.values[2])
+    assert "end_mp" not in joined_df.columns
+
+
+def test_overlap_weighted_values_no_overlap():
+    side_df = pd.DataFrame({
+        "route_key": [ROUTE_A, ROUTE_A],
+        "aadt_interval_left": [3.0, 3.5],
+        "end_mp": [3.5, 3.5],
+        "score": [1.0, 2.0],
+    })
+    joined_df = join_side_tables(
+        get_base_df(), {"side": side_df}, join_options={"side": {"method": "overlap", "end_key": "end_mp"}}
+    )
+    # A side interval that starts at the end of a base interval and a zero-length one don't overlap.
+    assert np.isnan(joined_df.score.values).all()
+    assert get_issue_rows("unmatched_join_key_side") == [0, 1]
@@ -0,0 +1,72 @@
+import numpy as np
+import pandas as pd
+from src.lrs import interval_join
+
+
+def brute_force_pairs(left_start, left_end, right_start, right_end, left_key, right_key):
+    """
+    Overlapping pairs of left-closed intervals on the same route, with pd.Interval.overlaps.
+    """
+    return {
+        (i, j)
+        for i in range(len(left_start))
+        for j in range(len(right_start))
+        if left_key[i] == right_key[j]
+        and pd.Interval(left_start[i], left_end[i], closed="left").overlaps(
+            pd.Interval(right_start[j], right_end[j], closed="left")
+        )
+    }
+
+
+def test_interval_join_touching_intervals_do_not_overlap():
+    pairs = interval_join([0, 1], [1, 2], [1], [2])
+    assert pairs[["left_idx", "right_idx"]].values.tolist() == [[1, 0]]
+
+
+def test_interval_join_zero_length_intervals():
+    # A zero-length interval overlaps an interval that contains it, but not one that starts at
+    # the same milepost, as with pd.Interval.overlaps.
+    pairs = interval_join([1, 1], [1, 1], [0, 1], [2, 2])
+    assert pairs[["left_idx", "right_idx"]].values.tolist() == [[0, 0], [1, 0]]
+    assert pairs[["overlap_start", "overlap_end"]].values.tolist() == [[1, 1], [1, 1]]
+
+
+def test_interval_join_overlapping_right_intervals():
+    # The long right interval ends after the short one that starts later, so the running max
+    # of the end milepost must not skip it.
+    pairs = interval_join([4], [5], [0, 1, 3], [10, 2, 6])
+    assert pairs[["left_idx", "right_idx"]].values.tolist() == [[0, 0], [0, 2]]
+    assert pairs[["overlap_start", "overlap_end"]].values.tolist() == [[4, 5], [4, 5]]
+
+
+def test_interval_join_no_overlap():
+    assert len(interval_join([5], [6], [0, 7], [1, 8])) == 0
+    pairs = interval_join([5, 0], [6, 1], [0], [1], how="left")
+    assert pairs.left_idx.tolist() == [0, 1]
+    assert pairs.right_idx.tolist() == [-1, 0]
+    assert np.isnan(pairs.overlap_start.values[0]) and np.isnan(pairs.overlap_end.values[0])
+
+
+def test_interval_join_keys():
+    pairs = interval_join([0, 0], [1, 1], [0, 0], [1, 1], left_key=[1, 2], right_key=[2, 3])
+    assert pairs[["left_idx", "right_idx"]].values.tolist() == [[1, 0]]
+
+
+def test_interval_join_matches_brute_force():
+    rng = np.random.default_rng(0)
+    n_left, n_right = 60, 40
+    left_start = rng.integers(0, 20, n_left).astype(float)
+    left_end = left_start + rng.integers(0, 4, n_left)
+    right_start = rng.integers(0, 20, n_right).astype(float)
+    right_end = right_start + rng.integers(0, 6, n_right)
+    left_key = rng.integers(0, 3, n_left)
+    right_key = rng.integers(0, 3, n_right)
+    pairs = interval_join(left_start, left_end, right_start, right_end, left_key=left_key, right_key=right_key)
+    assert set(zip(pairs.left_idx, pairs.right_idx)) == brute_force_pairs(
+        left_start, left_end, right_start, right_end, left_key, right_key
+    )
+    assert len(pairs) == len(set(zip(pairs.left_idx, pairs.right_idx)))
+    assert np.array_equal(
+        pairs.overlap_start.values, np.maximum(left_start[pairs.left_idx], right_start[pairs.right_idx])
+    )
+    assert np.array_equal(pairs.overlap_end.values, np.minimum(left_end[pairs.left_idx], right_end[pairs.right_idx]))
@@ -0,0 +1,79 @@
+import numpy as np
+import shapely
+from src.s9_vector_tiles import encode_tile, get_tile_bounds, MVT_COMMAND_MOVE_TO, MVT_COMMAND_LINE_TO
+
+
+def decode_varint(data, pos):
+    value, shift = 0, 0
+    while True:
+        byte = data[pos]
+        value |= (byte & 0x7F) << shift
+        pos += 1
+        shift += 7
+        if byte < 0x80:
+            return value, pos
+
+
+def decode_fields(data):
+    """
+    (field, value) of each protocol buffers field: int for varints, bytes for length delimited
+    fields. 64-bit fields are returned as bytes.
+    """
+    fields, pos = [], 0
+    while pos < len(data):
+        key, pos = decode_varint(data, pos)
+        field, wire_type = key >> 3, key & 7
+        if wire_type == 0:
+            value, pos = decode_varint(data, pos)
+        elif wire_type == 1:
+            value, pos = data[pos:pos + 8], pos + 8
+        else:
+            length, pos = decode_varint(data, pos)
+            value, pos = data[pos:pos + length], pos + length
+        fields.append((field, value))
+    return fields
+
+
+def decode_packed(data):
+    values, pos = [], 0
+    while pos < len(data):
+        value, pos = decode_varint(data, pos)
+        values.append(value)
+    return values
+
+
+def decode_lines(commands):
+    """
+    Lines in tile coordinates of the MVT geometry commands of a feature.
+    """
+    lines, cursor, pos = [], np.zeros(2, dtype=np.int64), 0
+    while pos < len(commands):
+        command, count = commands[pos] & 7, commands[pos] >> 3
+        pos += 1
+        for _ in range(count):
+            cursor = cursor + [(value >> 1) ^ -(value & 1) for value in commands[pos:pos + 2]]
+            pos += 2
+            if command == MVT_COMMAND_MOVE_TO:
+                lines.append([cursor.tolist()])
+            else:
+                assert command == MVT_COMMAND_LINE_TO
+                lines[-1].append(cursor.tolist())
+    return lines
+
+
+def test_encode_tile_multi_part_line():
+    tile_bounds = get_tile_bounds(0, 0, 0)
+    xmin, _, xmax, ymax = tile_bounds
+    tile_size = xmax - xmin
+    lines = [[[100, 200], [300, 250], [400, 400]], [[1000, 3000], [1200, 2800]]]
+    geometry = shapely.MultiLineString([
+        [(xmin + x / 4096 * tile_size, ymax - y / 4096 * tile_size) for x, y in line] for line in lines
+    ])
+    tile = encode_tile([(7, geometry, {"inc_fac": 0.5})], tile_bounds)
+    (layer_field, layer), = decode_fields(tile)
+    assert layer_field == 3
+    features = [value for field, value in decode_fields(layer) if field == 2]
+    assert len(features) == 1
+    feature = dict(decode_fields(features[0]))
+    assert feature[1] == 7
+    assert decode_lines(decode_packed(feature[4])) == lines